@@ -0,0 +1,297 @@
+"""
+Benchmark the graph build cost of the Ubuntu model components.
+
+Synthetic graphs of Ubuntu servers are built using the model component objects
+from this repository and lightweight stand-ins for ``base_objects``
+(see ``stand_ins.py``). For each image and graph size, the following phases
+are timed across all VMs:
+
+* ``__init__``: Decorating the vertex with the image's model component.
+* ``configure_ips``: Scheduling the IP configuration (or ``configure_all_ips``,
+  configuring every VM with a single call, with ``--bulk-ips``).
+* ``add_default_profiles``: Scheduling the default user/root profiles.
+* ``install_debs``: Scheduling a package install.
+* ``get_schedule``: Resolving the schedule (e.g. rendering callable content).
+
+The throughput (VMs per second) of each phase is reported along with the peak
+memory allocated while it ran (measured in a separate, traced, run since
+:py:mod:`tracemalloc` slows down the code being measured).
+
+Examples:
+    Run all images at every size::
+
+        $ python benchmarks/bench_graph_build.py
+
+    Only run the smaller graphs and save the results::
+
+        $ python benchmarks/bench_graph_build.py --sizes 100 1000 --json results.json
+"""
+
+import gc
+import sys
+import json
+import time
+import types
+import argparse
+import tracemalloc
+import importlib.util
+from pathlib import Path
+
+import stand_ins
+
+from firewheel.control.experiment_graph import Vertex, ExperimentGraph
+
+REPO_PATH = Path(__file__).resolve().parent.parent / "src" / "firewheel_repo_linux"
+
+# The model component objects needed by the benchmarks (in dependency order)
+MODEL_COMPONENTS = (
+    ("linux.base_objects", "linux"),
+    ("linux.ubuntu", "ubuntu/ubuntu"),
+    ("linux.ubuntu2204", "ubuntu/jammy"),
+    ("linux.ubuntu1804", "ubuntu/bionic"),
+    ("linux.ubuntu1404", "ubuntu/trusty"),
+)
+
+IMAGES = {
+    "Ubuntu2204Server": "linux.ubuntu2204",
+    "Ubuntu1804Server": "linux.ubuntu1804",
+    "Ubuntu1404Server": "linux.ubuntu1404",
+}
+
+SIZES = (100, 1000, 10000)
+
+# The number of VMs which share a switch (and therefore a /24 network)
+HOSTS_PER_SWITCH = 250
+
+# The phases which are applied to all VMs at once (rather than to each VM)
+BULK_PHASES = {"configure_all_ips"}
+
+
+def load_model_components():
+    """
+    Import the model component objects of this repository by their MC names,
+    using the stand-ins in place of ``base_objects``.
+
+    Returns:
+        dict: A mapping of MC name to the loaded module.
+    """
+    sys.modules["base_objects"] = stand_ins
+    sys.modules.setdefault("linux", types.ModuleType("linux"))
+
+    modules = {}
+    for name, path in MODEL_COMPONENTS:
+        spec = importlib.util.spec_from_file_location(
+            name, REPO_PATH / path / "model_component_objects.py"
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        modules[name] = module
+    return modules
+
+
+def create_vertices(graph, count, boot_bundle=False):
+    """
+    Create the (undecorated) VM vertices.
+
+    Arguments:
+        graph (firewheel.control.experiment_graph.ExperimentGraph): The graph.
+        count (int): The number of vertices to create.
+        boot_bundle (bool or str): The ``boot_bundle`` mode of the VMs.
+
+    Returns:
+        list: The new vertices.
+    """
+    vertices = []
+    for i in range(count):
+        vert = Vertex(graph, f"host-{i}")
+        if boot_bundle:
+            vert.boot_bundle = boot_bundle
+        vertices.append(vert)
+    return vertices
+
+
+def connect_vertices(graph, vertices):
+    """
+    Connect every VM to a switch, assigning addresses and MAC addresses in the
+    same way that later model components would.
+
+    Arguments:
+        graph (firewheel.control.experiment_graph.ExperimentGraph): The graph.
+        vertices (list): The decorated VM vertices.
+    """
+    switch = None
+    for i, vert in enumerate(vertices):
+        subnet, host = divmod(i, HOSTS_PER_SWITCH)
+        if host == 0:
+            switch = Vertex(graph, f"switch-{subnet}")
+            switch.decorate(stand_ins.Switch)
+        network = f"10.{subnet // 256}.{subnet % 256}"
+        vert.connect(switch, f"{network}.{host + 2}", 24)
+        vert.interfaces.interfaces[-1]["mac"] = (
+            "02:00:{:02x}:{:02x}:{:02x}:{:02x}".format(*i.to_bytes(4, "big"))
+        )
+        vert.default_gateway = f"{network}.1"
+        vert.dns_nameservers = ["10.255.255.253", "10.255.255.254"]
+
+
+def run_case(
+    model_component, count, boot_bundle=False, trace_memory=False, bulk_ips=False
+):
+    """
+    Build a graph of ``count`` VMs and measure each phase.
+
+    Arguments:
+        model_component (type): The model component to decorate the VMs with.
+        count (int): The number of VMs.
+        boot_bundle (bool or str): The ``boot_bundle`` mode of the VMs.
+        trace_memory (bool): Measure the peak memory of each phase
+            rather than its duration.
+        bulk_ips (bool): Configure the IP addresses of every VM with a single
+            call to ``linux.base_objects.configure_all_ips``.
+
+    Returns:
+        dict: A mapping of phase name to its duration (in seconds) or
+        peak memory (in bytes).
+    """
+    graph = ExperimentGraph()
+    vertices = create_vertices(graph, count, boot_bundle)
+
+    configure_ips = ("configure_ips", lambda vert: vert.configure_ips())
+    if bulk_ips:
+        base_objects = sys.modules["linux.base_objects"]
+        configure_ips = ("configure_all_ips", base_objects.configure_all_ips)
+
+    phases = (
+        ("__init__", lambda vert: vert.decorate(model_component)),
+        ("connect", None),
+        configure_ips,
+        ("add_default_profiles", lambda vert: vert.add_default_profiles()),
+        ("install_debs", lambda vert: vert.install_debs(-100, "benchmark.tgz")),
+        ("get_schedule", lambda vert: vert.vm_resource_schedule.get_schedule()),
+    )
+
+    results = {}
+    for phase, func in phases:
+        if func is None:
+            # The stand-ins are not being measured
+            connect_vertices(graph, vertices)
+            continue
+
+        gc.collect()
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        if phase in BULK_PHASES:
+            func(vertices)
+        else:
+            for vert in vertices:
+                func(vert)
+        elapsed = time.perf_counter() - start
+        if trace_memory:
+            results[phase] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            results[phase] = elapsed
+    return results
+
+
+def main(argv=None):
+    """
+    Run the benchmarks and print the results.
+
+    Arguments:
+        argv (list): The command line arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--images",
+        nargs="+",
+        choices=sorted(IMAGES),
+        default=list(IMAGES),
+        help="The model components to benchmark.",
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=list(SIZES),
+        help="The number of VMs in each graph.",
+    )
+    parser.add_argument(
+        "--boot-bundle",
+        nargs="?",
+        const=True,
+        default=False,
+        choices=["graph"],
+        help="Bundle the boot-time steps of each VM (see LinuxHost). "
+        "Pass 'graph' to run them as a dependency graph.",
+    )
+    parser.add_argument(
+        "--bulk-ips",
+        action="store_true",
+        help="Configure the IP addresses of every VM with a single call "
+        "(see linux.base_objects.configure_all_ips).",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Skip measuring the peak memory of each phase.",
+    )
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    modules = load_model_components()
+
+    print(
+        f"{'image':<18} {'vms':>6} {'phase':<22} {'seconds':>9} {'VMs/s':>10}"
+        f" {'peak KiB':>10}"
+    )
+    results = []
+    for image in args.images:
+        model_component = getattr(modules[IMAGES[image]], image)
+        for count in args.sizes:
+            durations = run_case(
+                model_component, count, args.boot_bundle, bulk_ips=args.bulk_ips
+            )
+            peaks = {}
+            if not args.no_memory:
+                peaks = run_case(
+                    model_component,
+                    count,
+                    args.boot_bundle,
+                    trace_memory=True,
+                    bulk_ips=args.bulk_ips,
+                )
+            for phase, elapsed in durations.items():
+                result = {
+                    "image": image,
+                    "vms": count,
+                    "phase": phase,
+                    "seconds": elapsed,
+                    "vms_per_second": count / elapsed if elapsed else None,
+                    "peak_bytes": peaks.get(phase),
+                }
+                results.append(result)
+                throughput = (
+                    f"{result['vms_per_second']:>10.0f}"
+                    if result["vms_per_second"]
+                    else f"{'-':>10}"
+                )
+                peak = (
+                    f"{result['peak_bytes'] / 1024:>10.0f}"
+                    if result["peak_bytes"] is not None
+                    else f"{'-':>10}"
+                )
+                print(
+                    f"{image:<18} {count:>6} {phase:<22} {elapsed:>9.3f} {throughput}"
+                    f" {peak}"
+                )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f_hand:
+            json.dump(results, f_hand, indent=4)
+
+
+if __name__ == "__main__":
+    main()
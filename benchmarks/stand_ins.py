@@ -0,0 +1,285 @@
+"""
+Lightweight stand-ins for the ``base_objects`` model component.
+
+The benchmarks measure the cost of the Linux/Ubuntu model components themselves,
+so ``base_objects`` (from ``firewheel_repo_base``) is replaced with the minimal
+objects those model components rely on. The schedule entries which are created
+have the same layout as the ones created by the real ``VMEndpoint``.
+"""
+
+import netaddr
+
+from firewheel.control.experiment_graph import Edge
+from firewheel.vm_resource_manager.schedule_entry import ScheduleEntry
+
+
+class AbstractWindowsEndpoint:
+    """
+    Identify a Windows-based VM.
+    """
+
+    def __init__(self):
+        """Nothing to do here."""
+
+
+class AbstractUnixEndpoint:
+    """
+    Identify a Unix-based VM.
+    """
+
+    def __init__(self):
+        """Check for possible conflicts.
+
+        Raises:
+            TypeError: If the vertex is already decorated with
+                :py:class:`AbstractWindowsEndpoint`.
+        """
+        if self.is_decorated_by(AbstractWindowsEndpoint):
+            raise TypeError(
+                "AbstractWindowsEndpoint cannot be decorated with AbstractUnixEndpoint!"
+            )
+
+
+class Switch:
+    """
+    A switch which VMs can be connected to.
+    """
+
+    def __init__(self, name=None):
+        """Set the switch type and name.
+
+        Arguments:
+            name (str): The name of the switch.
+
+        Raises:
+            NameError: If the switch does not have a name.
+        """
+        self.type = "switch"
+        self.name = getattr(self, "name", name)
+        if self.name is None:
+            raise NameError("Name must be specified for switch!")
+
+
+class VmResourceSchedule:
+    """
+    The list of schedule entries for a VM.
+    """
+
+    def __init__(self):
+        """Create an empty schedule."""
+        self.schedule_list = []
+
+    def add_vm_resource(self, new_entry):
+        """Add a new schedule entry.
+
+        Arguments:
+            new_entry (ScheduleEntry): The new entry.
+        """
+        self.schedule_list.append(new_entry)
+
+    def get_schedule(self):
+        """Resolve any callable content and return the schedule.
+
+        Returns:
+            list: The full list of schedule entries.
+        """
+        for entry in self.schedule_list:
+            for data in entry.data:
+                if "content" in data and callable(data["content"]):
+                    data["content"] = data["content"]()
+        return self.schedule_list
+
+
+class Interfaces:
+    """
+    The network interfaces of a VM.
+    """
+
+    def __init__(self, prefix="eth"):
+        """Initialize the list of interfaces.
+
+        Arguments:
+            prefix (str): The default name of the interfaces.
+        """
+        self.interfaces = []
+        self.prefix = prefix
+        self.counter = 0
+
+    def add_interface(self, address, netmask, switch=None, control_network=False):
+        """Add a new interface.
+
+        Arguments:
+            address (str): The IP address of the interface.
+            netmask (int): The CIDR netmask of the interface.
+            switch (Switch): The switch the interface is connected to.
+            control_network (bool): Is this interface part of the control network.
+
+        Returns:
+            dict: The new interface dictionary.
+        """
+        address = netaddr.IPAddress(address)
+        interface = {
+            "name": f"{self.prefix}{self.counter}",
+            "address": address,
+            "netmask": netmask,
+            "network": netaddr.IPNetwork((address.value, netmask)),
+            "switch": switch,
+            "qos": {"loss": None, "delay": None, "rate": None},
+            "control_network": control_network,
+            "l2_connection": False,
+        }
+        if control_network:
+            self.interfaces.insert(0, interface)
+        else:
+            self.interfaces.append(interface)
+        self.counter += 1
+        return interface
+
+
+class VMEndpoint:
+    """
+    The base class for all VM-based model components.
+    """
+
+    def __init__(self, name=None):
+        """Initialize the VM attributes and an empty schedule.
+
+        Arguments:
+            name (str): The name of the VM.
+
+        Raises:
+            NameError: If the VM does not have a name.
+        """
+        self.name = getattr(self, "name", name)
+        if self.name is None:
+            raise NameError("VMEndpoint must have a name!")
+
+        self.vm = getattr(self, "vm", {})
+        self.type = getattr(self, "type", "host")
+        self.coschedule = getattr(self, "coschedule", -1)
+        self.vm_resource_schedule = VmResourceSchedule()
+
+    def set_image(self, image_name):
+        """Set the name of the VM's image.
+
+        Arguments:
+            image_name (str): A generic name for the VM's image.
+        """
+        self.vm["image"] = image_name
+
+    def _add_entry(self, start_time):
+        entry = ScheduleEntry(start_time)
+        self.vm_resource_schedule.add_vm_resource(entry)
+        return entry
+
+    def add_vm_resource(
+        self, start_time, vm_resource_name, dynamic_arg=None, static_arg=None
+    ):
+        """Schedule a VM resource.
+
+        Arguments:
+            start_time (int): The schedule time.
+            vm_resource_name (str): The name of the VM resource.
+            dynamic_arg (str): Content passed as the first argument.
+            static_arg (str): A file passed as the second argument.
+
+        Returns:
+            ScheduleEntry: The new schedule entry.
+        """
+        entry = self._add_entry(start_time)
+        entry.add_file(vm_resource_name, vm_resource_name, executable=True)
+        arguments = []
+        if dynamic_arg:
+            entry.add_content("dynamic", dynamic_arg)
+            arguments.append("dynamic")
+        else:
+            arguments.append("None")
+        if static_arg:
+            entry.add_file(static_arg, static_arg)
+            arguments.append(static_arg)
+        else:
+            arguments.append("None")
+        arguments.append("reboot")
+        entry.set_executable(vm_resource_name, arguments)
+        return entry
+
+    def drop_content(self, start_time, location, content, executable=False):
+        """Schedule content to be written to a file on the VM.
+
+        Arguments:
+            start_time (int): The schedule time.
+            location (str): The destination path on the VM.
+            content (str): The content (or a callable which returns it).
+            executable (bool): Mark the file as executable.
+
+        Returns:
+            ScheduleEntry: The new schedule entry.
+        """
+        entry = self._add_entry(start_time)
+        entry.set_executable("mv", f"preloaded_content {location}")
+        entry.add_content("preloaded_content", content, executable)
+        return entry
+
+    def drop_file(self, start_time, location, filename, executable=False):
+        """Schedule a file to be placed on the VM.
+
+        Arguments:
+            start_time (int): The schedule time.
+            location (str): The destination path on the VM.
+            filename (str): The name of the file to place.
+            executable (bool): Mark the file as executable.
+
+        Returns:
+            ScheduleEntry: The new schedule entry.
+        """
+        entry = self._add_entry(start_time)
+        entry.set_executable("mv", f"{filename} {location}")
+        entry.add_file(filename, filename, executable)
+        return entry
+
+    def run_executable(self, start_time, program, arguments=None, vm_resource=False):
+        """Schedule a program to run on the VM.
+
+        Arguments:
+            start_time (int): The schedule time.
+            program (str): The program to run.
+            arguments (str): The arguments for the program.
+            vm_resource (bool): Whether the program must be loaded onto the VM.
+
+        Returns:
+            ScheduleEntry: The new schedule entry.
+        """
+        entry = self._add_entry(start_time)
+        entry.set_executable(program, arguments)
+        if vm_resource:
+            entry.add_file(program, program, executable=True)
+        return entry
+
+    def connect(self, switch, ip, netmask, control_network=False):
+        """Connect the VM to a switch.
+
+        Arguments:
+            switch (Switch): The switch to connect to.
+            ip (str): The IP address of the new interface.
+            netmask (int): The CIDR netmask of the new interface.
+            control_network (bool): Is this connection to the control network.
+
+        Returns:
+            tuple: The name of the new interface and the new edge.
+
+        Raises:
+            TypeError: If the switch is not decorated by :py:class:`Switch`.
+        """
+        if not switch.is_decorated_by(Switch):
+            raise TypeError("switch parameter must be (decorated by) a Switch.")
+
+        try:
+            interfaces = self.interfaces
+        except AttributeError:
+            interfaces = self.interfaces = Interfaces()
+        interface = interfaces.add_interface(ip, netmask, switch, control_network)
+
+        edge = Edge(self, switch)
+        edge.dst_ip = interface["address"]
+        edge.dst_network = interface["network"]
+        return (interface["name"], edge)
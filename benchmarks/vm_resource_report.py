@@ -0,0 +1,227 @@
+"""
+Summarize the execution time of the Linux VM resources in an experiment.
+
+Each VM resource in the Linux model components appends a timing record to
+``/var/log/firewheel/vm_resources.jsonl`` on its VM. Once these files have been
+pulled off of the VMs (see ``LinuxHost.collect_vm_resource_timings``), this
+script combines the records of every VM into a single report. For each VM
+resource (and, separately, for each combination of OS and VM resource) the
+following are reported:
+
+* The number of runs and the number of failed runs (i.e. a non-zero exit code).
+* The mean, median, 95th percentile, and maximum duration (in seconds).
+* The total number of retries.
+
+The slowest individual runs are also listed, which helps to find the VMs (or
+images) which hold up an experiment.
+
+Examples:
+    Report on the records in the default transfer directory::
+
+        $ python benchmarks/vm_resource_report.py /tmp/firewheel/transfers
+
+    Save the report, including every record, as JSON::
+
+        $ python benchmarks/vm_resource_report.py /tmp/firewheel/transfers --json report.json
+"""
+
+import sys
+import json
+import argparse
+import importlib.util
+from pathlib import Path
+
+# The helper which the VM resources use to write their timing records
+VM_TIMING_PATH = (
+    Path(__file__).resolve().parent.parent
+    / "src"
+    / "firewheel_repo_linux"
+    / "linux"
+    / "vm_resources"
+    / "vm_timing.py"
+)
+
+
+def load_timing_log():
+    """
+    Get the location of the timing records on each VM from ``vm_timing.py``.
+
+    Returns:
+        pathlib.Path: The location of the records, relative to the root directory
+        (i.e. relative to the transfer directory of each VM).
+    """
+    spec = importlib.util.spec_from_file_location("vm_timing", VM_TIMING_PATH)
+    vm_timing = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(vm_timing)
+    return Path(vm_timing.TIMING_LOG).relative_to("/")
+
+
+# The location of the records on each VM (relative to its transfer directory)
+RECORDS_PATH = load_timing_log()
+
+
+def load_records(transfers):
+    """
+    Read the timing records of every VM.
+
+    Arguments:
+        transfers (pathlib.Path): The directory containing a directory for each VM
+            (i.e. the ``destination`` of the file transfer).
+
+    Returns:
+        list: The records, each with the name of its VM (``vm``) and its
+        ``duration`` added.
+    """
+    records = []
+    for path in sorted(transfers.glob(f"*/{RECORDS_PATH}")):
+        vm_name = path.relative_to(transfers).parts[0]
+        with path.open(encoding="utf-8") as f_hand:
+            for line in f_hand:
+                try:
+                    record = json.loads(line)
+                    record["duration"] = float(record["end"]) - float(record["start"])
+                except (ValueError, KeyError, TypeError):
+                    # A record may be truncated if the VM was stopped while writing it
+                    print(f"Skipping an invalid record in {path}", file=sys.stderr)
+                    continue
+                record["vm"] = vm_name
+                records.append(record)
+    return records
+
+
+def percentile(values, fraction):
+    """
+    Compute a percentile (using the nearest rank) of a list of sorted values.
+
+    Arguments:
+        values (list): The sorted values.
+        fraction (float): The percentile, between 0 and 1.
+
+    Returns:
+        float: The percentile.
+    """
+    index = max(0, min(len(values) - 1, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+def summarize(records, key):
+    """
+    Group the records and compute the statistics of each group.
+
+    Arguments:
+        records (list): The timing records.
+        key (callable): A function returning the group of a record.
+
+    Returns:
+        dict: The statistics of each group, sorted by total duration (longest first).
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(key(record), []).append(record)
+
+    summary = {}
+    for group, members in groups.items():
+        durations = sorted(record["duration"] for record in members)
+        summary[group] = {
+            "runs": len(members),
+            "failures": sum(1 for record in members if record.get("exit_code")),
+            "retries": sum(int(record.get("retries", 0)) for record in members),
+            "total": sum(durations),
+            "mean": sum(durations) / len(durations),
+            "p50": percentile(durations, 0.5),
+            "p95": percentile(durations, 0.95),
+            "max": durations[-1],
+        }
+    return dict(
+        sorted(summary.items(), key=lambda item: item[1]["total"], reverse=True)
+    )
+
+
+def print_table(title, summary):
+    """
+    Print the statistics of each group.
+
+    Arguments:
+        title (str): The name of the grouping.
+        summary (dict): The statistics of each group (see :py:func:`summarize`).
+    """
+    print(
+        f"{title:<48} {'runs':>7} {'failed':>7} {'retries':>8} "
+        f"{'mean (s)':>9} {'p50 (s)':>9} {'p95 (s)':>9} {'max (s)':>9}"
+    )
+    for group, stats in summary.items():
+        print(
+            f"{group:<48} {stats['runs']:>7} {stats['failures']:>7} "
+            f"{stats['retries']:>8} {stats['mean']:>9.2f} {stats['p50']:>9.2f} "
+            f"{stats['p95']:>9.2f} {stats['max']:>9.2f}"
+        )
+    print()
+
+
+def main(argv=None):
+    """
+    Print (and optionally save) the report.
+
+    Arguments:
+        argv (list): The command line arguments.
+
+    Returns:
+        int: The exit code (1 if no records were found).
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "transfers",
+        type=Path,
+        help="The directory to which the records of each VM were transferred.",
+    )
+    parser.add_argument(
+        "--slowest",
+        type=int,
+        default=10,
+        help="The number of slowest individual runs to list.",
+    )
+    parser.add_argument("--json", help="Also write the report to this JSON file.")
+    args = parser.parse_args(argv)
+
+    records = load_records(args.transfers)
+    if not records:
+        print(f"No timing records were found in {args.transfers}", file=sys.stderr)
+        return 1
+
+    by_resource = summarize(records, lambda record: record.get("resource", ""))
+    by_os = summarize(
+        records,
+        lambda record: f"{record.get('os') or 'unknown'}: {record.get('resource', '')}",
+    )
+    slowest = sorted(records, key=lambda record: record["duration"], reverse=True)
+    slowest = slowest[: args.slowest]
+
+    vm_count = len({record["vm"] for record in records})
+    print(f"{len(records)} VM resource runs on {vm_count} VMs\n")
+    print_table("VM resource", by_resource)
+    print_table("OS: VM resource", by_os)
+    print(f"{'Slowest runs':<48} {'duration (s)':>12} {'retries':>8} {'exit':>5}")
+    for record in slowest:
+        name = f"{record['vm']}: {record.get('cwd') or record.get('resource', '')}"
+        print(
+            f"{name:<48} {record['duration']:>12.2f} "
+            f"{int(record.get('retries', 0)):>8} {record.get('exit_code', ''):>5}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f_hand:
+            json.dump(
+                {
+                    "resources": by_resource,
+                    "os_resources": by_os,
+                    "slowest": slowest,
+                    "records": records,
+                },
+                f_hand,
+                indent=4,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
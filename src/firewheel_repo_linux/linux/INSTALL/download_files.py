@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+"""
+Download and verify the ``files`` of a model component's ``INSTALL``.
+
+This is run by ``download_files.yml`` (rather than looping over ``get_url``) so
+that all files are downloaded concurrently. Each file is:
+
+* Skipped if it is already present with the expected sha256 hash.
+* Linked from the artifact store, if another model component (or an earlier
+  install) already obtained it.
+* Copied from the local mirror directory, if one is provided and it holds the file
+  (either as ``<mirror>/<dest>`` or as ``<mirror>/<host>/<path of the URL>``,
+  i.e. the layout created by ``wget --mirror``).
+* Otherwise downloaded from its URL. Interrupted downloads are kept as
+  ``<dest>.part`` and resumed (using a HTTP range request) by the next run.
+
+The sha256 hash is computed while the file is being written, so files are never
+read a second time to verify them. A file is only moved into place once it has
+been verified.
+
+The artifact store is a content-addressed directory (``sha256/<hash>``) shared by
+all of the model components in this repository. Every verified file is added to
+it and each model component receives a hard link (or, across file systems, a
+reflink or copy) to the stored file, so identical files are only downloaded and
+stored once.
+
+The files are read (as JSON) from standard input and a JSON summary of the
+result is written to standard output.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import argparse
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 1024 * 1024
+
+# The number of seconds to wait for the server to respond
+TIMEOUT = 60
+
+
+class ChecksumError(Exception):
+    """The contents of a file do not match its expected sha256 hash."""
+
+
+def sha256_file(path):
+    """
+    Compute the sha256 hash of a file.
+
+    Arguments:
+        path (str): The path of the file.
+
+    Returns:
+        hashlib.sha256: The hash object (so that more data may be added to it).
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f_hand:
+        for chunk in iter(lambda: f_hand.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
+
+
+def copy_stream(source, f_hand, digest):
+    """
+    Copy a stream into a file, hashing the data as it is written.
+
+    Arguments:
+        source (io.BufferedIOBase): The stream to read.
+        f_hand (io.BufferedIOBase): The file to write.
+        digest (hashlib.sha256): The hash to update.
+    """
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+        f_hand.write(chunk)
+
+
+def verify(digest, expected, source):
+    """
+    Check a computed hash against the expected hash.
+
+    Arguments:
+        digest (hashlib.sha256): The computed hash.
+        expected (str): The expected (hex) sha256 hash.
+        source (str): A description of where the data came from.
+
+    Raises:
+        ChecksumError: If the hashes differ.
+    """
+    if digest.hexdigest() != expected.lower():
+        raise ChecksumError(
+            f"The sha256 hash of {source} is {digest.hexdigest()}, expected {expected}"
+        )
+
+
+def link_file(source, destination):
+    """
+    Atomically place a file at ``destination`` which shares the contents of ``source``.
+
+    A hard link is used when possible. Otherwise, the file is copied (as a reflink, if
+    the file system supports it).
+
+    Arguments:
+        source (str): The existing file.
+        destination (str): The path of the new file.
+    """
+    tmp_path = f"{destination}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        try:
+            subprocess.run(
+                ["cp", "--reflink=auto", "--preserve=timestamps", source, tmp_path],  # noqa: S607
+                check=True,
+                stderr=subprocess.DEVNULL,
+            )
+        except (OSError, subprocess.CalledProcessError):
+            shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+def store_path(store, sha256):
+    """
+    Get the path of a file in the artifact store.
+
+    Arguments:
+        store (str): The artifact store directory.
+        sha256 (str): The (hex) sha256 hash of the file.
+
+    Returns:
+        str: The path of the file in the artifact store.
+    """
+    return os.path.join(store, "sha256", sha256.lower())
+
+
+def mirror_candidates(mirror, entry):
+    """
+    Get the paths at which a file may be found in the mirror directory.
+
+    Arguments:
+        mirror (str): The mirror directory.
+        entry (dict): The file (from the ``files`` of the ``INSTALL``).
+
+    Returns:
+        list: The candidate paths.
+    """
+    url = urllib.parse.urlsplit(entry["url"])
+    return [
+        os.path.join(mirror, entry["dest"]),
+        os.path.join(mirror, url.netloc, url.path.lstrip("/")),
+    ]
+
+
+def copy_from_mirror(mirror, entry, path):
+    """
+    Copy a file from the mirror directory, if it is there with the expected hash.
+
+    Arguments:
+        mirror (str): The mirror directory.
+        entry (dict): The file (from the ``files`` of the ``INSTALL``).
+        path (str): The destination of the file.
+
+    Returns:
+        bool: :py:data:`True` if the file was copied, :py:data:`False` otherwise.
+    """
+    tmp_path = f"{path}.mirror"
+    for candidate in mirror_candidates(mirror, entry):
+        if not os.path.isfile(candidate):
+            continue
+        digest = hashlib.sha256()
+        with open(candidate, "rb") as source, open(tmp_path, "wb") as f_hand:
+            copy_stream(source, f_hand, digest)
+        try:
+            verify(digest, entry["sha256"], candidate)
+        except ChecksumError as exp:
+            print(f"Ignoring the mirrored file: {exp}", file=sys.stderr)
+            os.remove(tmp_path)
+            continue
+        shutil.copystat(candidate, tmp_path)
+        os.replace(tmp_path, path)
+        return True
+    return False
+
+
+def download(entry, path):
+    """
+    Download a file, resuming a previous partial download (if any).
+
+    Arguments:
+        entry (dict): The file (from the ``files`` of the ``INSTALL``).
+        path (str): The destination of the file.
+
+    Raises:
+        HTTPError: If the server responds with an error.
+        ChecksumError: If the downloaded file does not have the expected hash.
+    """
+    part_path = f"{path}.part"
+    request = urllib.request.Request(entry["url"])  # noqa: S310
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset:
+        request.add_header("Range", f"bytes={offset}-")
+
+    try:
+        response = urllib.request.urlopen(request, timeout=TIMEOUT)  # noqa: S310
+    except urllib.error.HTTPError as exp:
+        # The partial download is already complete (or is larger than the file)
+        if exp.code != 416 or not offset:
+            raise
+        try:
+            verify(sha256_file(part_path), entry["sha256"], entry["url"])
+        except ChecksumError:
+            os.remove(part_path)
+            raise
+        os.replace(part_path, path)
+        return
+
+    with response:
+        if response.status == 206:
+            digest = sha256_file(part_path)
+            mode = "ab"
+        else:
+            # The server does not support resuming downloads
+            digest = hashlib.sha256()
+            mode = "wb"
+        with open(part_path, mode) as f_hand:
+            copy_stream(response, f_hand, digest)
+
+    try:
+        verify(digest, entry["sha256"], entry["url"])
+    except ChecksumError:
+        # Never resume from corrupt data
+        os.remove(part_path)
+        raise
+    os.replace(part_path, path)
+
+
+def fetch(entry, download_dir, mirror=None, retries=3, store=None):
+    """
+    Ensure that a file is present with the expected hash (and is in the artifact
+    store).
+
+    Arguments:
+        entry (dict): The file (from the ``files`` of the ``INSTALL``).
+        download_dir (str): The directory containing the parent directories.
+        mirror (str): A local mirror directory, which is checked before the URL.
+        retries (int): The number of times a failed download is retried.
+        store (str): The artifact store directory.
+
+    Returns:
+        str: How the file was obtained (``present``, ``store``, ``mirror``, or
+        ``downloaded``).
+    """
+    path = os.path.join(download_dir, entry["parent"], entry["dest"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    stored = store_path(store, entry["sha256"]) if store else None
+    if stored and os.path.isfile(stored):
+        if os.path.isfile(path) and os.path.samefile(path, stored):
+            return "present"
+        link_file(stored, path)
+        return "store"
+
+    result = obtain(entry, path, mirror, retries)
+    if stored:
+        os.makedirs(os.path.dirname(stored), exist_ok=True)
+        link_file(path, stored)
+    return result
+
+
+def obtain(entry, path, mirror, retries):
+    """
+    Ensure that a file is present with the expected hash, without the artifact store.
+
+    Arguments:
+        entry (dict): The file (from the ``files`` of the ``INSTALL``).
+        path (str): The destination of the file.
+        mirror (str): A local mirror directory, which is checked before the URL.
+        retries (int): The number of times a failed download is retried.
+
+    Returns:
+        str: How the file was obtained (``present``, ``mirror``, or ``downloaded``).
+
+    Raises:
+        OSError: If the file could not be downloaded.
+        ChecksumError: If the downloaded file does not have the expected hash.
+    """
+    if os.path.isfile(path):
+        try:
+            verify(sha256_file(path), entry["sha256"], path)
+            return "present"
+        except ChecksumError:
+            pass
+
+    if mirror and copy_from_mirror(mirror, entry, path):
+        return "mirror"
+
+    for attempt in range(retries + 1):
+        try:
+            download(entry, path)
+            return "downloaded"
+        except (OSError, ChecksumError) as exp:
+            if attempt == retries:
+                raise
+            print(f"Retrying the download of {entry['url']} ({exp})", file=sys.stderr)
+            time.sleep(2**attempt)
+
+
+def main():
+    """Download the files read from standard input."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "download_dir", help="The directory containing the parent directories."
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=8, help="The number of concurrent downloads."
+    )
+    parser.add_argument(
+        "--mirror", default="", help="A local directory to copy files from."
+    )
+    parser.add_argument("--store", default="", help="The artifact store directory.")
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="The number of times a failed download is retried.",
+    )
+    args = parser.parse_args()
+
+    entries = json.load(sys.stdin)
+    results = {}
+    failed = False
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = {
+            os.path.join(entry["parent"], entry["dest"]): executor.submit(
+                fetch, entry, args.download_dir, args.mirror, args.retries, args.store
+            )
+            for entry in entries
+        }
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as exp:  # noqa: BLE001
+                print(f"Unable to download {name}: {exp}", file=sys.stderr)
+                results[name] = "failed"
+                failed = True
+
+    changed = any(
+        result in {"store", "mirror", "downloaded"} for result in results.values()
+    )
+    json.dump({"changed": changed, "files": results}, sys.stdout, indent=4)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
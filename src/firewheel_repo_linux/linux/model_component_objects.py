@@ -1,21 +1,539 @@
+import os
 import json
+import time
 import shlex
+import atexit
+import bisect
+import shutil
+import hashlib
+import functools
+import subprocess
+import importlib.util
+from pathlib import Path
 
 from base_objects import VMEndpoint, AbstractUnixEndpoint
 
+from firewheel.config import config
+from firewheel.control.image_store import ImageStore
 from firewheel.control.experiment_graph import (
     IncorrectConflictHandlerError,
     require_class,
 )
 
 
+class GraphBuildProfiler:
+    """
+    Opt-in instrumentation for the time spent building the experiment graph
+    in the Linux model component objects.
+
+    For each instrumented method (or :py:meth:`section`), the profiler records
+    the number of calls, the cumulative wall time, and the number of schedule
+    entries that were added to the VM. It also records the total number of
+    schedule entries emitted per VM. The results can be exported as JSON or in
+    the "folded stacks" format used by flame graph tools (e.g.
+    `FlameGraph <https://github.com/brendangregg/FlameGraph>`__ or
+    `speedscope <https://www.speedscope.app/>`__).
+
+    Profiling is disabled by default and instrumented methods only check a flag.
+    It can be enabled either programmatically, via
+    ``graph_build_profiler.enable()``, or by setting the
+    ``FIREWHEEL_LINUX_PROFILE`` environment variable to an output path. In the
+    latter case, the results are written when the process exits; paths ending in
+    ``.folded`` use the folded stacks format and all others use JSON.
+    """
+
+    def __init__(self):
+        """
+        Create a disabled profiler with no results.
+        """
+        self.enabled = False
+        self.reset()
+
+    def enable(self):
+        """Start recording."""
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording (existing results are kept)."""
+        self.enabled = False
+
+    def reset(self):
+        """Remove all recorded results."""
+        self.methods = {}
+        self.entries_per_vm = {}
+        self.folded = {}
+        self._stack = []
+
+    def profile_class(self, cls):
+        """
+        A class decorator which instruments ``__init__`` and every method defined
+        directly on the class. It should be applied *above* any ``require_class``
+        decorators so that the time for ``__init__`` includes the decoration with
+        the required classes.
+
+        Arguments:
+            cls (type): The model component object to instrument.
+
+        Returns:
+            type: The instrumented class.
+        """
+        for attr_name, value in list(vars(cls).items()):
+            if not callable(value):
+                continue
+            if attr_name.startswith("__") and attr_name != "__init__":
+                continue
+            setattr(cls, attr_name, self.profile(value, f"{cls.__name__}.{attr_name}"))
+        return cls
+
+    def profile(self, func, name=None):
+        """
+        Instrument a single function.
+
+        Arguments:
+            func (callable): The function to instrument.
+            name (str, optional): The name to record the function as.
+                Defaults to the function's qualified name.
+
+        Returns:
+            callable: The instrumented function.
+        """
+        name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            with self.section(name, args[0] if args else None):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def section(self, name, vm=None):
+        """
+        Measure an arbitrary block of code as if it was an instrumented method.
+
+        Arguments:
+            name (str): The name to record the block as.
+            vm (Vertex, optional): The VM that the block adds schedule entries to.
+
+        Returns:
+            _ProfilerSection: A context manager for the block.
+        """
+        return _ProfilerSection(self, name, vm)
+
+    def _record(self, stack, elapsed, self_time, vm_name, entries):
+        """
+        Add the measurement of one call.
+
+        Arguments:
+            stack (list): The names of the enclosing sections (including this one).
+            elapsed (float): The wall time of the call in seconds.
+            self_time (float): The wall time not spent in nested sections.
+            vm_name (str): The name of the VM, if known.
+            entries (int): The number of schedule entries that were added.
+        """
+        stats = self.methods.setdefault(
+            stack[-1], {"calls": 0, "wall_time": 0.0, "schedule_entries": 0}
+        )
+        stats["calls"] += 1
+        # Recursive calls are already included in the outermost call
+        if stack.count(stack[-1]) == 1:
+            stats["wall_time"] += elapsed
+            stats["schedule_entries"] += entries
+        folded_key = ";".join(stack)
+        self.folded[folded_key] = self.folded.get(folded_key, 0.0) + self_time
+        if vm_name is not None and len(stack) == 1:
+            self.entries_per_vm[vm_name] = self.entries_per_vm.get(vm_name, 0) + entries
+
+    def to_dict(self):
+        """
+        Get the results.
+
+        Returns:
+            dict: The per-method statistics and the schedule entries per VM.
+        """
+        return {"methods": self.methods, "schedule_entries_per_vm": self.entries_per_vm}
+
+    def to_folded(self):
+        """
+        Get the results in the folded stacks format. Each line contains a
+        ``;`` separated stack followed by its self time in microseconds.
+
+        Returns:
+            str: The folded stacks.
+        """
+        return "".join(
+            f"{stack} {round(seconds * 1e6)}\n"
+            for stack, seconds in sorted(self.folded.items())
+        )
+
+    def dump(self, path):
+        """
+        Write the results to a file.
+
+        Arguments:
+            path (str): The output file. If it ends with ``.folded`` the folded
+                stacks format is used, otherwise the results are written as JSON.
+        """
+        with open(path, "w", encoding="utf-8") as out:
+            if str(path).endswith(".folded"):
+                out.write(self.to_folded())
+            else:
+                json.dump(self.to_dict(), out, indent=2, sort_keys=True)
+
+
+class _ProfilerSection:
+    """
+    A context manager which measures a block of code for a :py:class:`GraphBuildProfiler`.
+    """
+
+    def __init__(self, profiler, name, vm=None):
+        """
+        Arguments:
+            profiler (GraphBuildProfiler): The profiler to record to.
+            name (str): The name of the section.
+            vm (Vertex, optional): The VM that the block adds schedule entries to.
+        """
+        self.profiler = profiler
+        self.name = name
+        self.vm = vm
+
+    def _schedule_length(self):
+        try:
+            return len(self.vm.vm_resource_schedule.schedule_list)
+        except AttributeError:
+            return 0
+
+    def __enter__(self):
+        if not self.profiler.enabled:
+            return self
+        # Each frame holds [name, time spent in nested sections]
+        self.profiler._stack.append([self.name, 0.0])
+        self.entries = self._schedule_length()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.profiler.enabled or not self.profiler._stack:
+            return
+        elapsed = time.perf_counter() - self.start
+        stack = self.profiler._stack
+        frame = stack.pop()
+        if stack:
+            stack[-1][1] += elapsed
+        self.profiler._record(
+            [name for name, _ in stack] + [self.name],
+            elapsed,
+            elapsed - frame[1],
+            getattr(self.vm, "name", None),
+            self._schedule_length() - self.entries,
+        )
+
+
+graph_build_profiler = GraphBuildProfiler()
+
+if os.environ.get("FIREWHEEL_LINUX_PROFILE"):
+    graph_build_profiler.enable()
+    atexit.register(graph_build_profiler.dump, os.environ["FIREWHEEL_LINUX_PROFILE"])
+
+
+def baked_image_key(db_path, steps):
+    """
+    The cache key of a pre-baked image, i.e. a hash of the base image and the
+    setup steps which are baked into it (regardless of their order).
+    This must match the key computed by the ``bake_image.yml`` INSTALL tasks
+    of ``linux.ubuntu``.
+
+    Arguments:
+        db_path (str): The name of the base image in the image store.
+        steps (list): The names of the baked setup steps.
+
+    Returns:
+        str: The cache key.
+    """
+    value = ",".join([db_path, *sorted(steps)])
+    return hashlib.sha256(value.encode("utf8")).hexdigest()[:12]
+
+
+def find_baked_image(images_dir, db_path, file, steps):
+    """
+    Find the pre-baked version of an image, if it has been built. A pre-baked image
+    is a copy of the base image which already contains the results of some of the
+    boot-time setup steps (e.g. ``"stop_apt_daily"`` or ``"root_profiles"``).
+    VMs which use it skip these steps. Pre-baked images are built offline when
+    installing the image's model component (see ``linux.ubuntu``) and are named
+    after :py:func:`baked_image_key` so that a changed image or step list is never
+    mistaken for a stale one.
+
+    Image model components set the result as the ``baked_image`` class attribute
+    of their image class. :py:class:`LinuxHost` then uses the pre-baked image
+    unless the VM's drives were set explicitly.
+
+    Arguments:
+        images_dir (pathlib.Path): The ``images`` directory of the model component.
+        db_path (str): The name of the base image in the image store.
+        file (str): The name of the decompressed base image.
+        steps (list): The names of the baked setup steps.
+
+    Returns:
+        dict: The path and drive of the pre-baked image and the baked steps, or
+        :py:data:`None` if the image has not been built.
+    """
+    key = baked_image_key(db_path, steps)
+    baked_file = f"{os.path.splitext(file)[0]}-baked-{key}.qcow2"
+    # Pre-baked images are either Zstandard-compressed or gzipped tarballs
+    for path in (images_dir / f"{baked_file}.zst", images_dir / f"{baked_file}.tgz"):
+        if path.exists():
+            return {
+                "path": str(path),
+                "drive": {"db_path": path.name, "file": baked_file},
+                "steps": frozenset(steps),
+            }
+    return None
+
+
+def _image_cache_dir():
+    """
+    The directory which holds the decompressed copies of the image archives.
+    This can be set with the ``FIREWHEEL_IMAGE_CACHE`` environment variable and
+    defaults to the ``image_cache`` directory next to the minimega files directory
+    (so that cached images can be hard linked into the image store).
+
+    Returns:
+        str: The path of the image cache.
+    """
+    default = os.path.join(
+        os.path.dirname(os.path.normpath(config["minimega"]["files_dir"])),
+        "image_cache",
+    )
+    return os.environ.get("FIREWHEEL_IMAGE_CACHE", default)
+
+
+def _sha256_file(path):
+    """
+    Hash a file without reading it into memory at once.
+
+    Arguments:
+        path (str): The path of the file.
+
+    Returns:
+        str: The sha256 hash of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f_hand:
+        for chunk in iter(lambda: f_hand.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _image_decompress_commands(archive, file):
+    """
+    The pipeline of commands which stream the decompressed image from an image
+    archive (read on ``stdin``) to ``stdout``. Multi-threaded decompressors are
+    used when possible (``xz -T0`` and ``pigz``) and Zstandard-compressed
+    archives (``.zst``) are supported as well. The image is extracted
+    from a tarball as it is decompressed (i.e. without an intermediate tar file).
+
+    Arguments:
+        archive (str): The path of the image archive.
+        file (str): The name of the image (in the tarball).
+
+    Returns:
+        list: The commands of the pipeline.
+
+    Raises:
+        ValueError: If the archive is not a known compression type.
+    """
+    if archive.endswith(".xz"):
+        return [["xz", "-d", "-T0"]]
+    if archive.endswith((".tar.zst", ".tzst")):
+        return [["zstd", "-d"], ["tar", "-xO", "-f", "-", file]]
+    if archive.endswith(".zst"):
+        return [["zstd", "-d"]]
+    if archive.endswith((".tgz", ".tar.gz")):
+        gunzip = ["pigz", "-d"] if shutil.which("pigz") else ["gzip", "-d"]
+        return [gunzip, ["tar", "-xO", "-f", "-", file]]
+    raise ValueError(f"Unknown compression type for the image archive {archive}.")
+
+
+def _stream_decompress_image(archive, file, destination):
+    """
+    Decompress an image archive into ``destination``. The image is written to a
+    temporary file (and hashed) as it is decompressed and only moved into place
+    once every command of the pipeline succeeded, along with a
+    ``<destination>.sha256`` file recording its hash and size.
+
+    Arguments:
+        archive (str): The path of the image archive.
+        file (str): The name of the image (in the tarball).
+        destination (str): The path of the decompressed image.
+
+    Raises:
+        RuntimeError: If the image could not be decompressed.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    tmp_path = f"{destination}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    processes = []
+    with open(archive, "rb") as source, open(tmp_path, "wb") as dest:
+        stream = source
+        for command in _image_decompress_commands(archive, file):
+            processes.append(
+                subprocess.Popen(command, stdin=stream, stdout=subprocess.PIPE)
+            )
+            if stream is not source:
+                # Only the next command reads the output of the previous one
+                stream.close()
+            stream = processes[-1].stdout
+        for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+            dest.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+        stream.close()
+    failed = [process.args[0] for process in processes if process.wait() != 0]
+    if failed or not size:
+        os.remove(tmp_path)
+        raise RuntimeError(
+            f"Unable to decompress {archive} ({', '.join(failed) or 'empty image'})."
+        )
+    os.replace(tmp_path, destination)
+    with open(f"{destination}.sha256", "w", encoding="utf8") as f_hand:
+        f_hand.write(f"{digest.hexdigest()} {size}\n")
+
+
+def _cached_image(archive, file):
+    """
+    Get the decompressed copy of an image archive from the image cache,
+    decompressing the archive if it is not cached yet. Cached images are keyed by
+    the sha256 hash of their archive, so a changed archive is never mistaken for
+    a cached one, and are only used if they are complete (i.e. their size matches
+    the one recorded after decompressing them).
+
+    Arguments:
+        archive (str): The path of the image archive.
+        file (str): The name of the image (in the tarball).
+
+    Returns:
+        str: The path of the cached image.
+    """
+    cached = os.path.join(_image_cache_dir(), _sha256_file(archive), file)
+    try:
+        with open(f"{cached}.sha256", encoding="utf8") as f_hand:
+            _digest, size = f_hand.read().split()
+        if os.path.getsize(cached) == int(size):
+            return cached
+    except (OSError, ValueError):
+        pass
+    _stream_decompress_image(archive, file, cached)
+    return cached
+
+
+@functools.lru_cache(maxsize=None)
+def _upload_baked_image(path, file):
+    """
+    Add a pre-baked image to the image store (once per graph build). Unlike the
+    images listed in a MANIFEST, pre-baked images are optional, so they are only
+    uploaded when a VM uses them.
+
+    Rather than having the image store decompress the archive
+    (see :py:meth:`firewheel.lib.minimega.file_store.FileStore.add_image_file`),
+    the decompressed image comes from the image cache (see :py:func:`_cached_image`)
+    so an archive is only decompressed once per node, and in parallel when possible.
+
+    Arguments:
+        path (str): The path of the pre-baked image.
+        file (str): The name of the decompressed pre-baked image.
+    """
+    image_store = ImageStore()
+    if image_store.check_path(file):
+        return
+    image_store.add_file(path)
+    cached = _cached_image(path, file)
+    destination = os.path.join(image_store.cache, file)
+    try:
+        # The image store only reads the images, so they can share the cached copy
+        os.link(cached, destination)
+    except OSError:
+        shutil.copyfile(cached, destination)
+    image_store.broadcast_get_file(os.path.join(image_store.store, file))
+
+
+def _load_vm_resource_module(name):
+    """
+    Import a Python VM resource of this model component (e.g. a helper library
+    which is shared with the VM resources).
+
+    Arguments:
+        name (str): The name of the VM resource (without ``.py``).
+
+    Returns:
+        module: The VM resource.
+    """
+    path = Path(__file__).resolve().parent / "vm_resources" / f"{name}.py"
+    spec = importlib.util.spec_from_file_location(f"linux_vm_resources.{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# The helpers which are loaded alongside the VM resources of the Linux model
+# components, by file extension (for all VM resources of that type) or by the
+# name of the VM resource (see LinuxHost.add_vm_resource_helpers)
+VM_RESOURCE_HELPERS = {
+    ".sh": ("vm_timing.sh",),
+    ".py": ("vm_timing.py",),
+    # configure_ips.sh hands off to configure_ips.py when Python is available.
+    # Both wait for devices using the shared wait library.
+    "configure_ips.sh": (
+        "configure_ips.py",
+        "vm_timing.py",
+        "wait_for.py",
+        "wait_for.sh",
+    ),
+    # install_debs.py waits for its dependency with inotify rather than polling
+    "install_debs.py": ("wait_for.py",),
+}
+
+
+@graph_build_profiler.profile_class
 @require_class(VMEndpoint)
 @require_class(AbstractUnixEndpoint)
 class LinuxHost:
     """
     A class with functionality common to all Linux Hosts.
+
+    Setting ``boot_bundle = True`` on a vertex before decorating it collects
+    all of its negative-time setup steps (e.g. setting the hostname, adding
+    profiles, and configuring IP addresses) into a single schedule entry.
+    The steps run in their original order, but the VM only needs to fetch and
+    launch one VM resource instead of one per step. This is useful for very large
+    experiments. Steps which may reboot the VM (e.g. :py:meth:`increase_ulimit`)
+    are never bundled. If other schedule entries of the VM (e.g. those of other
+    model components) would run between two bundled steps, the bundle is split
+    there, so that every entry keeps its place in the boot sequence.
+
+    Setting ``boot_bundle = "graph"`` instead runs the bundled steps as a dependency
+    graph. Steps can be given a name (``step``) and a list of the step names which
+    must finish before they start (``after``). Each step starts as soon as its
+    prerequisites have finished rather than waiting for its start time, so
+    independent steps run in parallel. Steps which do not declare their
+    prerequisites wait for every step which would have run before them.
+
+    Image model components may list the capabilities of their image (as the
+    ``image_capabilities`` class attribute of the image class) so that setup steps
+    which the image does not need are skipped. They can also be set on a vertex
+    before decorating it (e.g. for a customized image). The known capabilities are:
+
+    * ``"no_apt_daily"``: The apt-daily and unattended-upgrade timers do not run in
+      the image (i.e. they are absent or already masked), so they are not stopped
+      at boot (see ``linux.ubuntu.UbuntuHost``).
     """
 
+    # The file on the VM to which the VM resources append their timing records
+    # (see collect_vm_resource_timings)
+    vm_resource_timings = _load_vm_resource_module("vm_timing").TIMING_LOG
+
     def __init__(self, name=None):
         """
         Sets a few of the basic options for new Linux-based VMs.
@@ -31,9 +549,589 @@ class LinuxHost:
         if not self.name:
             raise RuntimeError("LinuxHost needs a name!")
 
+        # Opt-in: collect all negative-time setup into a single schedule entry,
+        # either run in order (True) or as a dependency graph ("graph").
+        # This must be set on the vertex prior to decorating it.
+        self.boot_bundle = getattr(self, "boot_bundle", False)
+        self._boot_bundle_entry = None
+        self._boot_bundle_steps = []
+        # The files and contents which each bundled step needs
+        self._boot_bundle_data = []
+        self._boot_bundle_script = None
+
+        # The users whose passwords are set at each schedule time, mapped to
+        # their flags and password (see set_passwords)
+        self._user_passwords = {}
+
+        # The home directory of each user who receives the default profiles and
+        # the schedule entry which installs them (see install_profiles)
+        self._profile_homes = {}
+        self._profiles_entry = None
+
+        # The setup steps which are already baked into the VM's image (see
+        # find_baked_image). The pre-baked image is not used if the drives of
+        # the VM were set before decorating it.
+        self.baked_steps = frozenset()
+        baked_image = getattr(self, "baked_image", None)
+        if baked_image and not self.vm.get("drives"):
+            _upload_baked_image(baked_image["path"], baked_image["drive"]["file"])
+            self.vm["drives"] = [dict(baked_image["drive"])]
+            self.baked_steps = baked_image["steps"]
+
+        # The capabilities of the VM's image (see the class documentation)
+        self.image_capabilities = frozenset(getattr(self, "image_capabilities", ()))
+
         self.set_hostname()
         self.add_root_profiles()
 
+    def _add_boot_bundle_step(self, start_time, command, step=None, after=None):
+        """
+        Add a shell command to the boot bundle of this VM.
+
+        The first bundled step creates the bundle's schedule entry. The bundle script
+        itself is rendered lazily (see :py:meth:`_render_boot_bundle`) so that steps
+        added later in the graph build are still included. Until then, the entry
+        runs at the earliest start time of all its steps.
+
+        Arguments:
+            start_time (int): The schedule time that the step would have had on its own.
+            command (str): The shell command to run for this step.
+            step (str, optional): The name of the step. Several steps may share a name.
+            after (list, optional): The names of the steps which must finish before this
+                step starts. If :py:data:`None`, the step waits for all steps which
+                would have run before it.
+
+        Returns:
+            base_objects.RunExecutableScheduleEntry: The boot bundle schedule entry.
+        """
+        if self._boot_bundle_entry is None:
+            self._boot_bundle_entry = self.run_executable(
+                start_time, "/bin/bash", arguments="boot_bundle.sh"
+            )
+            self._boot_bundle_entry.add_content(
+                "boot_bundle.sh", self._render_boot_bundle
+            )
+        entry = self._boot_bundle_entry
+        entry.start_time = min(entry.start_time, start_time)
+        if after is not None:
+            after = tuple(after)
+        self._boot_bundle_steps.append(
+            (start_time, len(self._boot_bundle_steps), command, step, after)
+        )
+        self._boot_bundle_data.append({})
+        return entry
+
+    def _add_boot_bundle_file(self, filename, executable=False):
+        """
+        Load a file into the working directory of the boot bundle for the most
+        recently added step. Each file is only loaded once per schedule entry.
+
+        Arguments:
+            filename (str): The name of the VM resource file.
+            executable (bool): Whether the file should be made executable.
+        """
+        self._boot_bundle_data[-1][filename] = ("file", filename, executable)
+
+    def _add_boot_bundle_content(self, location, content):
+        """
+        Write content into the working directory of the boot bundle for the most
+        recently added step.
+
+        Arguments:
+            location (str): The name of the file in the working directory.
+            content (str): The content to write (or a callable which returns it).
+        """
+        self._boot_bundle_data[-1][location] = ("content", content, False)
+
+    def _split_boot_bundle(self):
+        """
+        Split the bundled steps into runs of consecutive steps which have no other
+        schedule entry of the VM between them. The first run keeps the bundle's
+        schedule entry, and each further run gets a new schedule entry at the start
+        time of its first step. Every entry is given the files and contents which
+        its steps need.
+
+        This is called while the schedule is resolved (i.e. once every entry of the
+        VM is known). The new entries are appended to the schedule, so they are
+        resolved along with the remaining entries.
+
+        Returns:
+            list: The steps and schedule entry of each run, in order.
+        """
+        bundle_entry = self._boot_bundle_entry
+        other_times = sorted(
+            entry.start_time
+            for entry in self.vm_resource_schedule.schedule_list
+            if entry is not bundle_entry
+        )
+
+        runs = [[]]
+        for step in sorted(self._boot_bundle_steps):
+            if runs[-1]:
+                # Another entry at (or after) the time of the previous step must
+                # still run after it, and before this step
+                index = bisect.bisect_left(other_times, runs[-1][-1][0])
+                if index < len(other_times) and other_times[index] < step[0]:
+                    runs.append([])
+            runs[-1].append(step)
+
+        bundles = []
+        for steps in runs:
+            if not bundles:
+                entry = bundle_entry
+            else:
+                entry = self.run_executable(
+                    steps[0][0], "/bin/bash", arguments="boot_bundle.sh"
+                )
+            entry.start_time = steps[0][0]
+            loaded = set()
+            for _start_time, seq, _command, _step, _after in steps:
+                for location, (kind, value, executable) in self._boot_bundle_data[
+                    seq
+                ].items():
+                    if location in loaded:
+                        continue
+                    loaded.add(location)
+                    if kind == "file":
+                        entry.add_file(location, value, executable=executable)
+                    else:
+                        entry.add_content(
+                            location, value() if callable(value) else value
+                        )
+            bundles.append((steps, entry))
+        return bundles
+
+    def _render_boot_bundle(self):
+        """
+        Render the script of the bundle's schedule entry, after splitting the
+        bundle where other schedule entries run between its steps (see
+        :py:meth:`_split_boot_bundle`). The scripts of the other runs are added to
+        their own schedule entries.
+
+        Returns:
+            str: The contents of ``boot_bundle.sh`` for the first run of steps.
+        """
+        if self._boot_bundle_script is None:
+            bundles = self._split_boot_bundle()
+            earlier = set()
+            for index, (steps, entry) in enumerate(bundles):
+                script = self._render_boot_steps(steps, earlier)
+                if index == 0:
+                    self._boot_bundle_script = script
+                else:
+                    entry.add_content("boot_bundle.sh", script)
+                earlier.update(step[3] for step in steps if step[3])
+        return self._boot_bundle_script
+
+    def _render_boot_steps(self, steps, earlier=()):
+        """
+        Render a boot bundle script. Steps are run sequentially, in the same
+        order that their individual schedule entries would have run.
+        A failing step does not prevent the remaining steps from running, but
+        the bundle will exit with a non-zero code.
+
+        Arguments:
+            steps (list): The bundled steps to run.
+            earlier (set): The names of the steps which have already run in an
+                earlier bundle.
+
+        Returns:
+            str: The contents of ``boot_bundle.sh``.
+        """
+        if self.boot_bundle == "graph":
+            return self._render_boot_graph(steps, earlier)
+
+        lines = [
+            "#!/bin/bash",
+            f"# Boot bundle for {self.name}",
+            "failures=0",
+        ]
+        for start_time, _seq, command, _step, _after in sorted(steps):
+            lines.append(f"echo {shlex.quote(f'[{start_time}] {command}')}")
+            lines.append(f"{command} || failures=$((failures + 1))")
+        lines.append('if [ "$failures" -ne 0 ]; then')
+        lines.append('    echo "$failures boot step(s) failed" >&2')
+        lines.append("    exit 1")
+        lines.append("fi")
+        return "\n".join(lines) + "\n"
+
+    def _boot_graph_order(self, steps, earlier=()):
+        """
+        Resolve the prerequisites of every bundled step and order the steps so that
+        each step comes after all of its prerequisites. Otherwise, steps keep the
+        order in which they would have run sequentially.
+
+        Arguments:
+            steps (list): The bundled steps to order.
+            earlier (set): The names of the steps which have already run in an
+                earlier bundle.
+
+        Returns:
+            tuple: The ordered list of steps and a dictionary mapping the sequence
+            number of each step to the sequence numbers of its prerequisites
+            (excluding those which are already implied by another prerequisite).
+
+        Raises:
+            ValueError: If a prerequisite does not exist (or only runs in a later
+                bundle) or if the prerequisites contain a cycle.
+        """
+        steps = sorted(steps)
+        names = {}
+        for _start_time, seq, _command, step, _after in steps:
+            if step:
+                names.setdefault(step, []).append(seq)
+
+        prerequisites = {}
+        for index, (_start_time, seq, _command, _step, after) in enumerate(steps):
+            if after is None:
+                prerequisites[seq] = [prev[1] for prev in steps[:index]]
+                continue
+            # Steps which are baked into the image (or ran in an earlier bundle)
+            # have already finished
+            unknown = [
+                name
+                for name in after
+                if name not in names
+                and name not in self.baked_steps
+                and name not in earlier
+            ]
+            if unknown:
+                raise ValueError(
+                    f"Unknown boot step(s) {', '.join(unknown)} on {self.name}. "
+                    "A step cannot wait for a step which runs after another "
+                    "schedule entry of the VM."
+                )
+            prerequisites[seq] = [dep for name in after for dep in names.get(name, ())]
+
+        ordered = []
+        # The (transitive) prerequisites of every ordered step
+        ancestors = {}
+        while steps:
+            ready = next(
+                (
+                    step
+                    for step in steps
+                    if all(dep in ancestors for dep in prerequisites[step[1]])
+                ),
+                None,
+            )
+            if ready is None:
+                raise ValueError(
+                    f"The boot steps of {self.name} have circular prerequisites."
+                )
+            steps.remove(ready)
+            ordered.append(ready)
+
+            deps = prerequisites[ready[1]]
+            ancestors[ready[1]] = set(deps).union(*(ancestors[dep] for dep in deps))
+            # Only wait for the prerequisites which are not implied by the others
+            implied = set().union(*(ancestors[dep] for dep in deps))
+            prerequisites[ready[1]] = [dep for dep in deps if dep not in implied]
+        return ordered, prerequisites
+
+    def _render_boot_graph(self, steps, earlier=()):
+        """
+        Render the boot bundle script for the ``"graph"`` mode. Every step runs in
+        the background and holds an exclusive lock on its own lock file until it
+        finishes. Before starting, a step takes a shared lock on the lock file of
+        each of its prerequisites, i.e. it starts as soon as they have finished.
+        As in the sequential mode, a failing step does not prevent the remaining
+        steps (including those which depend on it) from running, but the bundle
+        will exit with a non-zero code.
+
+        Arguments:
+            steps (list): The bundled steps to run.
+            earlier (set): The names of the steps which have already run in an
+                earlier bundle.
+
+        Returns:
+            str: The contents of ``boot_bundle.sh``.
+        """
+        ordered, prerequisites = self._boot_graph_order(steps, earlier)
+        lines = [
+            "#!/bin/bash",
+            f"# Boot bundle for {self.name} (dependency graph)",
+            "pids=()",
+        ]
+        for start_time, seq, command, step, _after in ordered:
+            label = f"{step}: {command}" if step else command
+            label = f"[{start_time}] {label}"
+            # The lock is taken before the step is started so that steps
+            # which depend on it cannot start first. The command itself does
+            # not inherit the lock, in case it leaves processes running.
+            lines.append(f"exec 9>.step_{seq}.lock && flock -x 9")
+            lines.append("(")
+            lines.extend(
+                f"    flock -s .step_{dep}.lock true" for dep in prerequisites[seq]
+            )
+            lines.append(f"    echo {shlex.quote(label)}")
+            lines.append(f"    {{ {command}; }} 9>&-")
+            lines.append(") &")
+            lines.append("pids+=($!)")
+        lines.append("exec 9>&-")
+        lines.append("failures=0")
+        lines.append('for pid in "${pids[@]}"; do')
+        lines.append('    wait "$pid" || failures=$((failures + 1))')
+        lines.append("done")
+        lines.append('if [ "$failures" -ne 0 ]; then')
+        lines.append('    echo "$failures boot step(s) failed" >&2')
+        lines.append("    exit 1")
+        lines.append("fi")
+        return "\n".join(lines) + "\n"
+
+    def run_boot_executable(
+        self,
+        start_time,
+        program,
+        arguments=None,
+        vm_resource=False,
+        step=None,
+        after=None,
+        idempotent=False,
+    ):
+        """
+        Equivalent to :py:meth:`base_objects.VMEndpoint.run_executable`, but the
+        program will be part of the boot bundle if :py:attr:`boot_bundle` is enabled
+        and ``start_time`` is negative.
+
+        Idempotent steps are run by ``run_once.sh``, which records a fingerprint of the
+        step's inputs (the program, its arguments, and the contents of any files
+        they refer to) on the VM once it succeeds. If the VM is restarted or its
+        schedule is replayed, steps whose fingerprint is unchanged are skipped.
+        Only steps whose effects persist across a restart should be idempotent.
+
+        Arguments:
+            start_time (int): The schedule time to run the program.
+            program (str): The name of the program or script to run.
+            arguments (str or list, optional): The arguments for the program.
+            vm_resource (bool, optional): If the program is a VM resource which needs
+                to be loaded onto the VM. Defaults to :py:data:`False`.
+            step (str, optional): The name of this step when :py:attr:`boot_bundle`
+                is ``"graph"``.
+            after (list, optional): The names of the steps which must finish before
+                this step when :py:attr:`boot_bundle` is ``"graph"``. By default, the
+                step waits for all steps which would have run before it.
+            idempotent (bool, optional): Skip the step if it already ran with the
+                same inputs. This requires a ``step`` name. Defaults to
+                :py:data:`False`.
+
+        Returns:
+            base_objects.RunExecutableScheduleEntry: The schedule entry which runs the program.
+
+        Raises:
+            ValueError: If an idempotent step does not have a name.
+        """
+        if idempotent and not step:
+            raise ValueError("Idempotent boot steps must have a `step` name.")
+        if isinstance(arguments, list):
+            arguments = " ".join(arguments)
+
+        if not self.boot_bundle or start_time >= 0:
+            if not idempotent:
+                entry = self.run_executable(start_time, program, arguments, vm_resource)
+            else:
+                entry = self.run_executable(
+                    start_time,
+                    "run_once.sh",
+                    f"{shlex.quote(step)} {program} {arguments or ''}".rstrip(),
+                    vm_resource=True,
+                )
+                if vm_resource:
+                    entry.add_file(program, program, executable=True)
+            if vm_resource:
+                self.add_vm_resource_helpers(entry, program)
+            return entry
+
+        command = f"./{program}" if vm_resource else program
+        if idempotent:
+            command = f"./run_once.sh {shlex.quote(step)} {command}"
+        if arguments:
+            command = f"{command} {arguments}"
+        entry = self._add_boot_bundle_step(start_time, command, step, after)
+        if idempotent:
+            self._add_boot_bundle_file("run_once.sh", executable=True)
+        if vm_resource:
+            self._add_boot_bundle_file(program, executable=True)
+            self.add_vm_resource_helpers(entry, program)
+        return entry
+
+    def drop_boot_file(self, start_time, location, filename, step=None, after=None):
+        """
+        Equivalent to :py:meth:`base_objects.VMEndpoint.drop_file`, but the file
+        will be part of the boot bundle if :py:attr:`boot_bundle` is enabled and
+        ``start_time`` is negative. Files dropped to multiple locations are only
+        loaded onto the VM once.
+
+        Arguments:
+            start_time (int): The schedule time to drop the file.
+            location (str): The absolute path (including filename) on the VM.
+            filename (str): The name of the file within the model component.
+            step (str, optional): The name of this step when :py:attr:`boot_bundle`
+                is ``"graph"``.
+            after (list, optional): The names of the steps which must finish before
+                this step when :py:attr:`boot_bundle` is ``"graph"``. By default, the
+                step waits for all steps which would have run before it.
+
+        Returns:
+            base_objects.ScheduleEntry: The schedule entry which drops the file.
+        """
+        if not self.boot_bundle or start_time >= 0:
+            return self.drop_file(start_time, location, filename)
+
+        location = shlex.quote(str(location))
+        entry = self._add_boot_bundle_step(
+            start_time,
+            f"mkdir -p $(dirname {location}) && cp -f {shlex.quote(filename)} {location}",
+            step,
+            after,
+        )
+        self._add_boot_bundle_file(filename)
+        return entry
+
+    def drop_boot_content(self, start_time, location, content, step=None, after=None):
+        """
+        Equivalent to :py:meth:`base_objects.VMEndpoint.drop_content`, but the content
+        will be part of the boot bundle if :py:attr:`boot_bundle` is enabled and
+        ``start_time`` is negative.
+
+        Arguments:
+            start_time (int): The schedule time to write the content.
+            location (str): The absolute path (including filename) on the VM.
+            content (str): The content to write (or a callable which returns it).
+            step (str, optional): The name of this step when :py:attr:`boot_bundle`
+                is ``"graph"``.
+            after (list, optional): The names of the steps which must finish before
+                this step when :py:attr:`boot_bundle` is ``"graph"``. By default, the
+                step waits for all steps which would have run before it.
+
+        Returns:
+            base_objects.ScheduleEntry: The schedule entry which writes the content.
+        """
+        if not self.boot_bundle or start_time >= 0:
+            return self.drop_content(start_time, location, content)
+
+        bundled_name = f"content_{len(self._boot_bundle_steps)}"
+        location = shlex.quote(str(location))
+        entry = self._add_boot_bundle_step(
+            start_time,
+            f"mkdir -p $(dirname {location}) && cp -f {bundled_name} {location}",
+            step,
+            after,
+        )
+        self._add_boot_bundle_content(bundled_name, content)
+        return entry
+
+    def add_boot_vm_resource(
+        self,
+        start_time,
+        vm_resource_name,
+        dynamic_arg=None,
+        static_arg=None,
+        step=None,
+        after=None,
+        idempotent=False,
+    ):
+        """
+        Equivalent to :py:meth:`base_objects.VMEndpoint.add_vm_resource`, but the
+        VM resource will be part of the boot bundle if :py:attr:`boot_bundle` is
+        enabled and ``start_time`` is negative. Idempotent VM resources are skipped
+        if they already ran with the same inputs (see :py:meth:`run_boot_executable`).
+
+        Note:
+            Bundled VM resources cannot request a reboot as the whole bundle
+            would be run again afterwards.
+
+        Arguments:
+            start_time (int): The schedule time to run the VM resource.
+            vm_resource_name (str): The name of the VM resource.
+            dynamic_arg (str, optional): Content which is written to a file whose path is
+                passed as the first argument.
+            static_arg (str, optional): The name of a file which is loaded onto the VM and
+                passed as the second argument.
+            step (str, optional): The name of this step when :py:attr:`boot_bundle`
+                is ``"graph"``.
+            after (list, optional): The names of the steps which must finish before
+                this step when :py:attr:`boot_bundle` is ``"graph"``. By default, the
+                step waits for all steps which would have run before it.
+            idempotent (bool, optional): Skip the step if it already ran with the
+                same inputs. This requires a ``step`` name. Defaults to
+                :py:data:`False`.
+
+        Returns:
+            base_objects.ScheduleEntry: The schedule entry which runs the VM resource.
+
+        Raises:
+            ValueError: If an idempotent step does not have a name.
+        """
+        if idempotent and not step:
+            raise ValueError("Idempotent boot steps must have a `step` name.")
+
+        if not self.boot_bundle or start_time >= 0:
+            entry = self.add_vm_resource(
+                start_time, vm_resource_name, dynamic_arg, static_arg
+            )
+            if idempotent:
+                # Run the VM resource (with its usual arguments) through run_once.sh
+                arguments = entry.arguments
+                entry.arguments = ""
+                entry.set_executable(
+                    "run_once.sh",
+                    f"{shlex.quote(step)} {vm_resource_name} {arguments}",
+                )
+                entry.add_file("run_once.sh", "run_once.sh", executable=True)
+            self.add_vm_resource_helpers(entry, vm_resource_name)
+            return entry
+
+        # Each VM resource runs in its own directory so that any files it
+        # creates do not collide with those of other bundled steps.
+        step_dir = f"step_{len(self._boot_bundle_steps)}"
+        dynamic_path = f"../{step_dir}.dynamic" if dynamic_arg else "None"
+        static_path = f"../{static_arg}" if static_arg else "None"
+        command = f"../{vm_resource_name} {dynamic_path} {static_path} reboot"
+        if idempotent:
+            command = f"../run_once.sh {shlex.quote(step)} {command}"
+        entry = self._add_boot_bundle_step(
+            start_time,
+            f"(mkdir -p {step_dir} && cd {step_dir} && {command})",
+            step,
+            after,
+        )
+        if idempotent:
+            self._add_boot_bundle_file("run_once.sh", executable=True)
+        self._add_boot_bundle_file(vm_resource_name, executable=True)
+        self.add_vm_resource_helpers(entry, vm_resource_name)
+        if dynamic_arg:
+            self._add_boot_bundle_content(f"{step_dir}.dynamic", dynamic_arg)
+        if static_arg:
+            self._add_boot_bundle_file(static_arg)
+        return entry
+
+    def add_vm_resource_helpers(self, entry, vm_resource_name):
+        """
+        Load the helpers which a VM resource of the Linux model components uses
+        (see :py:data:`VM_RESOURCE_HELPERS`) alongside it, e.g. ``vm_timing.sh``,
+        which records its execution time, or ``wait_for.py``, which waits for
+        events without polling.
+
+        This is done by :py:meth:`run_boot_executable` and
+        :py:meth:`add_boot_vm_resource`. VM resources which are scheduled otherwise
+        (e.g. ``install_debs.py`` with ``add_vm_resource``) should be passed to this
+        method, otherwise they fail to load their helpers.
+
+        Arguments:
+            entry (base_objects.ScheduleEntry): The schedule entry which runs the
+                VM resource.
+            vm_resource_name (str): The name of the VM resource.
+        """
+        helpers = VM_RESOURCE_HELPERS.get(
+            os.path.splitext(vm_resource_name)[1], ()
+        ) + VM_RESOURCE_HELPERS.get(vm_resource_name, ())
+        for helper in dict.fromkeys(helpers):
+            if entry is self._boot_bundle_entry:
+                self._add_boot_bundle_file(helper)
+            else:
+                entry.add_file(helper, helper)
+
     def set_hostname(self, start_time=-250):
         """
         Wrapper to run the vm_resource that sets the hostname of the VM
@@ -42,7 +1140,15 @@ class LinuxHost:
             start_time (int, optional): The start time to configure the VM's
                 hostname (default=-250)
         """
-        self.run_executable(start_time, "set_hostname.sh", self.name, vm_resource=True)
+        self.run_boot_executable(
+            start_time,
+            "set_hostname.sh",
+            self.name,
+            vm_resource=True,
+            step="set_hostname",
+            after=[],
+            idempotent=True,
+        )
 
     def change_password(self, start_time, username, password):
         """
@@ -52,13 +1158,68 @@ class LinuxHost:
             start_time (int): The schedule time to configure the VM's password.
             username (str): The username whose password should change.
             password (str): The new password.
+
+        Returns:
+            base_objects.ScheduleEntry: The schedule entry which sets the password
+            (see :py:meth:`set_passwords`).
         """
-        self.run_executable(
-            start_time,
-            "chpasswd.sh",
-            "{} {}".format(username, password),
-            vm_resource=True,
-        )
+        return self.set_passwords(start_time, {username: password})
+
+    def set_passwords(self, start_time, passwords, hashed=False, create=False):
+        """
+        Set the passwords of many users at once.
+
+        All passwords which are set at the same schedule time (including those
+        from later calls) are written to a single file which is applied by a
+        single ``chpasswd`` run, rather than scheduling a program per user.
+        The passwords are also never passed on the command line.
+
+        Arguments:
+            start_time (int): The schedule time to set the passwords.
+            passwords (dict): A mapping of username to password.
+            hashed (bool, optional): The passwords are already encrypted (i.e. they
+                are :manpage:`crypt(3)` hashes, such as those created by
+                ``openssl passwd -6``). Defaults to :py:data:`False`.
+            create (bool, optional): Create any users which do not exist (with a
+                home directory) before setting their passwords.
+                Defaults to :py:data:`False`.
+
+        Returns:
+            base_objects.ScheduleEntry: The schedule entry which sets the passwords.
+
+        Raises:
+            ValueError: If a username or password cannot be represented in the
+                input of ``chpasswd``.
+        """
+        flags = ("c" if create else "") + ("e" if hashed else "") or "-"
+        for username, password in passwords.items():
+            if not username or any(char in username for char in ": \t\n"):
+                raise ValueError(f"Invalid username for {self.name}: {username!r}")
+            if "\n" in password:
+                raise ValueError(f"Passwords cannot contain newlines ({username})")
+
+        if start_time not in self._user_passwords:
+            users = {}
+
+            def render_passwords():
+                return "".join(
+                    f"{user_flags} {username}:{password}\n"
+                    for username, (user_flags, password) in users.items()
+                )
+
+            entry = self.add_boot_vm_resource(
+                start_time,
+                "set_passwords.sh",
+                render_passwords,
+                step="set_passwords",
+                idempotent=True,
+            )
+            self._user_passwords[start_time] = (entry, users)
+
+        entry, users = self._user_passwords[start_time]
+        for username, password in passwords.items():
+            users[username] = (flags, password)
+        return entry
 
     def cleanup(self, start_time=1):
         """
@@ -69,7 +1230,44 @@ class LinuxHost:
         """
         self.run_executable(start_time, "/bin/rm", "-rf /var/launch")
 
-    def increase_ulimit(self, fd_limit=102400):
+    def collect_vm_resource_timings(self, start_time=1, interval=60, destination=None):
+        """
+        Pull the timing records of the Linux VM resources off of the VM.
+
+        When it exits, each VM resource in the Linux model components appends a
+        JSON line (see ``vm_timing.sh`` and ``vm_timing.py``) to
+        :py:attr:`vm_resource_timings`, with the name of the VM resource
+        (``resource``), its working directory (``cwd``, which includes its schedule
+        time), the ``PRETTY_NAME`` of the VM's OS (``os``), its ``start`` and ``end``
+        times (in seconds since the epoch), the number of times it retried a failing
+        operation (``retries``), and its ``exit_code``. The file is transferred to
+        ``<destination>/<VM name>/<vm_resource_timings>`` (by default,
+        ``destination`` is ``<logging.root_dir>/transfers``), where
+        ``benchmarks/vm_resource_report.py`` can combine the records of every VM into
+        a single report.
+
+        Arguments:
+            start_time (int): The time at which to start transferring the records.
+                Defaults to 1.
+            interval (int): How often (in seconds) to transfer new records. If this
+                is :py:data:`None`, the records are only transferred once.
+                Defaults to 60.
+            destination (str): The directory on the compute node in which to place
+                the records. Defaults to :py:data:`None`.
+        """
+        if interval:
+            self.file_transfer(
+                self.vm_resource_timings,
+                interval=interval,
+                start_time=start_time,
+                destination=destination,
+            )
+        else:
+            self.file_transfer_once(
+                self.vm_resource_timings, start_time=start_time, destination=destination
+            )
+
+    def increase_ulimit(self, fd_limit=102400, live=False):
         """
         This helps users adjust common `ulimit <https://ss64.com/bash/ulimit.html>`_
         parameters that typically impact experiments.
@@ -82,6 +1280,14 @@ class LinuxHost:
         the number of file descriptors open, but this method can be extended in the future
         for other ``ulimit`` parameters.
 
+        By default, the VM is rebooted so that the new limits apply to every process.
+        With ``live=True``, the limits are instead applied to the running system
+        (via ``sysctl``, ``prlimit`` on all running processes, and
+        ``systemctl daemon-reexec``), which avoids the extra boot. The VM is only
+        rebooted if the limits cannot be applied live (e.g. on systems without
+        systemd or ``prlimit``). In either case, no reboot is needed if the VM
+        already has the requested limits.
+
         .. seealso::
 
             - https://wiki.archlinux.org/title/Limits.conf
@@ -92,30 +1298,69 @@ class LinuxHost:
 
         Arguments:
             fd_limit (int): The maximum number of open file descriptors. Defaults to 102400.
+            live (bool): Apply the limits without rebooting the VM, if possible.
+                Defaults to :py:data:`False`.
         """
         start_time = -900
 
         # Set the default nofile ulimit
-        self.run_executable(
+        entry = self.run_executable(
             start_time,
             "set_ulimit.sh",
-            arguments=f"{fd_limit}",
+            arguments=f"{fd_limit} live" if live else f"{fd_limit}",
             vm_resource=True,
         )
+        self.add_vm_resource_helpers(entry, "set_ulimit.sh")
 
     def add_root_profiles(self):
         """
         Adds default ssh keys, .bashrc, .vimrc, etc. for the ``root`` user.
+        This is skipped if the profiles are baked into the VM's image.
         """
-        # root
-        self.drop_file(-249, "/root/combined_profiles.tgz", "combined_profiles.tgz")
-        self.run_executable(
-            -248, "chown", "-R root:root /root/combined_profiles.tgz", vm_resource=False
-        )
-        self.run_executable(
-            -247, "tar", "--no-same-owner -C /root/ -xf /root/combined_profiles.tgz"
-        )
-        self.run_executable(-246, "rm", "-f /root/combined_profiles.tgz")
+        if "root_profiles" in self.baked_steps:
+            return
+        self.install_profiles({"root": "/root"})
+
+    def install_profiles(self, homes, start_time=-249):
+        """
+        Adds default ssh keys, .bashrc, .vimrc, etc. (i.e. the contents of
+        ``combined_profiles.tgz``) to the home directories of many users at once.
+
+        All users are handled by a single ``install_profiles.sh`` VM resource, which
+        receives the archive once, decompresses it once, and then copies its
+        contents into every home directory in parallel (owned by the user).
+        Users who already receive the profiles (e.g. ``root``, from
+        :py:meth:`add_root_profiles`) are only handled once.
+
+        Arguments:
+            homes (dict): A mapping of username to home directory.
+            start_time (int, optional): The schedule time to install the profiles,
+                if they were not already scheduled. Defaults to -249.
+
+        Returns:
+            base_objects.ScheduleEntry: The schedule entry which installs the profiles.
+        """
+        if self._profiles_entry is None:
+            profile_homes = self._profile_homes
+
+            def render_homes():
+                return "".join(
+                    f"{user} {home}\n" for user, home in profile_homes.items()
+                )
+
+            self._profiles_entry = self.add_boot_vm_resource(
+                start_time,
+                "install_profiles.sh",
+                render_homes,
+                "combined_profiles.tgz",
+                step="profiles",
+                after=[],
+                idempotent=True,
+            )
+
+        for username, home in homes.items():
+            self._profile_homes.setdefault(username, str(home))
+        return self._profiles_entry
 
     def configure_ips(self, start_time=-200):
         """
@@ -131,14 +1376,29 @@ class LinuxHost:
         if not self.interfaces:
             return False
 
-        try:
-            nameservers = self.dns_nameservers
-            if isinstance(nameservers, list):
-                nameservers = " ".join(nameservers)
-        except AttributeError:
-            nameservers = ""
+        config = self._render_ip_config(_IPConfigCache())
+        if config is None:
+            return None
+        self._schedule_ip_config(config, start_time)
+        return True
+
+    def _render_ip_config(self, cache):
+        """
+        Render the input of ``configure_ips.sh``.
+
+        Arguments:
+            cache (_IPConfigCache): The strings shared with other VMs.
+
+        Returns:
+            str: The configuration or :py:data:`None` if no interface has an address.
+        """
+        nameservers = cache.nameservers(getattr(self, "dns_nameservers", None))[0]
+
+        # Add default gateway if there is one
+        gateway = cache.gateway(getattr(self, "default_gateway", None))
+        gateway = f" {gateway}" if gateway else ""
 
-        config = ""
+        lines = [nameservers]
         for iface in self.interfaces.interfaces:
             if (
                 "mac" in iface
@@ -147,31 +1407,32 @@ class LinuxHost:
                 and "netmask" in iface
                 and iface["netmask"]
             ):
-                config += "%s %s %s %s %s" % (
-                    iface["switch"].name,
-                    iface["mac"],
-                    str(iface["address"]),
-                    str(iface["netmask"]),
-                    str(iface["network"].prefixlen),
+                netmask, prefixlen = cache.netmask(iface)
+                lines.append(
+                    f"{iface['switch'].name} {iface['mac']} {iface['address']} "
+                    f"{netmask} {prefixlen}{'' if iface['control_network'] else gateway}"
                 )
 
-                # Add default gateway if there is one
-                gateway = getattr(self, "default_gateway", None)
-                if gateway and not iface["control_network"]:
-                    config += f" {gateway}"
-                config += "\n"
-
-        if not config:
-            return
+        if len(lines) == 1:
+            return None
 
-        config = f"{nameservers}\n{config}"
+        lines.append("")
+        return "\n".join(lines)
 
-        self.add_vm_resource(start_time, "configure_ips.sh", config)
+    def _schedule_ip_config(self, config, start_time):
+        """
+        Schedule ``configure_ips.sh`` with the given configuration.
 
-        return True
+        Arguments:
+            config (str): The configuration (see :py:meth:`_render_ip_config`).
+            start_time (int): The start time to configure the IP addresses.
+        """
+        self.add_boot_vm_resource(
+            start_time, "configure_ips.sh", config, step="configure_ips", after=[]
+        )
 
     def unpack_tar(
-        self, time, archive, options="-xzf", directory=None, vm_resource=False
+        self, time, archive, options=None, directory=None, vm_resource=False
     ):
         """
         Unpack the tar archive.
@@ -179,7 +1440,9 @@ class LinuxHost:
         This unpacks the tar archive, optionally into a specified
         directory. By default, the archive will be unpacked using the
         ``'-xzf'`` set of options, reading from the file given as the
-        ``archive`` argument. Other option combinations can be passed
+        ``archive`` argument. Zstandard-compressed archives (``.tar.zst``
+        or ``.tzst``) are instead decompressed with ``zstd``, which must
+        be installed on the VM. Other option combinations can be passed
         directly to the tar executable via the ``options`` parameter,
         or indirectly via the other method parameters.
 
@@ -191,10 +1454,11 @@ class LinuxHost:
                 :py:data:`True`, the name of the VM resource). Unless
                 ``vm_resource`` is :py:data:`True`, it is safest to
                 specify the absolute path of the archive on the VM.
-            options (str): The set of options to be passed to the tar
+            options (str, optional): The set of options to be passed to the tar
                 executable. This string must begin with ``'-x'`` and end
                 with ``'f'`` (or ``'-f'``) since this method only
-                performs extractions of named archives.
+                performs extractions of named archives. Defaults to ``'-xzf'``
+                (or ``'-xf'`` using ``zstd`` for Zstandard-compressed archives).
             directory (str or pathlib.Path, optional): A directory where
                 the archiving utility will move before unpacking the
                 archive. Specifying a directory is recommended when
@@ -206,6 +1470,13 @@ class LinuxHost:
         Raises:
             ValueError: If the provided options are unsupported.
         """
+        compress_program = []
+        if options is None:
+            options = "-xzf"
+            if str(archive).endswith((".tar.zst", ".tzst")):
+                # tar runs `zstd -d` to decompress the archive
+                options = "-xf"
+                compress_program = ["-I", "zstd"]
         if not options.startswith("-x"):
             raise ValueError(
                 "The `options` parameter must begin with '-x' since this method "
@@ -216,7 +1487,7 @@ class LinuxHost:
                 "The `options` parameter must end with 'f' (or '-f') since this "
                 "method requires that an archive file be specified for extraction."
             )
-        tar_options = shlex.split(options)
+        tar_options = [*compress_program, *shlex.split(options)]
         if directory:
             # Prevent duplicate `directory` options lest the kwarg be silently ignored
             if any(option in options for option in ["-C", "--directory"]):
@@ -232,6 +1503,78 @@ class LinuxHost:
             exec_vm_resource.add_file(archive, archive)
 
 
+class _IPConfigCache:
+    """
+    The strings which are shared between the IP configurations of many VMs (e.g.
+    the netmasks and nameservers), so that each is only computed once.
+    See :py:func:`configure_all_ips`.
+    """
+
+    def __init__(self):
+        """Start with empty caches."""
+        self._netmasks = {}
+        self._nameservers = {}
+        self._gateways = {}
+
+    def netmask(self, iface):
+        """
+        Get the netmask and prefix length of an interface.
+
+        Arguments:
+            iface (dict): The interface.
+
+        Returns:
+            tuple: The netmask and the prefix length of its network (as strings).
+        """
+        netmask = iface.get("netmask")
+        strings = self._netmasks.get(netmask)
+        if strings is None:
+            strings = (str(netmask), str(iface["network"].prefixlen))
+            # The prefix length can only be shared if it comes from the netmask
+            if netmask:
+                self._netmasks[netmask] = strings
+        return strings
+
+    def nameservers(self, nameservers):
+        """
+        Get the DNS nameservers of a VM in both of the forms used for configuration.
+
+        Arguments:
+            nameservers (list): The nameservers (or a space separated string of them).
+
+        Returns:
+            tuple: The space separated nameservers and a tuple of the nameservers.
+        """
+        if not nameservers:
+            return "", ()
+        key = nameservers if isinstance(nameservers, str) else tuple(nameservers)
+        strings = self._nameservers.get(key)
+        if strings is None:
+            if isinstance(nameservers, str):
+                strings = (nameservers, tuple(nameservers.split(" ")))
+            else:
+                strings = (" ".join(key), key)
+            self._nameservers[key] = strings
+        return strings
+
+    def gateway(self, gateway):
+        """
+        Get the default gateway of a VM as a string.
+
+        Arguments:
+            gateway (str): The default gateway (e.g. a :py:class:`netaddr.IPAddress`).
+
+        Returns:
+            str: The default gateway or :py:data:`None` if there is none.
+        """
+        if not gateway:
+            return None
+        string = self._gateways.get(gateway)
+        if string is None:
+            string = self._gateways[gateway] = str(gateway)
+        return string
+
+
 def configure_ip_conflict_handler(entry_name, _decorator_value, _current_instance_value):
     """
     The conflict handler for functions overwritten in LinuxNetplanHost that are
@@ -253,6 +1596,43 @@ def configure_ip_conflict_handler(entry_name, _decorator_value, _current_instanc
     raise IncorrectConflictHandlerError
 
 
+# Encode a string as a JSON string literal (the same encoder used by ``json.dumps``)
+_encode_json_string = json.encoder.encode_basestring_ascii
+
+
+@functools.lru_cache(maxsize=None)
+def _netplan_ethernet_template(nameservers, gateway):
+    """
+    Render a Netplan ethernet entry with placeholders for its MAC and IP address.
+    The entry is keyed by (and matches its device by) MAC address. On the VM,
+    ``set_netplan_interfaces.sh`` keys it by the kernel's name for the device, so
+    the device keeps its name.
+
+    Most VMs share their nameservers and default gateway, so the rendered template
+    is cached and only the MAC and IP address are filled in for each interface.
+
+    Args:
+        nameservers (tuple): The DNS nameservers.
+        gateway (str): The default gateway or :py:data:`None` if there is none.
+
+    Returns:
+        str: A ``%``-style template with ``mac`` and ``address`` keys which must be
+        JSON-encoded strings. The result matches the output of :py:func:`json.dumps`.
+    """
+    entry = {
+        "match": {"macaddress": "__mac__"},
+        "addresses": ["__address__"],
+        "nameservers": {"addresses": list(nameservers)},
+    }
+    if gateway is not None:
+        entry["gateway4"] = gateway
+    template = json.dumps({"__mac__": entry})[1:-1].replace("%", "%%")
+    return template.replace('"__mac__"', "%(mac)s").replace(
+        '"__address__"', "%(address)s"
+    )
+
+
+@graph_build_profiler.profile_class
 @require_class(LinuxHost, conflict_handler=configure_ip_conflict_handler)
 class LinuxNetplanHost:
     """
@@ -278,48 +1658,121 @@ class LinuxNetplanHost:
         if not self.interfaces:
             return False
 
-        try:
-            nameservers = self.dns_nameservers
-            if isinstance(nameservers, str):
-                nameservers = nameservers.split(" ")
-        except AttributeError:
-            nameservers = []
+        with graph_build_profiler.section("LinuxNetplanHost.configure_ips.render"):
+            config = self._render_netplan_config(_IPConfigCache())
+        if config is None:
+            return None
+        self._schedule_netplan_config(*config, start_time)
+        return True
 
-        ethernets = {}
-        macs = []
+    def _render_netplan_config(self, cache):
+        """
+        Render the Netplan configuration of the VM.
+
+        Arguments:
+            cache (_IPConfigCache): The strings shared with other VMs.
+
+        Returns:
+            tuple: The configuration and the MAC addresses of the configured
+            interfaces, or :py:data:`None` if no interface has an address.
+        """
+        nameservers = cache.nameservers(getattr(self, "dns_nameservers", None))[1]
+        gateway = cache.gateway(getattr(self, "default_gateway", None))
 
+        ethernets = []
+        macs = []
         for iface in self.interfaces.interfaces:
             if "mac" in iface and "address" in iface and iface["address"]:
-                ip_addr = str(iface["address"])
-                prefixlen = str(iface["network"].prefixlen)
-                address = f"{ip_addr}/{prefixlen}"
                 mac = iface["mac"]
                 macs.append(mac)
 
-                ethernets[mac] = {
-                    "addresses": [address],
-                    "nameservers": {"addresses": nameservers},
-                }
-                if not iface["control_network"] and hasattr(self, "default_gateway"):
-                    ethernets[mac]["gateway4"] = str(self.default_gateway)
-
-        config = {"network": {"ethernets": ethernets, "version": 2}}
+                template = _netplan_ethernet_template(
+                    nameservers, None if iface["control_network"] else gateway
+                )
+                address = f"{iface['address']}/{cache.netmask(iface)[1]}"
+                ethernets.append(
+                    template
+                    % {
+                        "mac": _encode_json_string(mac),
+                        "address": _encode_json_string(address),
+                    }
+                )
 
         if len(ethernets) == 0:
-            return
+            return None
 
         # Even though it uses YAML, we use JSON (since all JSON is valid YAML)
         # for ease of editing in other scripts if other settings need to be
         # applied
-        self.drop_content(
-            start_time - 1, "/etc/netplan/firewheel.yaml", json.dumps(config)
+        content = '{"network": {"ethernets": {%s}, "version": 2}}' % ", ".join(
+            ethernets
+        )
+        return content, macs
+
+    def _schedule_netplan_config(self, content, macs, start_time):
+        """
+        Schedule the Netplan configuration of the VM and the interfaces update.
+
+        Arguments:
+            content (str): The Netplan configuration.
+            macs (list): The MAC addresses of the configured interfaces.
+            start_time (int): The start time to configure the IP addresses.
+        """
+        self.drop_boot_content(
+            start_time - 1,
+            "/etc/netplan/firewheel.yaml",
+            content,
+            step="configure_ips.netplan",
+            after=[],
         )
         macs_str = " ".join(macs)
-        self.run_executable(
+        self.run_boot_executable(
             start_time,
             "set_netplan_interfaces.sh",
             arguments=f'"{macs_str}"',
             vm_resource=True,
+            step="configure_ips",
+            after=["configure_ips.netplan"],
         )
 
-        return True
+
+@graph_build_profiler.profile
+def configure_all_ips(hosts, start_time=-200):
+    """
+    Configure the IP addresses of many VMs at once (e.g. every VM in the graph).
+
+    This is equivalent to calling ``configure_ips`` on each VM, but the values
+    which VMs have in common (the netmask and prefix length of each network, the
+    nameservers, and the default gateways) are converted to strings once rather
+    than for each interface. This makes configuring large experiments much faster.
+    VMs which use Netplan (see :py:class:`LinuxNetplanHost`) are configured with
+    Netplan.
+
+    Arguments:
+        hosts (iterable): The vertices to configure (e.g. ``graph.get_vertices()``).
+            Vertices which are not Linux hosts are skipped.
+        start_time (int, optional): The start time to configure the IP addresses.
+            Defaults to -200.
+
+    Returns:
+        int: The number of VMs whose IP addresses were configured.
+    """
+    cache = _IPConfigCache()
+    configured = 0
+    for host in hosts:
+        if not host.is_decorated_by(LinuxHost):
+            continue
+        host.interfaces = getattr(host, "interfaces", None)
+        if not host.interfaces:
+            continue
+        if host.is_decorated_by(LinuxNetplanHost):
+            config = host._render_netplan_config(cache)
+            if config is not None:
+                host._schedule_netplan_config(*config, start_time)
+        else:
+            config = host._render_ip_config(cache)
+            if config is not None:
+                host._schedule_ip_config(config, start_time)
+        if config is not None:
+            configured += 1
+    return configured
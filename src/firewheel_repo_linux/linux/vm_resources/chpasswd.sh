@@ -1,5 +1,8 @@
 #!/bin/bash
 
+# Record the execution time of this VM resource (see vm_timing.sh)
+. "$(dirname "$0")/vm_timing.sh"
+
 USERNAME=$1
 PASSWORD=$2
 
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Configure the IP addresses of a Linux VM.
+
+This VM resource reads the same input as ``configure_ips.sh``: the first line
+contains the (space separated) DNS nameservers, and each following line contains
+``<network> <mac> <address> <netmask> <prefix> [<gateway>]``.
+
+Devices are located by reading ``/sys/class/net/*/address`` once. If a device
+has not appeared yet, this VMR waits on netlink link events rather than sleeping
+(see ``wait_for.py``, which must be in the same directory).
+All addresses are applied with a single ``ip -batch`` invocation.
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+from vm_timing import record_timing
+from wait_for import WaitTimeout, read_devices, wait_for_devices
+
+# How long to wait for devices to appear before giving up (in seconds)
+DEVICE_TIMEOUT = 600
+
+
+def read_config(path):
+    """
+    Parse the configuration file generated by ``LinuxHost.configure_ips``.
+
+    Arguments:
+        path (str): The path to the configuration file.
+
+    Returns:
+        tuple: A list of nameservers and a list of interface dictionaries.
+    """
+    with open(path, "r") as f_hand:
+        lines = f_hand.read().splitlines()
+
+    nameservers = lines[0].split() if lines else []
+    interfaces = []
+    for line in lines[1:]:
+        args = line.split()
+        if len(args) < 5:
+            continue
+        interfaces.append(
+            {
+                "network": args[0],
+                "mac": args[1].lower(),
+                "address": args[2],
+                "netmask": args[3],
+                "prefix": args[4],
+                "gateway": args[5] if len(args) > 5 else "",
+            }
+        )
+    return nameservers, interfaces
+
+
+def turn_off_network_manager():
+    """
+    Stop NetworkManager so that it does not overwrite the static configuration.
+    """
+    if os.path.isfile("/lib/systemd/system/NetworkManager.service"):
+        subprocess.call(["systemctl", "stop", "network-manager.service"])
+        subprocess.call(["systemctl", "disable", "network-manager.service"])
+
+    if os.path.isfile("/etc/init.d/network-manager"):
+        subprocess.call(["service", "network-manager", "stop"])
+        os.remove("/etc/init.d/network-manager")
+
+
+def set_dns_nameservers(nameservers):
+    """
+    Add the nameservers to ``/etc/resolv.conf`` (at most two, as before).
+
+    Arguments:
+        nameservers (list): The nameservers to add.
+    """
+    if not nameservers:
+        return
+    try:
+        with open("/etc/resolv.conf", "r") as f_hand:
+            existing = f_hand.read().splitlines()
+    except (IOError, OSError):
+        existing = []
+    lines = ["nameserver %s" % dns for dns in nameservers[:2]]
+    new_lines = [line for line in lines if line not in existing]
+    if new_lines:
+        with open("/etc/resolv.conf", "a") as f_hand:
+            f_hand.write("\n".join(new_lines) + "\n")
+
+
+def apply_addresses(configs):
+    """
+    Apply all addresses and gateways in one ``ip -batch`` invocation.
+
+    Arguments:
+        configs (list): Tuples of (device, interface dictionary).
+
+    Returns:
+        int: The exit code of ``ip``.
+    """
+    commands = []
+    gateways = []
+    for dev, iface in configs:
+        print("SETTING %s to IP: %s/%s" % (dev, iface["address"], iface["prefix"]))
+        commands.append("address flush dev %s" % dev)
+        commands.append(
+            "address add %s/%s dev %s" % (iface["address"], iface["prefix"], dev)
+        )
+        commands.append("link set dev %s up" % dev)
+        if iface["gateway"]:
+            gateways.append(iface["gateway"])
+    for gateway in gateways:
+        commands.append("route replace default via %s" % gateway)
+
+    proc = subprocess.Popen(
+        ["ip", "-force", "-batch", "-"], stdin=subprocess.PIPE, universal_newlines=True
+    )
+    proc.communicate("\n".join(commands) + "\n")
+    return proc.returncode
+
+
+def add_persistent_ifupdown(dev, iface, nameservers):
+    """
+    Persist the static configuration for ifupdown-based systems.
+
+    Arguments:
+        dev (str): The device name.
+        iface (dict): The interface configuration.
+        nameservers (list): The DNS nameservers.
+    """
+    stanza = [
+        "auto %s" % dev,
+        "iface %s inet static" % dev,
+        "    address %s" % iface["address"],
+        "    netmask %s" % iface["netmask"],
+    ]
+    if iface["gateway"]:
+        stanza.append("    gateway %s" % iface["gateway"])
+    if nameservers:
+        stanza.append("    dns-nameservers %s" % " ".join(nameservers))
+    stanza = "\n".join(stanza) + "\n"
+
+    if os.path.isdir("/etc/network/interfaces.d"):
+        with open(os.path.join("/etc/network/interfaces.d", dev), "w") as f_hand:
+            f_hand.write(stanza)
+        return
+
+    if os.path.isfile("/etc/network/interfaces"):
+        with open("/etc/network/interfaces", "r") as f_hand:
+            content = f_hand.read()
+        with open("/etc/network/interfaces", "a") as f_hand:
+            if "iface %s inet static" % dev not in content:
+                f_hand.write(stanza)
+            if "source /etc/network/interfaces.d/*" not in content:
+                f_hand.write("\nsource /etc/network/interfaces.d/*\n")
+
+
+def add_persistent_sysconfig(dev, iface, nameservers):
+    """
+    Persist the static configuration for sysconfig-based systems.
+
+    Arguments:
+        dev (str): The device name.
+        iface (dict): The interface configuration.
+        nameservers (list): The DNS nameservers.
+    """
+    iface_file = "/etc/sysconfig/network-scripts/ifcfg-%s" % dev
+    lines = []
+    if os.path.isfile(iface_file):
+        with open(iface_file, "r") as f_hand:
+            # Replace (rather than repeat) any settings from a previous run
+            lines = [
+                line
+                for line in f_hand.read().splitlines()
+                if not line.startswith(
+                    ("BOOTPROTO=", "IPADDR=", "NETMASK=", "GATEWAY=", "DNS1=", "DNS2=")
+                )
+            ]
+        lines.extend(
+            [
+                "IPADDR=%s" % iface["address"],
+                "NETMASK=%s" % iface["netmask"],
+                "BOOTPROTO=static",
+            ]
+        )
+    if iface["gateway"]:
+        lines.append("GATEWAY=%s" % iface["gateway"])
+    for i, dns in enumerate(nameservers[:2]):
+        lines.append("DNS%d=%s" % (i + 1, dns))
+    with open(iface_file, "w") as f_hand:
+        f_hand.write("\n".join(lines) + "\n")
+
+
+def main(config_path):
+    """
+    Configure all interfaces described in ``config_path``.
+
+    Arguments:
+        config_path (str): The path to the configuration file.
+
+    Returns:
+        int: The exit code for this VMR.
+    """
+    nameservers, interfaces = read_config(config_path)
+
+    try:
+        devices = wait_for_devices(
+            [iface["mac"] for iface in interfaces], timeout=DEVICE_TIMEOUT
+        )
+    except WaitTimeout as exp:
+        sys.stderr.write("%s\n" % exp)
+        devices = read_devices()
+    for mac, dev in sorted(devices.items()):
+        print("%s -> %s" % (dev, mac))
+
+    turn_off_network_manager()
+    set_dns_nameservers(nameservers)
+
+    configs = []
+    exit_code = 0
+    for iface in interfaces:
+        dev = devices.get(iface["mac"])
+        if not dev:
+            sys.stderr.write("UNABLE TO FIND DEVICE FOR %s\n" % iface["mac"])
+            exit_code = 1
+            continue
+        configs.append((dev, iface))
+
+    if configs and apply_addresses(configs) != 0:
+        exit_code = 1
+
+    for dev, iface in configs:
+        if os.path.isdir("/etc/network"):
+            add_persistent_ifupdown(dev, iface, nameservers)
+        if os.path.isdir("/etc/sysconfig/network-scripts"):
+            add_persistent_sysconfig(dev, iface, nameservers)
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    START = time.time()
+    EXIT_CODE = 1
+    try:
+        EXIT_CODE = main(sys.argv[1])
+    finally:
+        record_timing(START, EXIT_CODE)
+    sys.exit(EXIT_CODE)
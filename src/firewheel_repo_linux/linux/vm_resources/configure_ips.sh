@@ -1,8 +1,25 @@
 #!/bin/bash
 
+# Prefer the Python implementation, which configures all interfaces in a single
+# pass and waits on netlink events instead of sleeping.
+PY_CONFIGURE_IPS="$(dirname "$0")/configure_ips.py"
+if [ -f "$PY_CONFIGURE_IPS" ] && command -v python3 >/dev/null 2>&1; then
+    exec python3 "$PY_CONFIGURE_IPS" "$@"
+fi
+
+# Record the execution time of this VM resource (see vm_timing.sh)
+. "$(dirname "$0")/vm_timing.sh"
+
+# Wait on netlink events (via "ip monitor") rather than sleeping
+. "$(dirname "$0")/wait_for.sh"
+
+# How long to wait for devices to appear before giving up (in seconds)
+DEVICE_TIMEOUT=600
+
 DEVS=()
 MACS=()
 USED_DEVS=()
+FAILED=0
 NAMESERVERS=$(head -n 1 $1)
 # Remove nameservers from the dynamic file
 sed -i '1d' $1
@@ -12,6 +29,7 @@ get_interface_names () {
 }
 
 get_macs () {
+    MACS=()
     for dev in ${DEVS[@]}
     do
         mac="$(ip address show $dev | grep ether | awk '{print $2}')"
@@ -42,14 +60,19 @@ set_gateway () {
     fi
 }
 
+# Append a line to a file unless it is already there
+append_once () {
+    grep -qxF "$2" "$1" 2>/dev/null || echo "$2" >> "$1"
+}
+
 set_dns_nameservers () {
     if [ ! -z "$NAMESERVERS" ]; then
         DNS1=$(echo $NAMESERVERS | awk '{print $1}')
-        echo "nameserver ${DNS1}" >> /etc/resolv.conf
+        append_once /etc/resolv.conf "nameserver ${DNS1}"
 
         DNS2=$(echo $NAMESERVERS | awk '{print $2}')
         if [ ! -z "$DNS2" ]; then
-            echo "nameserver ${DNS2}" >> /etc/resolv.conf
+            append_once /etc/resolv.conf "nameserver ${DNS2}"
         fi
     fi
 }
@@ -62,15 +85,22 @@ set_ip () {
     ip addr add dev $1 $2
     ip link set dev $1 up
 
-    ip addr | grep $2
-    while [ $? -ne 0 ]; do
-        echo "IP did not take, sleeping and trying again"
-        sleep 1
+    until wait_until 5 "the address $2 on $1" "ip monitor address" has_address $1 $2
+    do
+        echo "IP did not take, trying again"
+        RETRIES=$((RETRIES + 1))
         ip addr add dev $1 $2
-        ip addr | grep $2
     done
 }
 
+has_address () {
+    ip -o addr show dev $1 | grep -qwF "$2"
+}
+
+has_device () {
+    grep -qixF "$1" /sys/class/net/*/address 2>/dev/null
+}
+
 find_device () {
     for (( i=0; i<${#MACS[@]}; i++ ));
     do
@@ -108,6 +138,9 @@ EOF
         return
     fi
     if [ -f /etc/network/interfaces ]; then
+        if grep -qxF "iface ${DEV} inet static" /etc/network/interfaces; then
+            return
+        fi
         cat >>/etc/network/interfaces <<EOF
 auto ${DEV}
 iface ${DEV} inet static
@@ -138,7 +171,8 @@ add_persistent_sysconfig_static_ip () {
     GATEWAY=$5
     IFACE_FILE="/etc/sysconfig/network-scripts/ifcfg-${DEV}"
     if [ -f $IFACE_FILE ]; then
-        sed -i '/^BOOTPROTO=/d' $IFACE_FILE
+        # Replace (rather than repeat) any settings from a previous run
+        sed -i -E '/^(BOOTPROTO|IPADDR|NETMASK|GATEWAY|DNS1|DNS2)=/d' $IFACE_FILE
         echo "IPADDR=${ADDR}" >> $IFACE_FILE
         echo "NETMASK=${NETMASK}" >> $IFACE_FILE
         echo "BOOTPROTO=static" >> $IFACE_FILE
@@ -177,32 +211,15 @@ EOF
 
 check_link_up () {
     # This function is for systemd configurations
-    routable=$(networkctl status $1 | grep State | grep routable)
-    if [ -z $routable ]
-    then
-        return 0
-    fi
-
-    configured=$(networkctl status $1 | grep State | grep configured)
-    if [ -z $configured ]
-    then
-        return 0
-    fi
-
-    return 1
+    networkctl status $1 | grep State | grep -q -e routable -e configured
 }
 
 check_all_links () {
     # This function is for systemd configurations
     for link in ${USED_DEVS[@]}
     do
-        while true; do
-            if [ $(check_link_up $link) -eq 1 ]
-            then
-                break
-            fi
-            sleep 2
-        done
+        wait_until $DEVICE_TIMEOUT "$link to be configured" "ip monitor link address" \
+            check_link_up $link
     done
 }
 
@@ -226,37 +243,46 @@ while read line; do
 
     if [ ${#args[@]} -gt 2 ]
     then
-        while true; do
-            NETWORK=${args[0]}
-            MAC=${args[1]}
-            ADDR=${args[2]}
-            NETMASK=${args[3]}
-            PREFIX=${args[4]}
-            GATEWAY=""
-
-            if [ ${#args[@]} -eq 6 ]
-            then
-                GATEWAY=${args[5]}
-            fi
+        NETWORK=${args[0]}
+        MAC=${args[1]}
+        ADDR=${args[2]}
+        NETMASK=${args[3]}
+        PREFIX=${args[4]}
+        GATEWAY=""
+
+        if [ ${#args[@]} -eq 6 ]
+        then
+            GATEWAY=${args[5]}
+        fi
 
-            DEV=$(find_device $MAC)
+        DEV=$(find_device $MAC)
 
-            if [[ ! -z $DEV ]]
+        if [[ -z $DEV ]]
+        then
+            if wait_until $DEVICE_TIMEOUT "a device with the MAC $MAC" "ip monitor link" \
+                has_device $MAC
             then
-                set_ip $DEV "${ADDR}/${PREFIX}"
-                set_gateway $GATEWAY
-                if [ -d /etc/network ]; then
-                    add_persistent_network_manager_static_ip $DEV $MAC $ADDR $NETMASK $GATEWAY
-                fi
-                if [ -d /etc/sysconfig/network-scripts ]; then
-                    add_persistent_sysconfig_static_ip $DEV $MAC $ADDR $NETMASK $GATEWAY
-                fi
-                break
+                get_interface_info
+                DEV=$(find_device $MAC)
             fi
+        fi
+
+        if [[ -z $DEV ]]
+        then
+            >&2 echo "UNABLE TO FIND DEVICE FOR $MAC"
+            FAILED=1
+            continue
+        fi
 
-            >&2 echo "UNABLE TO FIND DEVICE FOR $MAC, sleeping"
-            sleep 5
-            get_interface_info
-        done
+        set_ip $DEV "${ADDR}/${PREFIX}"
+        set_gateway $GATEWAY
+        if [ -d /etc/network ]; then
+            add_persistent_network_manager_static_ip $DEV $MAC $ADDR $NETMASK $GATEWAY
+        fi
+        if [ -d /etc/sysconfig/network-scripts ]; then
+            add_persistent_sysconfig_static_ip $DEV $MAC $ADDR $NETMASK $GATEWAY
+        fi
     fi
 done < $1
+
+exit $FAILED
@@ -0,0 +1,54 @@
+#!/bin/bash
+
+#######################################
+# Installs the default profiles (ssh keys, .bashrc, .vimrc, etc.) for many users
+#
+# Usage: install_profiles.sh <homes file> <profiles archive>
+#
+# Each line of the homes file has the form "<username> <home directory>".
+# The archive is only decompressed once. Its contents are then copied into every
+# home directory in parallel, owned by the user (and their primary group), so no
+# separate chown steps are needed.
+#######################################
+
+# Record the execution time of this VM resource (see vm_timing.sh)
+. "$(dirname "$0")/vm_timing.sh"
+
+HOMES=$1
+ARCHIVE=$2
+
+STAGING=$(mktemp -d)
+if ! tar --no-same-owner -C "$STAGING" -xf "$ARCHIVE"; then
+    rm -rf "$STAGING"
+    exit 1
+fi
+# The top level entries of the archive (excluding "." so that the permissions of
+# the home directories are not changed)
+mapfile -t ENTRIES < <(ls -A "$STAGING")
+
+FAILED=0
+PIDS=()
+while read -r user home || [ -n "$user" ]
+do
+    if [ -z "$user" ]; then
+        continue
+    fi
+    if ! group=$(id -gn "$user") || [ ! -d "$home" ]; then
+        >&2 echo "Unable to install the profiles of ${user} into ${home}"
+        FAILED=1
+        continue
+    fi
+    echo "Installing the profiles of ${user} into ${home}"
+    # Extracting as root keeps the owner recorded in the archive
+    tar -C "$STAGING" --owner="$user" --group="$group" -cf - -- "${ENTRIES[@]}" \
+        | tar -C "$home" -xpf - &
+    PIDS+=($!)
+done < "$HOMES"
+
+for pid in "${PIDS[@]}"
+do
+    wait "$pid" || FAILED=1
+done
+
+rm -rf "$STAGING"
+exit $FAILED
@@ -0,0 +1,57 @@
+#!/bin/bash
+
+#######################################
+# Runs a boot step unless it already ran with the same inputs
+#
+# Usage: run_once.sh <step> <program> [arguments...]
+#
+# The fingerprint of a step is the sha256 hash of its name, program, and
+# arguments, where the contents of the program and of any argument which is a
+# file are used rather than their paths. The fingerprint is recorded in
+# /var/lib/firewheel/steps once the program succeeds, so when the VM is
+# restarted (or its schedule is replayed) the step is skipped unless one of its
+# inputs changed. Nothing is recorded if the program requested a reboot (i.e. it
+# created the "reboot" file), as it will be run again afterwards.
+#######################################
+
+STEP=$1
+shift
+
+STATE_DIR=/var/lib/firewheel/steps
+
+fingerprint () {
+    printf 'step %s\n' "$STEP"
+    for arg in "$@"
+    do
+        if [ -f "$arg" ]; then
+            printf 'file '
+            sha256sum < "$arg"
+        else
+            printf 'arg %s\n' "$arg"
+        fi
+    done
+}
+
+FINGERPRINT=$(fingerprint "$@" | sha256sum | awk '{print $1}')
+RECORD="${STATE_DIR}/${STEP//\//_}.${FINGERPRINT}"
+
+if [ -e "$RECORD" ]; then
+    echo "Skipping ${STEP}: it already ran with the same inputs"
+    exit 0
+fi
+
+PROGRAM=$1
+shift
+# Programs loaded by the schedule entry are in the current directory
+if [ -f "$PROGRAM" ] && [[ "$PROGRAM" != */* ]]; then
+    PROGRAM="./${PROGRAM}"
+fi
+
+"$PROGRAM" "$@" || exit $?
+
+if [ -e reboot ]; then
+    exit 0
+fi
+
+mkdir -p "$STATE_DIR"
+touch "$RECORD"
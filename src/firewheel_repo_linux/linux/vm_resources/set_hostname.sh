@@ -1,8 +1,7 @@
 #!/bin/bash
 
-if [ -f "done" ] ; then
-    exit 0
-fi
+# Record the execution time of this VM resource (see vm_timing.sh)
+. "$(dirname "$0")/vm_timing.sh"
 
 if [ -f /etc/debian_version ] ; then
     # Put the hostname in the hostname file
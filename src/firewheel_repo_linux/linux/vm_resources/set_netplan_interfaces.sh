@@ -1,48 +1,49 @@
 #!/bin/bash
 
 #This script takes a list of MAC addresses and replaces them in
-#/etc/netplan/firewheel.yaml with their device (interface) name
+#/etc/netplan/firewheel.yaml with their device (interface) name, i.e. the name
+#the kernel gave the device. Each entry already matches its device by MAC
+#address, so the device is also pinned with "set-name" (to the name it already
+#has, so the device is never renamed). All replacements are made in a single
+#pass, and the file is only rewritten if any entry is still keyed by MAC address.
+
+# Record the execution time of this VM resource (see vm_timing.sh)
+. "$(dirname "$0")/vm_timing.sh"
 
 #A space separated string of MAC addresses to replace
 SEARCH_MACS=$1
 
-DEVS=()
-MACS=()
+NETPLAN_FILE=/etc/netplan/firewheel.yaml
 
-get_interface_names () {
-    DEVS=($(ip -o link show | awk -F': ' '{print $2}'))
-}
+# Only rewrite the file if any entry is still keyed by a MAC address
+if grep -qiE '"([0-9a-f]{2}:){5}[0-9a-f]{2}": \{' $NETPLAN_FILE
+then
+    declare -A DEVS
 
-get_macs () {
-    for dev in ${DEVS[@]}
+    # Map every MAC address to its device without forking per device
+    for path in /sys/class/net/*/address
     do
-        mac="$(ip address show $dev | grep ether | awk '{print $2}')"
-        MACS+=("${mac}")
+        read -r mac < "$path"
+        dev=${path%/address}
+        DEVS[${mac,,}]=${dev##*/}
     done
-}
 
-find_device () {
-    for (( i=0; i<${#MACS[@]}; i++ ));
+    SED_ARGS=()
+    for mac in $SEARCH_MACS
     do
-        if [ "${MACS[$i]}" == $1 ]
-        then
-            echo ${DEVS[$i]}
-            return 0
+        dev=${DEVS[${mac,,}]}
+        echo "$mac=$dev"
+        if [ -z "$dev" ]; then
+            # The entry still matches on the MAC address, so leave it as is
+            >&2 echo "Unable to find device for $mac"
+            continue
         fi
+        SED_ARGS+=(-e "s/\"${mac}\": {/\"${dev}\": {\"set-name\": \"${dev}\", /I")
     done
 
-    echo ""
-    return 1
-}
-
-get_interface_names
-get_macs
-
-for mac in $SEARCH_MACS
-do
-    dev=$(find_device $mac)
-    echo "$mac=$dev"
-    sed -i "s/$mac/$dev/g" /etc/netplan/firewheel.yaml
-done
+    if [ ${#SED_ARGS[@]} -gt 0 ]; then
+        sed -i "${SED_ARGS[@]}" $NETPLAN_FILE
+    fi
+fi
 
 netplan apply
@@ -0,0 +1,48 @@
+#!/bin/bash
+
+#######################################
+# Sets the passwords of many users at once
+#
+# Usage: set_passwords.sh <passwords file>
+#
+# Each line of the passwords file has the form "<flags> <username>:<password>".
+# The flags are "-" or any of:
+#   c: Create the user (with a home directory) if it does not exist.
+#   e: The password is already encrypted (a crypt(3) hash).
+# All plain text passwords are set by a single chpasswd run and all encrypted
+# passwords by a single "chpasswd -e" run.
+#######################################
+
+# Record the execution time of this VM resource (see vm_timing.sh)
+. "$(dirname "$0")/vm_timing.sh"
+
+PLAIN=()
+ENCRYPTED=()
+
+while IFS= read -r line || [ -n "$line" ]
+do
+    if [ -z "$line" ]; then
+        continue
+    fi
+    flags=${line%% *}
+    entry=${line#* }
+    user=${entry%%:*}
+
+    if [[ "$flags" == *c* ]] && ! id -u "$user" > /dev/null 2>&1; then
+        useradd -m -s /bin/bash "$user" || exit 1
+    fi
+
+    if [[ "$flags" == *e* ]]; then
+        ENCRYPTED+=("$entry")
+    else
+        PLAIN+=("$entry")
+    fi
+done < "$1"
+
+if [ ${#PLAIN[@]} -gt 0 ]; then
+    printf '%s\n' "${PLAIN[@]}" | chpasswd || exit 1
+fi
+
+if [ ${#ENCRYPTED[@]} -gt 0 ]; then
+    printf '%s\n' "${ENCRYPTED[@]}" | chpasswd -e || exit 1
+fi
@@ -2,8 +2,19 @@
 
 #######################################
 # Set's the limit for the number of open files
+#
+# Usage: set_ulimit.sh <limit> [live]
+#
+# The limits are written to drop-in configuration files, so running this
+# script again does not add duplicate entries. By default, the VM is rebooted
+# so that the new limits apply everywhere. With "live", the limits are instead
+# applied to the running system (sysctl, prlimit on all running processes and
+# re-executing systemd) and the VM is only rebooted if that is not possible.
 #######################################
 
+# Record the execution time of this VM resource (see vm_timing.sh)
+. "$(dirname "$0")/vm_timing.sh"
+
 # Check to see if a reboot file exists and if it does
 # that means we have set the ulimit and can complete
 if [ -e has_rebooted ]
@@ -12,19 +23,104 @@ then
 fi
 
 FD_LIMIT=$1
+MODE=$2
+
+# Write a file only if its contents differ, returns 0 if the file changed
+write_config () {
+    local path=$1
+    local content=$2
+    if [ -f "$path" ] && [ "$(cat "$path")" == "$content" ]; then
+        return 1
+    fi
+    mkdir -p "$(dirname "$path")"
+    echo "$content" > "${path}.tmp"
+    mv -f "${path}.tmp" "$path"
+    return 0
+}
+
+CHANGED=0
 
 # Set the default limit for systemd processes
-echo -e "DefaultLimitNOFILE=${FD_LIMIT}" >> /etc/systemd/user.conf
-echo -e "DefaultLimitNOFILE=${FD_LIMIT}" >> /etc/systemd/system.conf
+if [ -d /etc/systemd ]; then
+    for conf in system user
+    do
+        write_config "/etc/systemd/${conf}.conf.d/firewheel-nofile.conf" \
+            "$(printf '[Manager]\nDefaultLimitNOFILE=%s' "$FD_LIMIT")" && CHANGED=1
+    done
+fi
 
 # Set the default limit for PAM logged in users
-echo -e "* soft nofile ${FD_LIMIT}\n" >> /etc/security/limits.conf
-echo -e "* hard nofile ${FD_LIMIT}\n" >> /etc/security/limits.conf
-echo -e "root soft nofile ${FD_LIMIT}\n" >> /etc/security/limits.conf
-echo -e "root hard nofile ${FD_LIMIT}\n" >> /etc/security/limits.conf
+write_config /etc/security/limits.d/90-firewheel-nofile.conf \
+    "$(printf '%s\n' \
+        "* soft nofile ${FD_LIMIT}" \
+        "* hard nofile ${FD_LIMIT}" \
+        "root soft nofile ${FD_LIMIT}" \
+        "root hard nofile ${FD_LIMIT}")" && CHANGED=1
 
 # Set the number of open file max
-echo -e "fs.file-max = ${FD_LIMIT}" >> /etc/sysctl.conf
+write_config /etc/sysctl.d/90-firewheel-file-max.conf \
+    "fs.file-max = ${FD_LIMIT}" && CHANGED=1
+
+# Check if a limit is at least the new limit ("unlimited" always is)
+at_least () {
+    [ "$1" == "unlimited" ] || [ "$1" -ge "$FD_LIMIT" ]
+}
+
+# Check if the running system already has (at least) the new limits
+limits_applied () {
+    at_least "$(ulimit -Hn)" && at_least "$(cat /proc/sys/fs/file-max)"
+}
+
+if [ $CHANGED -eq 0 ] && limits_applied; then
+    echo "The open file limit is already ${FD_LIMIT}"
+    exit 0
+fi
+
+# Raise the open file limit of every running process (never lowering it)
+raise_process_limits () {
+    local pid soft hard
+    for limits in /proc/[0-9]*/limits
+    do
+        pid=${limits#/proc/}
+        pid=${pid%/limits}
+        # Skip kernel threads (the children of kthreadd)
+        if [ "$pid" == "2" ] || grep -q "^PPid:[[:space:]]*2$" "/proc/${pid}/status" 2>/dev/null; then
+            continue
+        fi
+        read -r soft hard < <(awk '/^Max open files/ {print $4, $5}' "$limits" 2>/dev/null)
+        if [ -z "$hard" ]; then
+            # The process has already exited
+            continue
+        fi
+        if at_least "$soft" && at_least "$hard"; then
+            continue
+        fi
+        at_least "$soft" || soft=$FD_LIMIT
+        at_least "$hard" || hard=$FD_LIMIT
+        # Ignore processes which exit in the meantime
+        prlimit --pid "$pid" --nofile="${soft}:${hard}" 2>/dev/null || [ ! -e "$limits" ] || return 1
+    done
+}
+
+apply_live () {
+    # Live application relies on systemd and prlimit
+    if [ ! -d /run/systemd/system ] || ! command -v prlimit > /dev/null; then
+        >&2 echo "Unable to apply the open file limit without a reboot"
+        return 1
+    fi
+    if ! at_least "$(cat /proc/sys/fs/file-max)"; then
+        sysctl -w "fs.file-max=${FD_LIMIT}" || return 1
+    fi
+    # Re-execute systemd so that it reads the new default limits
+    systemctl daemon-reexec || return 1
+    raise_process_limits || return 1
+    limits_applied
+}
+
+if [ "$MODE" == "live" ] && apply_live; then
+    echo "Applied the open file limit of ${FD_LIMIT} without a reboot"
+    exit 0
+fi
 
 touch reboot
 touch has_rebooted
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Record the execution time of a VM resource.
+
+This is a small library shared by the Python VM resources (it is compatible with
+Python 2.7 and 3, see ``vm_timing.sh`` for the shell VM resources). Each VM
+resource appends a JSON record to :py:data:`TIMING_LOG` when it exits::
+
+    START = time.time()
+    EXIT_CODE = 1
+    try:
+        ...
+        EXIT_CODE = 0
+    finally:
+        record_timing(START, EXIT_CODE)
+
+The records are collected with ``LinuxHost.collect_vm_resource_timings``.
+"""
+
+import os
+import sys
+import json
+import time
+
+# The file to which VM resources append their timing records
+TIMING_LOG = "/var/log/firewheel/vm_resources.jsonl"
+
+
+def record_timing(start, exit_code, retries=0):
+    """
+    Append a timing record for this VM resource to :py:data:`TIMING_LOG`.
+
+    Arguments:
+        start (float): The time at which the VM resource started.
+        exit_code (int): The exit code of the VM resource.
+        retries (int): The number of times a failing operation was retried.
+    """
+    os_name = ""
+    try:
+        with open("/etc/os-release") as f_hand:
+            for line in f_hand:
+                if line.startswith("PRETTY_NAME="):
+                    os_name = line.split("=", 1)[1].strip().strip('"')
+    except (IOError, OSError):
+        pass
+    record = {
+        "resource": os.path.basename(sys.argv[0]),
+        "cwd": os.getcwd(),
+        "os": os_name,
+        "start": start,
+        "end": time.time(),
+        "retries": retries,
+        "exit_code": exit_code,
+    }
+    try:
+        if not os.path.isdir(os.path.dirname(TIMING_LOG)):
+            os.makedirs(os.path.dirname(TIMING_LOG))
+        with open(TIMING_LOG, "a") as f_hand:
+            f_hand.write(json.dumps(record, sort_keys=True) + "\n")
+    except (IOError, OSError) as exp:
+        sys.stderr.write("Unable to record the timing of this VMR: %s\n" % exp)
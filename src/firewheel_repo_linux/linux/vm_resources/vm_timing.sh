@@ -0,0 +1,29 @@
+#!/bin/bash
+
+#######################################
+# Records the execution time of a VM resource (the shell counterpart of vm_timing.py)
+#
+# Usage (at the top of a shell VM resource):
+#   . "$(dirname "$0")/vm_timing.sh"
+#
+# A JSON record with the name of the VM resource, its working directory, the OS
+# of the VM, its start and end times, the number of retries, and its exit code
+# is appended to TIMING_LOG when the VM resource exits. This uses an EXIT trap, so
+# the VM resource must not set its own. VM resources which retry an operation
+# should increment RETRIES. The records are collected with
+# LinuxHost.collect_vm_resource_timings.
+#######################################
+
+TIMING_LOG=/var/log/firewheel/vm_resources.jsonl
+TIMING_START=$(date +%s.%N)
+TIMING_CWD=$PWD
+RETRIES=0
+
+record_timing () {
+    exit_code=$?
+    mkdir -p "${TIMING_LOG%/*}"
+    printf '{"resource": "%s", "cwd": "%s", "os": "%s", "start": %s, "end": %s, "retries": %d, "exit_code": %d}\n' \
+        "${0##*/}" "$TIMING_CWD" "$(. /etc/os-release 2>/dev/null; echo "$PRETTY_NAME")" \
+        "$TIMING_START" "$(date +%s.%N)" "$RETRIES" "$exit_code" >> "$TIMING_LOG"
+}
+trap record_timing EXIT
@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+"""
+Wait for conditions on a Linux VM without polling.
+
+This is a small library shared by the Python VM resources (it is compatible with
+Python 2.7 and 3). A condition is checked once and then only re-checked when the
+kernel reports a relevant event:
+
+* Files are watched with inotify (on the closest existing directory of the path).
+* Network devices, links, and addresses are watched with netlink.
+
+If the events are not available (e.g. in a container), the condition is checked
+every second instead. Every wait has an (optional) timeout, after which
+:py:class:`WaitTimeout` is raised with a description of the condition.
+
+It can also be run as a script, e.g. from shell VM resources::
+
+    $ python wait_for.py --timeout 60 file /tmp/dependency_done
+    $ python wait_for.py --timeout 600 device 00:11:22:33:44:55
+    $ python wait_for.py --timeout 30 link eth0
+    $ python wait_for.py --timeout 10 address eth0 10.0.0.1/24
+
+The exit code is 0 once the condition is true and 1 if the wait timed out.
+"""
+
+import os
+import sys
+import glob
+import time
+import errno
+import select
+import socket
+import ctypes
+import argparse
+import subprocess
+import ctypes.util
+
+# Multicast groups for netlink notifications (see ``linux/rtnetlink.h``)
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+# inotify flags (see ``sys/inotify.h``)
+IN_ATTRIB = 0x4
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# How often conditions are checked when events are not available (in seconds)
+POLL_INTERVAL = 1
+
+
+class WaitTimeout(Exception):
+    """A condition did not become true before the timeout."""
+
+
+def chain(error, cause):
+    """
+    Record the exception which caused another one, like ``raise error from cause``
+    (which is not valid syntax on Python 2).
+
+    Arguments:
+        error (Exception): The exception to raise.
+        cause (Exception): The exception which caused it.
+
+    Returns:
+        Exception: The ``error``.
+    """
+    error.__cause__ = cause
+    return error
+
+
+class NetlinkMonitor(object):
+    """
+    Receive netlink route notifications (e.g. link or address changes).
+    """
+
+    def __init__(self, groups):
+        """
+        Subscribe to the given netlink multicast groups.
+
+        Arguments:
+            groups (int): The ``RTMGRP_*`` groups to subscribe to.
+
+        Raises:
+            OSError: If netlink is not available.
+        """
+        error = None
+        try:
+            self.sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE
+            )
+            self.sock.bind((0, groups))
+        except (AttributeError, socket.error) as exp:
+            error = chain(OSError("Unable to monitor netlink: %s" % exp), exp)
+        if error is not None:
+            raise error
+
+    def fileno(self):
+        """
+        Get the file descriptor to wait on.
+
+        Returns:
+            int: The file descriptor of the netlink socket.
+        """
+        return self.sock.fileno()
+
+    def drain(self):
+        """
+        Discard the pending notifications. Their contents are not needed as the
+        condition is checked again anyway. For the same reason, it does not matter
+        if notifications were lost because the receive buffer overflowed
+        (``ENOBUFS``).
+        """
+        try:
+            self.sock.recv(65536)
+        except socket.error as exp:
+            if exp.errno != errno.ENOBUFS:
+                raise
+
+    def close(self):
+        """Close the netlink socket."""
+        self.sock.close()
+
+
+class InotifyMonitor(object):
+    """
+    Receive inotify events for a path which may not exist yet.
+
+    The closest existing directory of the path (or the path itself, once it
+    exists) is watched. The watch moves further down whenever an event occurs,
+    so that nested directories which are created later are also followed.
+    """
+
+    def __init__(self, path):
+        """
+        Start watching the given path.
+
+        Arguments:
+            path (str): The path to watch.
+
+        Raises:
+            OSError: If inotify is not available.
+        """
+        self.path = os.path.abspath(path)
+        self.libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "Unable to initialize inotify")
+        self.watch = None
+        self.watched = None
+        self.rewatch()
+
+    def rewatch(self):
+        """
+        Watch the closest existing directory of the path (or the path itself).
+
+        Raises:
+            OSError: If the watch cannot be added.
+        """
+        target = self.path
+        while not os.path.exists(target) and os.path.dirname(target) != target:
+            target = os.path.dirname(target)
+        if target == self.watched:
+            return
+        if self.watch is not None:
+            self.libc.inotify_rm_watch(self.fd, self.watch)
+        mask = IN_CREATE | IN_MOVED_TO | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF
+        self.watch = self.libc.inotify_add_watch(
+            self.fd, target.encode("utf-8"), mask
+        )
+        if self.watch < 0:
+            raise OSError(ctypes.get_errno(), "Unable to watch %s" % target)
+        self.watched = target
+
+    def fileno(self):
+        """
+        Get the file descriptor to wait on.
+
+        Returns:
+            int: The inotify file descriptor.
+        """
+        return self.fd
+
+    def drain(self):
+        """Discard the pending events and follow any newly created directories."""
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except OSError as exp:
+            if exp.errno != errno.EAGAIN:
+                raise
+        # The watched directory may have been replaced, so always watch it again
+        self.watched = None
+        self.rewatch()
+
+    def close(self):
+        """Stop watching the path."""
+        os.close(self.fd)
+
+
+def open_monitor(factory, *args):
+    """
+    Create a monitor, falling back to polling if it is not available.
+
+    Arguments:
+        factory (type): The monitor class.
+        *args: The arguments of the monitor.
+
+    Returns:
+        object: The monitor or :py:data:`None` if it is unavailable.
+    """
+    try:
+        return factory(*args)
+    except OSError as exp:
+        sys.stderr.write("%s, falling back to polling\n" % exp)
+        return None
+
+
+def wait_until(condition, description, timeout=None, monitor=None):
+    """
+    Wait until a condition is true, checking it again whenever the monitor
+    reports an event (or every :py:data:`POLL_INTERVAL` seconds without a monitor).
+
+    Arguments:
+        condition (callable): Returns a true value once the wait is over.
+        description (str): What is being waited for (used in messages).
+        timeout (float): The maximum number of seconds to wait. If this is
+            :py:data:`None`, wait forever.
+        monitor (object): The source of events (with ``fileno`` and ``drain``
+            methods). The monitor is not closed.
+
+    Returns:
+        object: The (true) result of the condition.
+
+    Raises:
+        WaitTimeout: If the condition is not true before the timeout.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    waiting = False
+    while True:
+        result = condition()
+        if result:
+            return result
+        remaining = None if deadline is None else deadline - time.time()
+        if remaining is not None and remaining <= 0:
+            raise WaitTimeout(
+                "Timed out after %s seconds waiting for %s" % (timeout, description)
+            )
+        if not waiting:
+            sys.stderr.write("Waiting for %s\n" % description)
+            waiting = True
+        if monitor is None:
+            interval = POLL_INTERVAL if remaining is None else remaining
+            time.sleep(min(POLL_INTERVAL, interval))
+            continue
+        try:
+            readable = select.select([monitor], [], [], remaining)[0]
+        except select.error as exp:
+            if exp.args[0] == errno.EINTR:
+                continue
+            raise
+        if readable:
+            monitor.drain()
+
+
+def wait_for_file(path, timeout=None):
+    """
+    Wait until a file (or directory) exists.
+
+    Arguments:
+        path (str): The path of the file.
+        timeout (float): The maximum number of seconds to wait.
+
+    Returns:
+        bool: :py:data:`True`.
+    """
+    # Watch before checking so that no event can be missed in between
+    monitor = open_monitor(InotifyMonitor, path)
+    try:
+        return wait_until(
+            lambda: os.path.exists(path), "the file %s" % path, timeout, monitor
+        )
+    finally:
+        if monitor is not None:
+            monitor.close()
+
+
+def read_devices():
+    """
+    Map the MAC address of every network device to its name.
+
+    Returns:
+        dict: A dictionary of MAC address to device name.
+    """
+    devices = {}
+    for path in glob.glob("/sys/class/net/*/address"):
+        try:
+            with open(path, "r") as f_hand:
+                mac = f_hand.read().strip().lower()
+        except (IOError, OSError):
+            continue
+        if mac and mac != "00:00:00:00:00:00":
+            devices[mac] = os.path.basename(os.path.dirname(path))
+    return devices
+
+
+def wait_for_devices(macs, timeout=None):
+    """
+    Wait until a network device exists for every given MAC address.
+
+    Arguments:
+        macs (list): The MAC addresses which need a device.
+        timeout (float): The maximum number of seconds to wait.
+
+    Returns:
+        dict: A dictionary of MAC address to device name (of every device).
+    """
+    macs = [mac.lower() for mac in macs]
+    devices = {}
+
+    def found():
+        devices.clear()
+        devices.update(read_devices())
+        return all(mac in devices for mac in macs)
+
+    monitor = open_monitor(NetlinkMonitor, RTMGRP_LINK)
+    try:
+        wait_until(found, "devices with the MACs %s" % " ".join(macs), timeout, monitor)
+    finally:
+        if monitor is not None:
+            monitor.close()
+    return devices
+
+
+def link_is_up(dev):
+    """
+    Check whether a network device is up.
+
+    Arguments:
+        dev (str): The name of the device.
+
+    Returns:
+        bool: :py:data:`True` if the device is up (or its state is unknown,
+        e.g. for devices without carrier detection).
+    """
+    try:
+        with open("/sys/class/net/%s/operstate" % dev, "r") as f_hand:
+            return f_hand.read().strip() in ("up", "unknown")
+    except (IOError, OSError):
+        return False
+
+
+def wait_for_link(dev, timeout=None):
+    """
+    Wait until a network device is up.
+
+    Arguments:
+        dev (str): The name of the device.
+        timeout (float): The maximum number of seconds to wait.
+
+    Returns:
+        bool: :py:data:`True`.
+    """
+    monitor = open_monitor(NetlinkMonitor, RTMGRP_LINK)
+    try:
+        return wait_until(
+            lambda: link_is_up(dev), "the link %s to be up" % dev, timeout, monitor
+        )
+    finally:
+        if monitor is not None:
+            monitor.close()
+
+
+def has_address(dev, address):
+    """
+    Check whether a network device has an address.
+
+    Arguments:
+        dev (str): The name of the device.
+        address (str): The address, in CIDR notation (e.g. ``10.0.0.1/24``).
+
+    Returns:
+        bool: :py:data:`True` if the device has the address.
+    """
+    try:
+        # pylint: disable=consider-using-with
+        proc = subprocess.Popen(
+            ["ip", "-o", "addr", "show", "dev", dev], stdout=subprocess.PIPE
+        )
+    except OSError:
+        return False
+    output = proc.communicate()[0].decode("utf-8", "replace")
+    return address in output.split()
+
+
+def wait_for_address(dev, address, timeout=None):
+    """
+    Wait until a network device has an address.
+
+    Arguments:
+        dev (str): The name of the device.
+        address (str): The address, in CIDR notation (e.g. ``10.0.0.1/24``).
+        timeout (float): The maximum number of seconds to wait.
+
+    Returns:
+        bool: :py:data:`True`.
+    """
+    monitor = open_monitor(NetlinkMonitor, RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR)
+    try:
+        return wait_until(
+            lambda: has_address(dev, address),
+            "the address %s on %s" % (address, dev),
+            timeout,
+            monitor,
+        )
+    finally:
+        if monitor is not None:
+            monitor.close()
+
+
+def main(argv=None):
+    """
+    Wait for the condition given on the command line.
+
+    Arguments:
+        argv (list): The command line arguments.
+
+    Returns:
+        int: 0 if the condition is true, 1 if the wait timed out.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="The maximum number of seconds to wait (by default, wait forever).",
+    )
+    conditions = parser.add_subparsers(dest="condition")
+    conditions.required = True
+    file_parser = conditions.add_parser("file", help="Wait until a file exists.")
+    file_parser.add_argument("path")
+    device_parser = conditions.add_parser(
+        "device", help="Wait for a device with a MAC address and print its name."
+    )
+    device_parser.add_argument("mac")
+    link_parser = conditions.add_parser("link", help="Wait until a device is up.")
+    link_parser.add_argument("dev")
+    address_parser = conditions.add_parser(
+        "address", help="Wait until a device has an address (in CIDR notation)."
+    )
+    address_parser.add_argument("dev")
+    address_parser.add_argument("address")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.condition == "file":
+            wait_for_file(args.path, args.timeout)
+        elif args.condition == "device":
+            print(wait_for_devices([args.mac], args.timeout)[args.mac.lower()])
+        elif args.condition == "link":
+            wait_for_link(args.dev, args.timeout)
+        else:
+            wait_for_address(args.dev, args.address, args.timeout)
+    except WaitTimeout as exp:
+        sys.stderr.write("%s\n" % exp)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#!/bin/bash
+
+#######################################
+# Waits for conditions without polling (the shell counterpart of wait_for.py)
+#
+# Usage (from a bash VM resource):
+#   . "$(dirname "$0")/wait_for.sh"
+#   wait_until <timeout> <description> <monitor> <condition> [arguments...]
+#
+# The condition command is run once and then again whenever the monitor command
+# prints a line, e.g. "ip monitor link" for changes to network devices or
+# "ip monitor address" for changes to addresses. If the monitor is not available
+# (or exits), the condition is checked every second instead. wait_until returns 0
+# once the condition succeeds and 1 (with a message on stderr) if it did not
+# succeed within <timeout> seconds.
+#######################################
+
+wait_until () {
+    local timeout=$1
+    local description=$2
+    local monitor=$3
+    shift 3
+
+    local deadline=$((SECONDS + timeout))
+    local events monitor_pid fifo_dir remaining status waiting line rc
+    # Start the monitor before the first check so that no event is missed. It is
+    # started as a background job (writing to a FIFO) rather than with a process
+    # substitution, as $! is not set for the latter before bash 4.4.
+    if fifo_dir=$(mktemp -d) && mkfifo "$fifo_dir/events"; then
+        $monitor > "$fifo_dir/events" 2>/dev/null &
+        monitor_pid=$!
+        exec {events}< "$fifo_dir/events"
+    fi
+    rm -rf "$fifo_dir"
+    status=0
+
+    until "$@"
+    do
+        if [ -z "$waiting" ]; then
+            >&2 echo "Waiting for ${description}"
+            waiting=1
+        fi
+        remaining=$((deadline - SECONDS))
+        if [ $remaining -le 0 ]; then
+            >&2 echo "Timed out after ${timeout} seconds waiting for ${description}"
+            status=1
+            break
+        fi
+        if [ -n "$events" ]; then
+            read -r -t "$remaining" -u "$events" line
+            rc=$?
+            # The monitor exited (i.e. it is unavailable), fall back to polling
+            if [ $rc -ne 0 ] && [ $rc -le 128 ]; then
+                exec {events}<&-
+                events=""
+            fi
+        else
+            sleep 1
+        fi
+    done
+
+    if [ -n "$monitor_pid" ]; then
+        kill "$monitor_pid" 2>/dev/null
+    fi
+    if [ -n "$events" ]; then
+        exec {events}<&-
+    fi
+    return $status
+}
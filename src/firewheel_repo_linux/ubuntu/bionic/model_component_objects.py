@@ -1,9 +1,24 @@
+from pathlib import Path
+
 from linux.ubuntu import UbuntuHost, UbuntuServer, UbuntuDesktop
-from linux.base_objects import LinuxNetplanHost
+from linux.base_objects import LinuxNetplanHost, find_baked_image, graph_build_profiler
 
 from firewheel.control.experiment_graph import require_class
 
+IMAGES_DIR = Path(__file__).resolve().parent / "images"
+
+# The setup steps which the pre-baked images contain (see ``bake_images`` in
+# INSTALL/vars.yml)
+BAKED_STEPS = (
+    "stop_apt_daily",
+    "root_profiles",
+    "default_profiles",
+    "install_debs.htop-1_0_2_debs.tgz",
+    "install_debs.pssh_2.3.1-1_all_debs.tgz",
+)
+
 
+@graph_build_profiler.profile_class
 @require_class(LinuxNetplanHost)
 @require_class(UbuntuHost)
 class Ubuntu1804Host:
@@ -15,6 +30,7 @@ class Ubuntu1804Host:
         """This abstraction is not needed"""
 
 
+@graph_build_profiler.profile_class
 @require_class(Ubuntu1804Host)
 @require_class(UbuntuServer)
 class Ubuntu1804Server:
@@ -22,6 +38,15 @@ class Ubuntu1804Server:
     The Model Component for the Ubuntu1804Server image.
     """
 
+    # The pre-baked version of the image, if it has been built
+    # (see linux.base_objects.find_baked_image)
+    baked_image = find_baked_image(
+        IMAGES_DIR,
+        "ubuntu-18.04.5-server-amd64.qcow2.tgz",
+        "ubuntu-18.04.5-server-amd64.qcow2",
+        BAKED_STEPS,
+    )
+
     def __init__(self):
         """
         Setting all of the required parameters for a new image
@@ -52,6 +77,7 @@ class Ubuntu1804Server:
         self.set_image("ubuntu1804server")
 
 
+@graph_build_profiler.profile_class
 @require_class(Ubuntu1804Host)
 @require_class(UbuntuDesktop)
 class Ubuntu1804Desktop:
@@ -59,6 +85,15 @@ class Ubuntu1804Desktop:
     The Model Component for the Ubuntu1804Desktop image.
     """
 
+    # The pre-baked version of the image, if it has been built
+    # (see linux.base_objects.find_baked_image)
+    baked_image = find_baked_image(
+        IMAGES_DIR,
+        "ubuntu-18.04.5-desktop-amd64.qcow2.tgz",
+        "ubuntu-18.04.5-desktop-amd64.qcow2",
+        BAKED_STEPS,
+    )
+
     def __init__(self):
         """
         Setting all of the required parameters for a new image
@@ -1,13 +1,26 @@
 """This module contains all necessary Model Component Objects for linux.ubuntu2204."""
 
+from pathlib import Path
+
 from linux.ubuntu import UbuntuHost, UbuntuServer, UbuntuDesktop
-from linux.base_objects import LinuxNetplanHost
+from linux.base_objects import LinuxNetplanHost, find_baked_image, graph_build_profiler
 
 from firewheel.control.experiment_graph import (
     IncorrectConflictHandlerError,
     require_class,
 )
 
+IMAGES_DIR = Path(__file__).resolve().parent / "images"
+
+# The setup steps which the pre-baked images contain (see ``bake_images`` in
+# INSTALL/vars.yml)
+BAKED_STEPS = (
+    "stop_apt_daily",
+    "root_profiles",
+    "default_profiles",
+    "install_debs.pssh_2.3.4-2_all_debs.tgz",
+)
+
 
 def ubuntu_2204_conflict_handler(entry_name, _decorator_value, _current_instance_value):
     """
@@ -31,6 +44,7 @@ def ubuntu_2204_conflict_handler(entry_name, _decorator_value, _current_instance
     raise IncorrectConflictHandlerError
 
 
+@graph_build_profiler.profile_class
 @require_class(UbuntuHost, conflict_handler=ubuntu_2204_conflict_handler)
 @require_class(LinuxNetplanHost)
 class Ubuntu2204Host:
@@ -49,6 +63,7 @@ class Ubuntu2204Host:
         self.install_debs(-244, "pssh_2.3.4-2_all_debs.tgz")
 
 
+@graph_build_profiler.profile_class
 @require_class(Ubuntu2204Host)
 @require_class(UbuntuServer)
 class Ubuntu2204Server:
@@ -56,6 +71,15 @@ class Ubuntu2204Server:
     The Model Component for the Ubuntu2204Server image.
     """
 
+    # The pre-baked version of the image, if it has been built
+    # (see linux.base_objects.find_baked_image)
+    baked_image = find_baked_image(
+        IMAGES_DIR,
+        "ubuntu-22.04-server-amd64.qcow2.tgz",
+        "ubuntu-22.04-server-amd64.qcow2",
+        BAKED_STEPS,
+    )
+
     def __init__(self):
         """
         Setting all of the required parameters for a new image
@@ -86,6 +110,7 @@ class Ubuntu2204Server:
         self.set_image("ubuntu2204server")
 
 
+@graph_build_profiler.profile_class
 @require_class(Ubuntu2204Host)
 @require_class(UbuntuDesktop)
 class Ubuntu2204Desktop:
@@ -93,6 +118,15 @@ class Ubuntu2204Desktop:
     The Model Component for the Ubuntu2204Desktop image.
     """
 
+    # The pre-baked version of the image, if it has been built
+    # (see linux.base_objects.find_baked_image)
+    baked_image = find_baked_image(
+        IMAGES_DIR,
+        "ubuntu-22.04-desktop-amd64.qcow2.tgz",
+        "ubuntu-22.04-desktop-amd64.qcow2",
+        BAKED_STEPS,
+    )
+
     def __init__(self):
         """
         Setting all of the required parameters for a new image
@@ -1,8 +1,22 @@
+from pathlib import Path
+
 from linux.ubuntu import UbuntuHost, UbuntuServer, UbuntuDesktop
+from linux.base_objects import find_baked_image, graph_build_profiler
 
 from firewheel.control.experiment_graph import require_class
 
+IMAGES_DIR = Path(__file__).resolve().parent / "images"
+
+# The setup steps which the pre-baked images contain (see ``bake_images`` in
+# INSTALL/vars.yml)
+BAKED_STEPS = ("root_profiles", "default_profiles")
+
+# The capabilities of the images (see ``LinuxHost``). Ubuntu 14.04 uses upstart,
+# so it does not have the apt-daily systemd units.
+IMAGE_CAPABILITIES = frozenset({"no_apt_daily"})
 
+
+@graph_build_profiler.profile_class
 @require_class(UbuntuHost)
 class Ubuntu1404Host:
     """
@@ -13,6 +27,7 @@ class Ubuntu1404Host:
         """An unused init method."""
 
 
+@graph_build_profiler.profile_class
 @require_class(Ubuntu1404Host)
 @require_class(UbuntuServer)
 class Ubuntu1404Server:
@@ -20,6 +35,16 @@ class Ubuntu1404Server:
     The Model Component for the Ubuntu1404Server image.
     """
 
+    # The pre-baked version of the image, if it has been built
+    # (see linux.base_objects.find_baked_image)
+    baked_image = find_baked_image(
+        IMAGES_DIR,
+        "ubuntu-14.04.5-server-amd64.qc2.xz",
+        "ubuntu-14.04.5-server-amd64.qc2",
+        BAKED_STEPS,
+    )
+    image_capabilities = IMAGE_CAPABILITIES
+
     def __init__(self):
         """
         Setting all of the required parameters for a new image
@@ -50,6 +75,7 @@ class Ubuntu1404Server:
         self.set_image("ubuntu1404server")
 
 
+@graph_build_profiler.profile_class
 @require_class(Ubuntu1404Host)
 @require_class(UbuntuDesktop)
 class Ubuntu1404Desktop:
@@ -57,6 +83,16 @@ class Ubuntu1404Desktop:
     The Model Component for the Ubuntu1404Desktop image.
     """
 
+    # The pre-baked version of the image, if it has been built
+    # (see linux.base_objects.find_baked_image)
+    baked_image = find_baked_image(
+        IMAGES_DIR,
+        "ubuntu-14.04.5-desktop-amd64.qcow2.xz",
+        "ubuntu-14.04.5-desktop-amd64.qcow2",
+        BAKED_STEPS,
+    )
+    image_capabilities = IMAGE_CAPABILITIES
+
     def __init__(self):
         """
         Setting all of the required parameters for a new image
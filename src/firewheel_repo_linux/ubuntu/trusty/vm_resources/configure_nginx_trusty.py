@@ -1,15 +1,19 @@
 #!/usr/bin/env python
 import os
 import sys
+import time
 import pickle
+import shutil
 from subprocess import PIPE, Popen
 
+from vm_timing import record_timing
+
 
 # pylint: disable=useless-object-inheritance
 class ConfigureNginx(object):
     """
-    Add files to customize the configuration of nginx and restart the service
-    so the changes take effect.
+    Add files to customize the configuration of nginx and gracefully reload the
+    service so the changes take effect.
 
     This agent is Ubuntu 14.04 specific.
 
@@ -36,14 +40,30 @@ class ConfigureNginx(object):
 
     This dictionary would result in the creation of 3 files:
         - /etc/nginx/sites-available/example
-        - (symlink) /etc/nginx/sites-enabled/example -> /etc/nginx/sites-available/example
+        - (symlink) /etc/nginx/sites-enabled/example -> ../sites-available/example
         - /etc/nginx/conf.d/more_conf.conf
 
     This agent removes the default site from sites-enabled, but leaves the file
     in sites-available for reference.
 
+    The configuration is swapped atomically. The current contents of the managed
+    directories (``sites-available``, ``sites-enabled``, and ``conf.d``) are
+    copied into a new generation directory in ``/etc/nginx/firewheel``, where
+    the new files are written. The generation is validated once with ``nginx -t``
+    and, if it is valid, each managed directory is replaced by a symlink to the
+    generation (with a ``rename``). Finally, nginx is gracefully reloaded
+    (``nginx -s reload``), so in-flight connections are not dropped. An invalid
+    configuration is discarded without changing the running configuration.
+
+    The execution time of this VMR is recorded with ``vm_timing.py``, so it must
+    be scheduled with ``LinuxHost.add_boot_vm_resource``, which loads the helper
+    alongside it.
     """
 
+    nginx_dir = "/etc/nginx"
+    generations_dir = "/etc/nginx/firewheel"
+    managed_dirs = ("sites-available", "sites-enabled", "conf.d")
+
     def __init__(self, ascii_file=None):
         """
         Enable the ``ascii_file`` path to become available to the VMR.
@@ -56,6 +76,9 @@ class ConfigureNginx(object):
     def run(self):
         """
         The primary function which properly configures nginx on Ubuntu 14.04.
+
+        Returns:
+            int: The exit code for this VMR.
         """
         config = None
         with open(self.ascii_file, "r") as f:
@@ -63,74 +86,270 @@ class ConfigureNginx(object):
 
         if not config:
             print("Could not load pickled data")
-            return
+            return 0
+
+        generation = self.stage(config)
+        if not self.validate(generation):
+            shutil.rmtree(generation, ignore_errors=True)
+            return 1
+
+        self.swap(generation)
+        self.remove_old_generations(generation)
+        return self.reload()
+
+    def stage(self, config):
+        """
+        Render the new configuration into a new generation directory.
+
+        Arguments:
+            config (dict): The sites and conf files to add.
+
+        Returns:
+            str: The path of the generation directory.
+        """
+        generation = os.path.join(
+            self.generations_dir, "%d.%d" % (time.time(), os.getpid())
+        )
+        os.makedirs(generation)
+
+        # Start from the current configuration
+        for name in self.managed_dirs:
+            current = os.path.join(self.nginx_dir, name)
+            staged = os.path.join(generation, name)
+            if os.path.isdir(current):
+                shutil.copytree(os.path.realpath(current), staged, symlinks=True)
+            else:
+                os.makedirs(staged)
+
+        sites_available = os.path.join(generation, "sites-available")
+        sites_enabled = os.path.join(generation, "sites-enabled")
+
+        # Point enabled sites at the staged copy of the site (rather than the
+        # live one) so that the generation can be validated on its own
+        available_prefix = os.path.join(self.nginx_dir, "sites-available") + "/"
+        for site in os.listdir(sites_enabled):
+            link = os.path.join(sites_enabled, site)
+            if os.path.islink(link) and os.readlink(link).startswith(available_prefix):
+                target = os.readlink(link)[len(available_prefix) :]
+                os.remove(link)
+                os.symlink(os.path.join("..", "sites-available", target), link)
+
+        # Disable the default site
+        default_site = os.path.join(sites_enabled, "default")
+        if os.path.lexists(default_site):
+            os.remove(default_site)
+
+        for site, content in (config.get("sites") or {}).items():
+            site_path = os.path.join(sites_available, site)
+            with open(site_path, "w") as f_hand:
+                f_hand.write(content)
+            os.chmod(site_path, int("0644", 8))
+            link = os.path.join(sites_enabled, site)
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(os.path.join("..", "sites-available", site), link)
+
+        for conf, content in (config.get("conf") or {}).items():
+            conf_path = os.path.join(generation, "conf.d", conf)
+            with open(conf_path, "w") as f_hand:
+                f_hand.write(content)
+            os.chmod(conf_path, int("0644", 8))
+
+        return generation
+
+    def validate(self, generation):
+        """
+        Test the configuration of a generation with ``nginx -t``.
+
+        The main configuration file is copied with its includes of the managed
+        directories pointed at the generation. The copy is placed next to the main
+        configuration file so that any relative includes still resolve.
+
+        Arguments:
+            generation (str): The path of the generation directory.
+
+        Returns:
+            bool: :py:data:`True` if the configuration is valid.
+        """
+        main_conf = os.path.join(self.nginx_dir, "nginx.conf")
+        with open(main_conf, "r") as f_hand:
+            content = f_hand.read()
+        for name in self.managed_dirs:
+            content = content.replace(
+                os.path.join(self.nginx_dir, name) + "/",
+                os.path.join(generation, name) + "/",
+            )
+
+        test_conf = os.path.join(self.nginx_dir, ".firewheel-test.conf")
+        with open(test_conf, "w") as f_hand:
+            f_hand.write(content)
+        try:
+            # pylint: disable=consider-using-with
+            test = Popen(["nginx", "-t", "-c", test_conf], stdout=PIPE, stderr=PIPE)
+            output = test.communicate()
+        finally:
+            os.remove(test_conf)
+
+        if test.returncode != 0:
+            print("The new nginx configuration is invalid, it was not applied")
+            print(output[1])
+            return False
+        return True
+
+    def swap(self, generation):
+        """
+        Replace each managed directory with a symlink to the generation.
+
+        The symlinks are all created before any managed directory is changed, then
+        each one is renamed over its managed directory. This atomically switches a
+        managed directory which is already a symlink to the new generation. The
+        first time, the original directory is moved away just before its symlink
+        is renamed into place (a symlink cannot be renamed over a directory). If
+        any step fails, the managed directories which were already switched are
+        restored, so that they never point at different generations.
 
-        # Delete the default site
-        default_file = "/etc/nginx/sites-enabled/default"
+        Arguments:
+            generation (str): The path of the generation directory.
+        """
+        links = {}
+        swapped = []
         try:
-            os.remove(default_file)
-        except OSError as exp:
-            print("Warning: Unable to remove default site: %s" % exp)
-
-        # Handle sites
-        if config.get("sites"):
-            for site in config["sites"].keys():
-                sites_available_dir = os.path.join("/etc", "nginx", "sites-available")
-                sites_available = os.path.join(sites_available_dir, site)
-                sites_enabled_dir = os.path.join("/etc", "nginx", "sites-enabled")
-                sites_enabled = os.path.join(sites_enabled_dir, site)
-
-                # Make sure that needed directories exist
-                if not os.path.exists(sites_available_dir):
-                    try:
-                        os.makedirs(sites_available_dir)
-                    except OSError:
-                        print("Unable to create directory: %s" % sites_available_dir)
-
-                if not os.path.exists(sites_enabled_dir):
-                    try:
-                        os.makedirs(sites_enabled_dir)
-                    except OSError:
-                        print("Unable to create directory: %s" % sites_enabled_dir)
-
-                # Put the file in sites-available with the right permission
-                with open(sites_available, "w") as f:
-                    f.write(config["sites"][site])
-
-                try:
-                    os.chmod(sites_available, int("0644", 8))
-                except OSError as exp:
-                    print("Error: sites_available chmod failed: %s" % exp)
-
-                # Link the file to sites-enabled with the correct permissions.
-                try:
-                    os.symlink(sites_available, sites_enabled)
-                except OSError as exp:
-                    print("Error: Unable to create symlink in sites_enabled: %s" % exp)
-
-                try:
-                    os.chmod(sites_enabled, int("0644", 8))
-                except OSError as exp:
-                    print("Error: sites_enabled chmod failed: %s" % exp)
-
-        # Handle conf
-        if config.get("conf"):
-            for conf in config["conf"].keys():
-                conf_path = os.path.join("/etc", "nginx", "conf.d", conf)
-
-                with open(conf_path, "w") as f:
-                    f.write(config["conf"][conf])
-
-        # Restart the service
+            for name in self.managed_dirs:
+                links[name] = os.path.join(self.nginx_dir, ".%s.tmp" % name)
+                if os.path.lexists(links[name]):
+                    os.remove(links[name])
+                os.symlink(os.path.join(generation, name), links[name])
+
+            for name in self.managed_dirs:
+                live = os.path.join(self.nginx_dir, name)
+                swapped.append((live, self.replace(live, links[name])))
+        except OSError:
+            for live, previous in reversed(swapped):
+                self.restore(live, previous)
+            raise
+        finally:
+            for link in links.values():
+                if os.path.lexists(link):
+                    os.remove(link)
+
+    def replace(self, live, link):
+        """
+        Rename a symlink over a managed directory, keeping the original directory
+        (the first time) in ``/etc/nginx/firewheel/original``.
+
+        Arguments:
+            live (str): The path of the managed directory.
+            link (str): The path of the symlink to the new generation.
+
+        Returns:
+            tuple: The previous state of the managed directory (see :py:meth:`restore`).
+        """
+        if os.path.islink(live):
+            previous = ("link", os.readlink(live))
+        elif os.path.isdir(live):
+            previous = ("dir", self.keep_original(live))
+        else:
+            previous = (None, None)
+        try:
+            os.rename(link, live)
+        except OSError:
+            self.restore(live, previous)
+            raise
+        return previous
+
+    def restore(self, live, previous):
+        """
+        Restore a managed directory to its state before :py:meth:`replace`.
+
+        Arguments:
+            live (str): The path of the managed directory.
+            previous (tuple): The kind of the previous managed directory
+                (``"link"``, ``"dir"``, or :py:data:`None` if it did not exist) and
+                the target of the symlink or the path where the directory was kept.
+        """
+        kind, path = previous
+        if kind == "link":
+            link = os.path.join(self.nginx_dir, ".%s.restore" % os.path.basename(live))
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(path, link)
+            os.rename(link, live)
+            return
+        if os.path.islink(live):
+            os.remove(live)
+        if kind == "dir":
+            os.rename(path, live)
+
+    def keep_original(self, live):
+        """
+        Move an original managed directory into ``/etc/nginx/firewheel/original``.
+
+        If an original with the same name was already kept (e.g. because the
+        directory was recreated by a package upgrade), a numeric suffix is added
+        rather than replacing it.
+
+        Arguments:
+            live (str): The path of the managed directory.
+
+        Returns:
+            str: The path where the directory was kept.
+        """
+        original_dir = os.path.join(self.generations_dir, "original")
+        if not os.path.isdir(original_dir):
+            os.makedirs(original_dir)
+        name = os.path.basename(live)
+        original = os.path.join(original_dir, name)
+        suffix = 0
+        while os.path.lexists(original):
+            suffix += 1
+            original = os.path.join(original_dir, "%s.%d" % (name, suffix))
+        os.rename(live, original)
+        return original
+
+    def remove_old_generations(self, generation):
+        """
+        Remove the generations which are no longer in use.
+
+        Arguments:
+            generation (str): The path of the current generation directory.
+        """
+        for name in os.listdir(self.generations_dir):
+            path = os.path.join(self.generations_dir, name)
+            if name != "original" and path != generation:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def reload(self):
+        """
+        Gracefully reload nginx (or start it, if it is not running).
+
+        Returns:
+            int: The exit code for this VMR.
+        """
+        # pylint: disable=consider-using-with
+        reload_proc = Popen(["nginx", "-s", "reload"], stdout=PIPE, stderr=PIPE)
+        output = reload_proc.communicate()
+        if reload_proc.returncode == 0:
+            return 0
+
+        print("Unable to reload nginx, starting the service instead")
+        print(output[1])
         # pylint: disable=consider-using-with
-        restart = Popen(["service", "nginx", "restart"], stdout=PIPE, stderr=PIPE)
-        output = restart.communicate()
-        if restart.returncode != 0:
-            print("Unable to restart nginx service")
+        start = Popen(["service", "nginx", "start"], stdout=PIPE, stderr=PIPE)
+        output = start.communicate()
+        if start.returncode != 0:
+            print("Unable to start nginx service")
             print(output[1])
+            return 1
+        return 0
 
 
 if __name__ == "__main__":
-    # Only takes an ascii file
-    configure = ConfigureNginx(sys.argv[1])
-    configure.run()
+    START = time.time()
+    EXIT_CODE = 1
+    try:
+        # Only takes an ascii file
+        configure = ConfigureNginx(sys.argv[1])
+        EXIT_CODE = configure.run()
+    finally:
+        record_timing(START, EXIT_CODE)
+    sys.exit(EXIT_CODE)
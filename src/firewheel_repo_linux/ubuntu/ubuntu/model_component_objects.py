@@ -1,12 +1,14 @@
 import os
+import shlex
 import warnings
 from pathlib import Path
 
-from linux.base_objects import LinuxHost
+from linux.base_objects import LinuxHost, graph_build_profiler
 
 from firewheel.control.experiment_graph import require_class
 
 
+@graph_build_profiler.profile_class
 @require_class(LinuxHost)
 class UbuntuHost:
     """
@@ -21,50 +23,56 @@ class UbuntuHost:
     def __init__(self):
         """
         By default, we need to stop/disable the apt daily task, if allowed to run
-        it will prevent other packages from being installed.
+        it will prevent other packages from being installed. This is skipped if the
+        image does not run it (the ``"no_apt_daily"`` capability, see ``LinuxHost``)
+        or if it is already disabled in the pre-baked image.
         """
+        # The debian packages (or tarballs) which are already scheduled for install,
+        # mapped to their schedule time and entry
+        self.installed_debs = getattr(self, "installed_debs", {})
+        # The debconf selections of this VM (keyed on their owner and question, in
+        # the order they were added) and the schedule entry which applies them
+        self.debconf_selections = getattr(self, "debconf_selections", {})
+        self.debconf_entry = getattr(self, "debconf_entry", None)
+
         # Apt scheduled task interferes with dpkg use. Disable it.
-        self.run_executable(-300, "stop_apt_daily.sh", vm_resource=True)
+        if (
+            "no_apt_daily" not in self.image_capabilities
+            and "stop_apt_daily" not in self.baked_steps
+        ):
+            self.run_boot_executable(
+                -300,
+                "stop_apt_daily.sh",
+                vm_resource=True,
+                step="stop_apt_daily",
+                after=[],
+                idempotent=True,
+            )
 
     def add_default_profiles(self):
         """
         Adds default ssh keys, .bashrc, .vimrc, etc.
         Also configures the VM to allow the ubuntu user to use passwordless `sudo`.
+        This is skipped if the profiles are baked into the VM's image.
         """
-        self.run_executable(
+        if "default_profiles" in self.baked_steps:
+            return
+        # The line is only added once, so that restarting the VM does not repeat it
+        sudoers = shlex.quote(f"{self.default_user} ALL=(ALL) NOPASSWD:ALL")
+        self.run_boot_executable(
             -250,
-            "echo",
-            f"'{self.default_user} ALL=(ALL) NOPASSWD:ALL' >> /etc/sudoers",
-            vm_resource=False,
-        )
-        # drop configs and profiles
-        vmr_profile_archive = "combined_profiles.tgz"
-        # root profiles
-        vm_root_profile_archive = Path("/root") / vmr_profile_archive
-        self.drop_file(-249, f"{vm_root_profile_archive}", vmr_profile_archive)
-        self.run_executable(
-            -248, "chown", f"-R root:root {vm_root_profile_archive}", vm_resource=False
-        )
-        self.run_executable(
-            -247, "tar", f"--no-same-owner -C /root/ -xf {vm_root_profile_archive}"
-        )
-        self.run_executable(-246, "rm", f"-f {vm_root_profile_archive}")
-
-        # User profiles
-        vm_user_profile_archive = self.home_path / vmr_profile_archive
-        self.drop_file(-249, f"{vm_user_profile_archive}", vmr_profile_archive)
-        self.run_executable(
-            -248,
-            "chown",
-            f"-R {self.default_user}:{self.default_user} {vm_user_profile_archive}",
+            "grep",
+            f"-qxF {sudoers} /etc/sudoers || echo {sudoers} >> /etc/sudoers",
             vm_resource=False,
+            step="sudoers",
+            after=[],
         )
-        self.run_executable(
-            -247,
-            "su",
-            f'{self.default_user} -c "tar -C {self.home_path} -xf {vm_user_profile_archive}"',
-        )
-        self.run_executable(-246, "rm", f"-f {vm_user_profile_archive}")
+        # The root profiles are only installed once, even if add_root_profiles
+        # already scheduled them
+        homes = {self.default_user: self.home_path}
+        if "root_profiles" not in self.baked_steps:
+            homes = {"root": "/root", **homes}
+        self.install_profiles(homes)
 
     def add_debug_debs(self):
         """
@@ -74,6 +82,66 @@ class UbuntuHost:
         self.install_debs(-245, "htop-1_0_2_debs.tgz")
         self.install_debs(-244, "pssh_2.3.1-1_all_debs.tgz")
 
+    def preseed_debconf(self, selections, start_time=-299):
+        """
+        Preseed the answers to the questions asked when debian packages are installed
+        (e.g. the root password of ``mysql-server`` or the mail name of ``postfix``).
+
+        The selections of every call (e.g. one for each package) are merged into a
+        single file for the VM, which is applied by a single ``debconf.sh`` run (i.e.
+        one ``debconf-set-selections`` transaction). The selections keep the order
+        in which they were first added; a later selection for the same question
+        replaces the earlier one.
+
+        Note:
+            The selections are applied at the ``start_time`` of the first call,
+            which must be before the packages which use them are installed
+            (see :py:meth:`install_debs`).
+
+        Arguments:
+            selections (str): The selections, in the format of
+                ``debconf-set-selections`` (i.e. one ``<owner> <question> <type>
+                <value>`` line each). This may also be a list of lines. Blank lines
+                and comments are ignored.
+            start_time (int, optional): The schedule time to apply the selections,
+                if they were not already scheduled. Defaults to -299.
+
+        Returns:
+            base_objects.ScheduleEntry: The schedule entry which applies the selections.
+
+        Raises:
+            ValueError: If a selection does not have an owner, question, and type.
+        """
+        if isinstance(selections, str):
+            selections = selections.splitlines()
+        parsed = []
+        for line in selections:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split(None, 3)
+            if len(fields) < 3:
+                raise ValueError(f"Invalid debconf selection for {self.name}: {line!r}")
+            parsed.append(((fields[0], fields[1]), line))
+
+        if self.debconf_entry is None:
+            debconf_selections = self.debconf_selections
+
+            def render_selections():
+                return "".join(f"{line}\n" for line in debconf_selections.values())
+
+            self.debconf_entry = self.add_boot_vm_resource(
+                start_time,
+                "debconf.sh",
+                render_selections,
+                step="debconf",
+                after=[],
+                idempotent=True,
+            )
+
+        self.debconf_selections.update(parsed)
+        return self.debconf_entry
+
     def install_debs(self, time, debfile):
         """
         Installs a debian package.
@@ -81,11 +149,35 @@ class UbuntuHost:
         Arguments:
             time (int): Experiment time at which to install the package.
             debfile (str): The file to be installed. This can be either a ``.deb``
-                file or a tarball containing multiple ``.deb`` files. No additional
-                path information should be provided. However, the ``.deb`` file/tarball
+                file or a tarball containing multiple ``.deb`` files. Tarballs may be
+                gzip or Zstandard-compressed (``.tar.zst``, which requires ``zstd`` on
+                the VM). No additional path information should be provided. However,
+                the ``.deb`` file/tarball
                 **must** be provided by a model component used in the experiment
                 (i.e. it must be referenced in a MANIFEST file).
+
+        Returns:
+            base_objects.ScheduleEntry: The schedule entry which installs the package(s).
+            If the same file was already scheduled for install on this VM at or before
+            ``time``, no new entry is created and the existing one is returned instead.
+            If the package(s) are baked into the VM's image, nothing is scheduled and
+            :py:data:`None` is returned.
         """
+        if f"install_debs.{debfile}" in self.baked_steps:
+            self.log.debug(
+                "%s is already installed in the image of %s", debfile, self.name
+            )
+            return None
+
+        # Avoid shipping (and unpacking) the same packages to the VM more than once
+        if debfile in self.installed_debs:
+            scheduled_time, entry = self.installed_debs[debfile]
+            if scheduled_time <= time:
+                self.log.debug(
+                    "%s is already scheduled for install on %s", debfile, self.name
+                )
+                return entry
+
         if debfile != os.path.basename(debfile):
             msg = str(
                 "When using `install_debs`, path information should not"
@@ -94,9 +186,16 @@ class UbuntuHost:
             )
             warnings.warn(msg, stacklevel=2)
             self.log.warning(msg)
-        self.add_vm_resource(time, "install_debs.sh", None, debfile)
+        # Packages may depend on those installed before them, so the install keeps
+        # its position in the boot sequence (i.e. no prerequisites are declared)
+        entry = self.add_boot_vm_resource(
+            time, "install_debs.sh", None, debfile, step=f"install_debs.{debfile}"
+        )
+        self.installed_debs[debfile] = (time, entry)
+        return entry
 
 
+@graph_build_profiler.profile_class
 @require_class(UbuntuHost)
 class UbuntuServer:
     """
@@ -108,6 +207,7 @@ class UbuntuServer:
         """An unused init method."""
 
 
+@graph_build_profiler.profile_class
 @require_class(UbuntuHost)
 class UbuntuDesktop:
     """
@@ -1,8 +1,27 @@
 #!/bin/bash
 
+#######################################
 # Take in debconf lines and apply them
+#
+# Usage: debconf.sh <selections file>
+#
+# The whole file is applied by a single debconf-set-selections run (i.e. one
+# update of the debconf database) rather than one run per line. The file is
+# checked first, so that an invalid file does not apply any of its selections.
+#######################################
 
-while read line
-do
-    debconf-set-selections <<< $line
-done < $1
+# Record the execution time of this VM resource (see vm_timing.sh)
+. "$(dirname "$0")/vm_timing.sh"
+
+SELECTIONS=$1
+if [ -z "$SELECTIONS" ] || [ "$SELECTIONS" == "None" ]; then
+    >&2 echo "No debconf selections were provided"
+    exit 1
+fi
+
+if ! debconf-set-selections --checkonly "$SELECTIONS"; then
+    >&2 echo "Invalid debconf selections, none were applied"
+    exit 1
+fi
+
+debconf-set-selections "$SELECTIONS"
@@ -3,9 +3,20 @@ import os
 import sys
 import json
 import time
+import fcntl
+import shlex
 import tarfile
 from subprocess import PIPE, Popen
 
+from vm_timing import record_timing
+from wait_for import WaitTimeout, chain, wait_for_file
+
+try:
+    # The JSON configuration is read as ``unicode`` on Python 2
+    STRING_TYPES = basestring  # noqa: F821 pylint: disable=undefined-variable
+except NameError:
+    STRING_TYPES = str
+
 
 # pylint: disable=useless-object-inheritance
 class InstallDebs(object):
@@ -13,10 +24,37 @@ class InstallDebs(object):
     This VM Resource enables the installation of Debian packages on a given VM.
     This VMR has largely been replaced by the newer (but less configurable)
     ``install_debs.sh``.
+
+    Multiple instances of this VMR may be scheduled at (nearly) the same time.
+    Rather than installing each set of packages separately, each instance adds
+    its packages to a shared spool directory and then waits on a file lock.
+    Whichever instance obtains the lock installs *all* pending package sets with
+    a single ``dpkg`` invocation (which configures the packages in dependency order).
+    The remaining instances find that their packages were already installed once
+    they obtain the lock. If a package set could not be installed, its error is
+    recorded next to it (``<touch_location>.failed``) so that the instance which
+    added it reports the error.
+
+    Other programs (e.g. ``install_debs.sh``, apt, or unattended-upgrades) may be
+    using dpkg at the same time. Before running ``dpkg``, the instance waits for
+    them to release dpkg's lock (and holds dpkg's frontend lock, as apt does). A
+    ``dpkg`` run which still fails because dpkg is locked is always retried.
+
+    This VMR imports ``vm_timing.py`` and ``wait_for.py`` (from
+    ``linux.base_objects``), so it must be scheduled with
+    ``LinuxHost.add_boot_vm_resource`` (or its schedule entry passed to
+    ``LinuxHost.add_vm_resource_helpers``), which loads them alongside it.
     """
 
     dependency = False
 
+    spool_dir = "/tmp/firewheel-debs-pending"
+    lock_file = "/tmp/firewheel-dpkg.lock"
+
+    # The frontend lock (dpkg >= 1.19.1) and the status database lock of dpkg
+    dpkg_frontend_lock = "/var/lib/dpkg/lock-frontend"
+    dpkg_lock = "/var/lib/dpkg/lock"
+
     def __init__(self, ascii_file=None, binary_file=None):
         """
         Decompress the tarball of packages and read in any configuration.
@@ -32,14 +70,24 @@ class InstallDebs(object):
 
                 {
                     "dependency": "<path to file>",
+                    "dependency_timeout": 600,
                     "environment": "<string of environment variables>",
+                    "max_retries": 5
                 }
 
             The ``dependency`` is the path to a file which is required to exist
             prior to the installation of the debian files. This could be useful
             if there are potential race conditions amongst VMRs.
+            The file is waited for with inotify (see ``wait_for.py``).
+            The ``dependency_timeout`` is the maximum number of seconds to wait for
+            the ``dependency`` (by default, there is no limit).
             The ``environment`` is the environment which should be passed into the
-            shell which executes the ``dpkg`` command.
+            shell which executes the ``dpkg`` command. It can be either a dictionary
+            or a string of ``KEY=value`` pairs.
+            The ``max_retries`` is the number of times a failing ``dpkg`` command
+            is retried before giving up (default is 5). Failures because dpkg is
+            locked by another process do not count, they are retried until the
+            lock is released.
 
         """
         # Split on '.' in an attempt to get the name of the binary
@@ -49,7 +97,9 @@ class InstallDebs(object):
         if "." in package_name:
             package_name = package_name.split(".")[0]
 
+        self.package_name = package_name
         self.touch_location = "/tmp/%s-installed" % package_name
+        self.failed_location = "%s.failed" % self.touch_location
         self.install_dir = "/tmp/%s-agent-install" % package_name
         self.untared_dir_name = package_name
 
@@ -77,8 +127,18 @@ class InstallDebs(object):
             self.environment = data["environment"]
         except KeyError:
             self.environment = None
+        if isinstance(self.environment, STRING_TYPES):
+            self.environment = dict(
+                var.split("=", 1) for var in shlex.split(self.environment) if "=" in var
+            )
+
+        self.dependency_timeout = data.get("dependency_timeout")
+        if self.dependency_timeout is not None:
+            self.dependency_timeout = float(self.dependency_timeout)
 
-        self.dpkg_lock = "/tmp/dpkg-lock"
+        self.max_retries = int(data.get("max_retries", 5))
+        # The number of times dpkg was retried (for the timing record)
+        self.retries = 0
 
     def run(self):
         """
@@ -93,8 +153,7 @@ class InstallDebs(object):
             tar.extractall(path=self.install_dir)
 
         if self.dependency:
-            while not os.path.exists(self.dependency):
-                time.sleep(1)
+            self.wait_for_dependency()
 
         # Verify our extract and get the directory name with actual .debs.
         untared_contents = os.listdir(self.install_dir)
@@ -103,50 +162,259 @@ class InstallDebs(object):
         ):
             raise OSError("Invalid tarfile format: Need exactly 1 directory.")
 
-        # Acquire a file-system lock for running dpkg
-        while True:
+        # Remove the markers left by a previous install of the same packages so
+        # that they are not mistaken for an install by a concurrent instance.
+        for marker in (self.touch_location, self.failed_location):
+            if os.path.exists(marker):
+                os.remove(marker)
+
+        binary_dir = os.path.join(self.install_dir, untared_contents[0])
+        self.add_to_spool(binary_dir)
+
+        # Block (without polling) until no other instance is running dpkg
+        with open(self.lock_file, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
             try:
-                os.mkdir(self.dpkg_lock)
-                break
+                if os.path.exists(self.touch_location):
+                    print("%s was installed by another instance" % self.package_name)
+                    return
+                if not os.path.exists(self.failed_location):
+                    self.install_spool()
+                self.check_installed()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def wait_for_dependency(self):
+        """
+        Wait until the ``dependency`` file exists.
+
+        Raises:
+            RuntimeError: If the file does not exist before the
+                ``dependency_timeout``.
+        """
+        error = None
+        try:
+            wait_for_file(self.dependency, self.dependency_timeout)
+        except WaitTimeout as exp:
+            error = chain(RuntimeError(str(exp)), exp)
+        if error is not None:
+            raise error
+
+    def add_to_spool(self, binary_dir):
+        """
+        Register a directory of packages as pending installation.
+
+        Arguments:
+            binary_dir (str): The directory containing the ``.deb`` files.
+        """
+        if not os.path.exists(self.spool_dir):
+            try:
+                os.makedirs(self.spool_dir)
             except OSError:
-                time.sleep(1)
+                # Another instance created it first
+                pass
 
-        # now that we have the files to install, install them
-        binary_dir = os.path.join(self.install_dir, untared_contents[0])
+        pending = {
+            "binary_dir": binary_dir,
+            "touch_location": self.touch_location,
+            "environment": self.environment,
+        }
+        spool_file = os.path.join(self.spool_dir, self.package_name)
+        with open(spool_file + ".tmp", "w") as f_hand:
+            json.dump(pending, f_hand)
+        # Rename so that a partially written entry is never read
+        os.rename(spool_file + ".tmp", spool_file)
 
-        while True:
-            env = dict(os.environ)
-            if self.environment:
-                env.update(self.environment)
+    def read_spool(self):
+        """
+        Read all pending package sets. Sets which need the same environment
+        are grouped together so that they can be installed at once.
+
+        Returns:
+            dict: A mapping of the serialized environment to a list of
+            ``(spool_file, pending)`` tuples.
+        """
+        groups = {}
+        for name in sorted(os.listdir(self.spool_dir)):
+            if name.endswith(".tmp"):
+                continue
+            spool_file = os.path.join(self.spool_dir, name)
+            try:
+                with open(spool_file, "r") as f_hand:
+                    pending = json.load(f_hand)
+            except (OSError, IOError, ValueError) as exp:
+                print("Skipping unreadable spool entry %s: %s" % (spool_file, exp))
+                continue
+            key = json.dumps(pending.get("environment"), sort_keys=True)
+            groups.setdefault(key, []).append((spool_file, pending))
+        return groups
+
+    def install_spool(self):
+        """
+        Install every pending package set with as few ``dpkg`` runs as possible.
+        If a merged install fails, each set is installed on its own so that one
+        broken set cannot block the others. The outcome of each set is recorded
+        (see :py:meth:`record_failure`) for the instance which added it. This must
+        only be called while holding the lock.
+        """
+        for pending_sets in self.read_spool().values():
+            environment = pending_sets[0][1].get("environment")
+            binary_dirs = [pending["binary_dir"] for _, pending in pending_sets]
+            errors = {}
+            try:
+                self.dpkg_install(binary_dirs, environment)
+            except RuntimeError as exp:
+                if len(pending_sets) == 1:
+                    errors[pending_sets[0][0]] = str(exp)
+                else:
+                    print("Merged install failed, installing each set separately")
+                    for spool_file, pending in pending_sets:
+                        try:
+                            self.dpkg_install([pending["binary_dir"]], environment)
+                        except RuntimeError as exp:
+                            errors[spool_file] = str(exp)
+
+            for spool_file, pending in pending_sets:
+                if spool_file in errors:
+                    print(errors[spool_file])
+                    self.record_failure(pending["touch_location"], errors[spool_file])
+                else:
+                    self.touch(pending["touch_location"])
+                os.remove(spool_file)
+
+    def check_installed(self):
+        """
+        Check that the package set of this instance was installed.
+
+        Raises:
+            RuntimeError: With the recorded ``dpkg`` error, if the package set of
+                this instance could not be installed.
+        """
+        if os.path.exists(self.touch_location):
+            return
+        error = "%s was not installed" % self.package_name
+        if os.path.exists(self.failed_location):
+            with open(self.failed_location, "r") as f_hand:
+                error = f_hand.read().strip() or error
+        raise RuntimeError(error)
+
+    def record_failure(self, touch_location, error):
+        """
+        Record that a package set could not be installed, so that the instance
+        which added it can report the error.
+
+        Arguments:
+            touch_location (str): The file which would indicate the install is done.
+            error (str): The error message.
+        """
+        failed_location = "%s.failed" % touch_location
+        with open(failed_location + ".tmp", "w") as f_hand:
+            f_hand.write(error + "\n")
+        os.rename(failed_location + ".tmp", failed_location)
+
+    def wait_for_dpkg(self):
+        """
+        Block (without polling) until no other process is using dpkg, i.e. until
+        dpkg's locks are released. The frontend lock is then held while ``dpkg``
+        runs (``dpkg`` is told so with ``DPKG_FRONTEND_LOCKED``), so that apt cannot
+        start in between.
+
+        Returns:
+            file: The open frontend lock, which must be closed to release it (or
+            :py:data:`None` if this version of dpkg has no frontend lock).
+        """
+        frontend = None
+        if os.path.exists(self.dpkg_frontend_lock):
             # pylint: disable=consider-using-with
-            dpkg = Popen(
-                ["dpkg", "-R", "--force-depends", "-i", binary_dir],
-                stdout=PIPE,
-                stderr=PIPE,
-                env=env,
-            )
-            output = dpkg.communicate()
-            if dpkg.returncode != 0:
-                # Output is a tuple (<stdout>, <stderr>)
-                print(output[1])
-            else:
-                break
-            time.sleep(1)
+            frontend = open(self.dpkg_frontend_lock, "a")
+            fcntl.lockf(frontend, fcntl.LOCK_EX)
+        if os.path.exists(self.dpkg_lock):
+            # dpkg takes this lock itself, so it is released straight away
+            with open(self.dpkg_lock, "a") as lock:
+                fcntl.lockf(lock, fcntl.LOCK_EX)
+        return frontend
 
-        # Release the file-system dpkg lock
-        os.rmdir(self.dpkg_lock)
+    def dpkg_install(self, binary_dirs, environment=None):
+        """
+        Install all packages in the given directories with a single ``dpkg``
+        command. If dpkg is locked by another process, the command is retried
+        until it is not. Other failures are retried a bounded number of times.
 
-        print("touching")
-        # touch a file to indicate that the install is done
-        # pylint: disable=consider-using-with
-        touch = Popen(["touch", self.touch_location], stdout=PIPE, stderr=PIPE)
+        Arguments:
+            binary_dirs (list): Directories containing ``.deb`` files.
+            environment (dict): Additional environment variables for ``dpkg``.
+
+        Raises:
+            RuntimeError: If ``dpkg`` still fails after ``max_retries`` retries.
+        """
+        env = dict(os.environ)
+        if environment:
+            env.update(environment)
+
+        print("Installing packages from: %s" % ", ".join(binary_dirs))
+        delay = 1
+        attempt = 0
+        while True:
+            frontend = self.wait_for_dpkg()
+            run_env = env
+            if frontend is not None:
+                run_env = dict(env, DPKG_FRONTEND_LOCKED="1")
+            try:
+                # pylint: disable=consider-using-with
+                dpkg = Popen(
+                    ["dpkg", "-R", "--force-depends", "-i"] + binary_dirs,
+                    stdout=PIPE,
+                    stderr=PIPE,
+                    env=run_env,
+                )
+                output = dpkg.communicate()
+            finally:
+                if frontend is not None:
+                    frontend.close()
+            if dpkg.returncode == 0:
+                return
 
-        output = touch.communicate()
-        if touch.returncode != 0:
             # Output is a tuple (<stdout>, <stderr>)
-            print(output[1])
+            error = output[1].decode("utf-8", "replace")
+            print(error)
+            if "locked by another process" in error:
+                # Another process took the lock before dpkg did
+                self.retries += 1
+                print("dpkg is locked by another process, retrying")
+                time.sleep(1)
+                continue
+            if attempt >= self.max_retries:
+                break
+            attempt += 1
+            self.retries += 1
+            print("dpkg failed, retrying in %d seconds" % delay)
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+        raise RuntimeError(
+            "dpkg failed to install %s after %d retries"
+            % (", ".join(binary_dirs), self.max_retries)
+        )
+
+    def touch(self, path):
+        """
+        Create an empty file to indicate that an install is done.
+
+        Arguments:
+            path (str): The file to create.
+        """
+        print("touching %s" % path)
+        with open(path, "a"):
+            os.utime(path, None)
 
 
 if __name__ == "__main__":
-    install = InstallDebs(sys.argv[1], sys.argv[2])
-    install.run()
+    START = time.time()
+    EXIT_CODE = 1
+    install = None
+    try:
+        install = InstallDebs(sys.argv[1], sys.argv[2])
+        install.run()
+        EXIT_CODE = 0
+    finally:
+        record_timing(START, EXIT_CODE, getattr(install, "retries", 0))
@@ -1,33 +1,85 @@
- #!/bin/bash
+#!/bin/bash
+
+# Record the execution time of this VM resource (see vm_timing.sh)
+. "$(dirname "$0")/vm_timing.sh"
 
 BINARY=$2
 
 echo "Handling binary package: ${BINARY}"
 
+# The installed version of each package (e.g. INSTALLED[htop]=2.1.0-3), read with
+# a single dpkg-query call
+declare -A INSTALLED
+load_installed_versions () {
+    local name version status
+    while IFS=$'\t' read -r name version status
+    do
+        if [ "$status" == "install ok installed" ]; then
+            INSTALLED[$name]=$version
+        fi
+    done < <(dpkg-query -W -f='${Package}\t${Version}\t${Status}\n' 2>/dev/null)
+}
+
+# Print the packages which are not yet installed (at the same version).
+filter_installed_packages () {
+    local deb name version
+    for deb in "$@"
+    do
+        IFS=$'\t' read -r name version < <(dpkg-deb --show --showformat='${Package}\t${Version}\n' "$deb")
+        if [ -n "$name" ] && [ "${INSTALLED[$name]}" == "$version" ]; then
+            >&2 echo "Skipping $deb: $name $version is already installed"
+            continue
+        fi
+        echo "$deb"
+    done
+}
+
 install_debian_packages () {
     SINGLE=$1
+    load_installed_versions
     if [ ! -z "$SINGLE" ]; then
-        PACKAGES=$SINGLE
+        PACKAGES=$(filter_installed_packages $SINGLE)
     fi
     if [ -z "$SINGLE" ]; then
-        PACKAGES=$(find . -name '*.deb')
+        PACKAGES=$(filter_installed_packages $(find . -name '*.deb'))
+    fi
+
+    if [ -z "$PACKAGES" ]; then
+        echo "All packages are already installed"
+        return
     fi
 
     until dpkg -i --force-depends $PACKAGES
     do
+        RETRIES=$((RETRIES + 1))
         sleep 1
         echo "DPKG FAILING: Sleeping and trying again"
     done
 }
 
-# Check to see if it is a single debian package
-if [ ! -z "$(file $BINARY | grep 'Debian binary package')" ]; then
+# The older versions of file (e.g. on Ubuntu 14.04 and 16.04) do not recognize
+# Zstandard archives, so they are identified by their magic number
+MAGIC=$(head -c 4 "$BINARY" | od -An -tx1 | tr -d ' \n')
+TYPE=$(file "$BINARY")
+
+if grep -q 'Debian binary package' <<< "$TYPE"; then
     # Install the single deb
     install_debian_packages $BINARY
-fi
-
-# Check if the binary data is a compressed directory of debian packages
-if [ ! -z "$(file $BINARY | grep -i 'compressed data')" ]; then
+elif [ "$MAGIC" == "28b52ffd" ]; then
+    # Older versions of tar cannot decompress zstd archives themselves
+    if ! command -v zstd > /dev/null; then
+        >&2 echo "zstd is required to unpack $BINARY"
+        exit 1
+    fi
+    zstd -dc $BINARY | tar x
+    install_debian_packages
+elif grep -qi 'gzip compressed data' <<< "$TYPE" && command -v pigz > /dev/null; then
+    tar -I pigz -xf $BINARY
+    install_debian_packages
+elif grep -qiE 'compressed data|tar archive' <<< "$TYPE"; then
     tar xf $BINARY
     install_debian_packages
+else
+    >&2 echo "Unable to install $BINARY: not a debian package or an archive of them ($TYPE)"
+    exit 1
 fi
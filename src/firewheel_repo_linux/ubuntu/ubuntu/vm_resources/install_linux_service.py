@@ -2,11 +2,30 @@
 
 import os
 import sys
+import time
 import pickle
+import shutil
 import tarfile
 import tempfile
 import subprocess
 
+from vm_timing import record_timing
+
+
+def to_bytes(content):
+    """
+    Encode the content of a file (if needed) so that it can be compared and written.
+
+    Arguments:
+        content (str): The content of the file.
+
+    Returns:
+        bytes: The encoded content.
+    """
+    if isinstance(content, bytes):
+        return content
+    return content.encode("utf-8")
+
 
 # pylint: disable=useless-object-inheritance
 class InstallLinuxService(object):
@@ -15,13 +34,27 @@ class InstallLinuxService(object):
     The agent then installs all of those files (similar to ``install_debs.py``.
     It is important to note that if any of the deb files need user interaction,
     this agent will fail. Any services that need user interaction (mysql, postfix,
-    etc) should have their own VMR. Additionally, this agent will move a configuration file
-    into place and restart the service.
+    etc) should have their own VMR. Additionally, this agent will move configuration
+    files into place and restart the service(s).
+
+    The agent only does the work which is needed, so that running it again (e.g.
+    to update the configuration of a service) is cheap:
+
+    - Packages which are already installed (at the same version) are skipped.
+    - Configuration files are only written if their content changed. Each file is
+      written to a temporary file in the same directory and renamed into place, so
+      the service never sees a partially written file. The previous file is kept
+      with an ``_old`` suffix.
+    - A service is only restarted (or reloaded) if one of its files changed.
+
+    Note:
+        This uses ``sudo service x restart`` (where ``x`` is the service) by default.
+        A service which supports it can be reloaded instead by setting its
+        ``service_action`` to ``"reload"``.
 
     Note:
-        This uses ``sudo service x restart`` (where ``x`` is the service). Therefore, if
-        another method of restarting (after configuration changes happen) a different
-        VMR should be created.
+        This VMR imports ``vm_timing.py``, so it must be scheduled with
+        ``LinuxHost.add_boot_vm_resource``, which loads the helper alongside it.
 
     """
 
@@ -38,6 +71,11 @@ class InstallLinuxService(object):
                 - ``conf_files`` - a dictionary of files/content that will be replaced.
                 - ``service_name`` - the name of the service that needs to be restarted
                     when the configuration changes.
+                It may also have ``service_action`` - the ``service`` command used
+                when the configuration changes (``"restart"``, the default, or
+                ``"reload"``). To configure several services at once, the dictionary
+                can instead have a ``services`` key with a list of dictionaries
+                containing these variables (one for each service).
                 If any of these variables are missing the VMR will exit, and assume
                 that the generated configuration file will be present.
             binary_file (str): The path to a tarball containing all of the debian packages
@@ -49,44 +87,62 @@ class InstallLinuxService(object):
     def run(self):
         """
         Run the agent: Extract the binary argument and install the debs it
-        contains.
+        contains. Then configure (and restart) the service(s).
+
+        Returns:
+            int: The exit code for this VMR.
         """
         tar_path = tempfile.mkdtemp()
-        self.untar_binary(self.tar_file, tar_path)
-        self.install_deb(tar_path)
+        try:
+            self.untar_binary(self.tar_file, tar_path)
+            self.install_deb(tar_path)
+        finally:
+            shutil.rmtree(tar_path, ignore_errors=True)
 
         # Check to see if there is a variables file
         if not self.variables_file or self.variables_file == "None":
             print("An ascii file was not provided")
-            sys.exit()
-        else:
-            # Make sure that the Pickle is formated correctly
-            try:
-                with open(self.variables_file, "r") as in_file:
-                    variables = pickle.load(in_file)
-            except (OSError, pickle.UnpicklingErrorException) as exp:
-                print(
-                    "An error occurred reading the variables file. "
-                    "Continuing without substitutions."
-                )
-                print(exp)
-                variables = {}
-
-        # If they user did not provide the needed information (as described in
-        # the agent documentation then use the default config file and exit.
-        if "conf_dir" not in variables or not variables["conf_dir"]:
-            print("Needs a configuration directory. (conf_dir)")
-        elif "conf_files" not in variables or not variables["conf_files"]:
+            return 0
+
+        # Make sure that the Pickle is formated correctly
+        try:
+            with open(self.variables_file, "rb") as in_file:
+                variables = pickle.load(in_file)
+        except (IOError, OSError, pickle.UnpicklingError) as exp:
             print(
-                "You did not provide any configuration files! (conf_files) Using the default."
-            )
-        elif "service_name" not in variables or not variables["service_name"]:
-            print("Needs the name of the service to restart. (service_name)")
-        else:
-            conf_dir = os.path.abspath(variables["conf_dir"])
-            self.make_confs(
-                variables["conf_files"], conf_dir, variables["service_name"]
+                "An error occurred reading the variables file. "
+                "Continuing without substitutions."
             )
+            print(exp)
+            variables = {}
+
+        services = variables.get("services")
+        if services is None:
+            services = [variables]
+
+        exit_code = 0
+        for service in services:
+            # If they user did not provide the needed information (as described in
+            # the agent documentation then use the default config file.
+            if "conf_dir" not in service or not service["conf_dir"]:
+                print("Needs a configuration directory. (conf_dir)")
+            elif "conf_files" not in service or not service["conf_files"]:
+                print(
+                    "You did not provide any configuration files! (conf_files) "
+                    "Using the default."
+                )
+            elif "service_name" not in service or not service["service_name"]:
+                print("Needs the name of the service to restart. (service_name)")
+            else:
+                conf_dir = os.path.abspath(service["conf_dir"])
+                if not self.make_confs(
+                    service["conf_files"],
+                    conf_dir,
+                    service["service_name"],
+                    service.get("service_action") or "restart",
+                ):
+                    exit_code = 1
+        return exit_code
 
     def untar_binary(self, tar_file, tar_path):
         """
@@ -100,47 +156,169 @@ class InstallLinuxService(object):
         with tarfile.open(tar_file) as tar:
             tar.extractall(path=tar_path)
 
+    def installed_versions(self, packages):
+        """
+        Get the installed versions of the given packages (with a single query).
+
+        Arguments:
+            packages (list): The names of the packages.
+
+        Returns:
+            dict: The installed version(s) of each installed package.
+        """
+        # pylint: disable=consider-using-with
+        query = subprocess.Popen(
+            ["dpkg-query", "-W", "-f", "${Package}\t${Version}\t${Status}\n"]
+            + sorted(set(packages)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        # Unknown packages are reported on stderr (and with a non-zero exit code)
+        output = query.communicate()[0].decode("utf-8", "replace")
+        installed = {}
+        for line in output.splitlines():
+            fields = line.split("\t")
+            if len(fields) == 3 and fields[2].endswith(" installed"):
+                installed.setdefault(fields[0], set()).add(fields[1])
+        return installed
+
+    def deb_info(self, deb_path):
+        """
+        Get the name and version of a debian package.
+
+        These are read from the package's control fields (rather than its file
+        name, which may have been renamed or omit the epoch of the version), so
+        they can be compared with those reported by ``dpkg-query``.
+
+        Arguments:
+            deb_path (str): The path of the ``.deb`` file.
+
+        Returns:
+            tuple: The name and version of the package, or :py:data:`None` if they
+            could not be found.
+        """
+        output = self.popen(
+            ["dpkg-deb", "--show", "--showformat=${Package}\t${Version}", deb_path]
+        )
+        if not output:
+            return None
+        fields = output.decode("utf-8", "replace").strip().split("\t")
+        if len(fields) != 2 or not all(fields):
+            return None
+        return fields[0], fields[1]
+
     def install_deb(self, setup_location):
         """
-        Install all debian files in a given directory.
+        Install all debian files in a given directory, skipping the packages which
+        are already installed at the same version.
 
         Arguments:
             setup_location (str): A directory containing debian files to install.
         """
+        debs = {}
+        for root, _dirs, files in os.walk(setup_location):
+            for name in files:
+                if name.endswith(".deb"):
+                    deb_path = os.path.join(root, name)
+                    debs[deb_path] = self.deb_info(deb_path)
+
+        installed = self.installed_versions(info[0] for info in debs.values() if info)
+        pending = sorted(
+            deb_path
+            for deb_path, info in debs.items()
+            if not info or info[1] not in installed.get(info[0], ())
+        )
+        if not pending:
+            print("All packages are already installed")
+            return
+
         # Install deb packages
-        cmd = ["sudo", "dpkg", "-i", "-R", setup_location]
-        self.popen(cmd)
+        cmd = ["sudo", "dpkg", "-i"] + pending
+        if self.popen(cmd) is None:
+            # Resolve any missing dependencies
+            cmd = ["sudo", "apt-get", "-f", "-y", "install"]
+            self.popen(cmd)
+
+    def write_conf(self, conf, content):
+        """
+        Atomically write a configuration file, if its content changed. The previous
+        file is kept with an ``_old`` suffix.
 
-        cmd = ["sudo", "apt-get", "-f", "install"]
-        self.popen(cmd)
+        Arguments:
+            conf (str): The path of the configuration file.
+            content (bytes): The new configuration.
 
-    def make_confs(self, files, conf_dir, service_name):
+        Returns:
+            bool: :py:data:`True` if the file was written.
+        """
+        old_content = None
+        if os.path.exists(conf):
+            with open(conf, "rb") as old_file:
+                old_content = old_file.read()
+            if old_content == content:
+                return False
+
+        conf_dir = os.path.dirname(conf)
+        if not os.path.isdir(conf_dir):
+            os.makedirs(conf_dir)
+
+        # Write the new configuration next to the file and rename it into place
+        tmp_fd, tmp_path = tempfile.mkstemp(
+            prefix=".%s." % os.path.basename(conf), dir=conf_dir
+        )
+        try:
+            with os.fdopen(tmp_fd, "wb") as new_file:
+                new_file.write(content)
+                new_file.flush()
+                os.fsync(new_file.fileno())
+            if old_content is None:
+                os.chmod(tmp_path, int("0644", 8))
+            else:
+                # Keep the ownership and permissions of the generated config
+                stat = os.stat(conf)
+                for path in (tmp_path, "%s_old" % conf):
+                    if path != tmp_path:
+                        with open(path, "wb") as backup:
+                            backup.write(old_content)
+                    os.chmod(path, stat.st_mode & int("07777", 8))
+                    os.chown(path, stat.st_uid, stat.st_gid)
+            os.rename(tmp_path, conf)
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return True
+
+    def make_confs(self, files, conf_dir, service_name, service_action="restart"):
         """
         If configuration files are provided by the user the old file is
-        moved and the new file is written to disk. Then the services is
-        restarted restarted.
+        moved and the new file is written to disk. Then the service is
+        restarted, if any of its files changed.
 
         Arguments:
             files (dict): A dictionary keyed on the filename with the value being the
                 new configuration.
             conf_dir (str): Where the configuration files are located
             service_name (str): The name of the service that needs to be restarted
-        """
-        for f in files:
-            conf = os.path.join(conf_dir, f)
-            old_conf = os.path.join(conf_dir, "%s_old" % f)
+            service_action (str): The ``service`` command which applies the new
+                configuration (e.g. ``"restart"`` or ``"reload"``).
 
-            # Move the generated config
-            cmd = ["sudo", "mv", conf, old_conf]
-            self.popen(cmd)
+        Returns:
+            bool: :py:data:`True` if the service was configured successfully.
+        """
+        changed = []
+        for f in sorted(files):
+            if self.write_conf(os.path.join(conf_dir, f), to_bytes(files[f])):
+                changed.append(f)
 
-            # Write the new configuration
-            with open(conf, "w") as new_file:
-                new_file.write(files[f])
+        if not changed:
+            print("The configuration of %s is unchanged" % service_name)
+            return True
 
-        # Reload the service
-        cmd = ["sudo", "service", service_name, "restart"]
-        self.popen(cmd)
+        print("Updated %s of %s" % (", ".join(changed), service_name))
+        # Apply the new configuration
+        cmd = ["sudo", "service", service_name, service_action]
+        return self.popen(cmd) is not None
 
     def popen(self, cmd):
         """
@@ -164,6 +342,7 @@ class InstallLinuxService(object):
 
 # pylint: disable=invalid-name
 if __name__ == "__main__":
+    START = time.time()
     if len(sys.argv) >= 3:
         ascii_arg = sys.argv[1]
         binary_arg = sys.argv[2]
@@ -173,7 +352,13 @@ if __name__ == "__main__":
 
     if not binary_arg or binary_arg == "None":
         print("Must have a binary file")
+        record_timing(START, 1)
         sys.exit(1)
 
-    agent = InstallLinuxService(ascii_arg, binary_arg)
-    agent.run()
+    EXIT_CODE = 1
+    try:
+        agent = InstallLinuxService(ascii_arg, binary_arg)
+        EXIT_CODE = agent.run()
+    finally:
+        record_timing(START, EXIT_CODE)
+    sys.exit(EXIT_CODE)
@@ -2,17 +2,23 @@
 
 # Reference: https://gist.github.com/noromanba/6e062d38fd7fd2cd609a6ef1c26ea7bc
 # Accessed January 18, 2018
-echo "Disabling apt-daily.service and apt-daily.timer"
-systemctl stop apt-daily.service
-systemctl stop apt-daily.timer
-systemctl disable apt-daily.timer
-systemctl mask apt-daily.service
-systemctl daemon-reload
 
-echo "Checking apt-daily status"
-systemctl status apt-daily.service
-systemctl status apt-daily.timer
+# Record the execution time of this VM resource (see vm_timing.sh)
+. "$(dirname "$0")/vm_timing.sh"
+
+# The units which run apt (and unattended-upgrade) in the background
+UNITS="apt-daily.timer apt-daily.service apt-daily-upgrade.timer apt-daily-upgrade.service"
+
+if command -v systemctl > /dev/null; then
+    echo "Masking and stopping: ${UNITS}"
+    # Masking (which reloads systemd once) prevents the timers from starting the
+    # services again, then all of the units are stopped in a single transaction
+    systemctl mask $UNITS
+    systemctl stop $UNITS
+fi
 
 echo "Killing running apt processes"
-pkill -f -9 '/apt/apt.systemd' -e
-pkill -f -9 '/usr/bin/unattended-upgrade' -e
+pkill -9 -f -e '/apt/apt.systemd|/usr/bin/unattended-upgrade'
+
+# Whether or not anything was running, apt is now disabled
+exit 0
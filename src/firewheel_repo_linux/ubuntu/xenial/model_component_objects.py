@@ -1,8 +1,24 @@
+from pathlib import Path
+
 from linux.ubuntu import UbuntuHost, UbuntuServer, UbuntuDesktop
+from linux.base_objects import find_baked_image, graph_build_profiler
 
 from firewheel.control.experiment_graph import require_class
 
+IMAGES_DIR = Path(__file__).resolve().parent / "images"
+
+# The setup steps which the pre-baked images contain (see ``bake_images`` in
+# INSTALL/vars.yml)
+BAKED_STEPS = (
+    "stop_apt_daily",
+    "root_profiles",
+    "default_profiles",
+    "install_debs.htop-1_0_2_debs.tgz",
+    "install_debs.pssh_2.3.1-1_all_debs.tgz",
+)
+
 
+@graph_build_profiler.profile_class
 @require_class(UbuntuHost)
 class Ubuntu1604Host:
     """
@@ -13,6 +29,7 @@ class Ubuntu1604Host:
         """This abstraction is not needed"""
 
 
+@graph_build_profiler.profile_class
 @require_class(Ubuntu1604Host)
 @require_class(UbuntuServer)
 class Ubuntu1604Server:
@@ -20,6 +37,15 @@ class Ubuntu1604Server:
     The Model Component for the Ubuntu1604Server image.
     """
 
+    # The pre-baked version of the image, if it has been built
+    # (see linux.base_objects.find_baked_image)
+    baked_image = find_baked_image(
+        IMAGES_DIR,
+        "ubuntu-16.04.4-server-amd64.qcow2.xz",
+        "ubuntu-16.04.4-server-amd64.qcow2",
+        BAKED_STEPS,
+    )
+
     def __init__(self):
         """
         Setting all of the required parameters for a new image
@@ -50,6 +76,7 @@ class Ubuntu1604Server:
         self.set_image("ubuntu1604server")
 
 
+@graph_build_profiler.profile_class
 @require_class(Ubuntu1604Host)
 @require_class(UbuntuDesktop)
 class Ubuntu1604Desktop:
@@ -57,6 +84,15 @@ class Ubuntu1604Desktop:
     The Model Component for the Ubuntu1604Desktop image.
     """
 
+    # The pre-baked version of the image, if it has been built
+    # (see linux.base_objects.find_baked_image)
+    baked_image = find_baked_image(
+        IMAGES_DIR,
+        "ubuntu-16.04.4-desktop-amd64.qcow2.xz",
+        "ubuntu-16.04.4-desktop-amd64.qcow2",
+        BAKED_STEPS,
+    )
+
     def __init__(self):
         """
         Setting all of the required parameters for a new image